@@ -3,11 +3,11 @@
 Script to add a test user to the S3 authentication system
 """
 
-import boto3
 import json
 import os
 from datetime import datetime
 from dotenv import load_dotenv
+from utils.aws_clients import get_s3_client
 
 # Load environment variables
 load_dotenv()
@@ -31,7 +31,7 @@ def add_test_user():
     
     try:
         # Initialize S3 client
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         
         # Check if auth file exists
         try:
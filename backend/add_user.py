@@ -5,15 +5,16 @@ Usage: python add_user.py <ads_id> <password> [role]
 """
 
 import json
-import boto3
 import sys
 from datetime import datetime
-from config import S3_BUCKET
+from config import S3_BUCKET, USERS_CACHE_TTL
+from utils.aws_clients import get_s3_client
+from services.user_directory import save_allowed_users
 
 def add_user_to_s3(ads_id: str, password: str, role: str = "user"):
     """Add a new user to the S3 auth file"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         
         # Try to get existing users
         try:
@@ -40,16 +41,12 @@ def add_user_to_s3(ads_id: str, password: str, role: str = "user"):
         users_data["users"].append(new_user)
         
         # Upload updated file to S3
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key='auth/allowed_users.json',
-            Body=json.dumps(users_data, indent=2),
-            ContentType='application/json'
-        )
+        save_allowed_users(users_data["users"])
         
         print(f"Successfully added user with ADS ID: {ads_id}")
         print(f"Role: {role}")
         print(f"Created at: {new_user['created_at']}")
+        print(f"Running API workers pick up the change within {USERS_CACHE_TTL} seconds")
         return True
         
     except Exception as e:
@@ -59,7 +56,7 @@ def add_user_to_s3(ads_id: str, password: str, role: str = "user"):
 def list_users():
     """List all users in the S3 auth file"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         response = s3_client.get_object(Bucket=S3_BUCKET, Key='auth/allowed_users.json')
         users_data = json.loads(response['Body'].read().decode('utf-8'))
         
@@ -1,9 +1,15 @@
-from utils.llm_utils import call_llm
+import json
+from utils.llm_utils import call_llm_json
+from utils.bpmn_compiler import validate_template
 
-def generate_bpmn_template(sop_content):
+# Bump when the prompt changes so cached responses are not reused
+PROMPT_VERSION = "2"
+
+def generate_bpmn_template(sop_content, bypass_cache=False, on_delta=None):
     """
     Agent 1: BPMN Template Generator
     Extracts high-level process structure and converts it into a BPMN process template.
+    Returns the template as a JSON string.
     """
     prompt = f"""
 You are a BPMN Process Designer Agent. You are given an SOP text extracted from a document. Your task is to extract a high-level process structure and convert it into a BPMN process template.
@@ -16,19 +22,26 @@ Analyze the content and identify:
 - Special conditions (e.g., wait periods, triggers)
 - Swimlanes for responsibilities
 
-Output the process in a structured JSON format like:
+Respond with a single JSON object only, in this format:
 {{
   "start_event": "Start",
   "tasks": [
     {{"id": "Task_1", "name": "Receive Application", "actor": "Customer Support"}},
-    {{"id": "Gateway_1", "type": "exclusive", "name": "Is Application Complete?"}},
-    {{"id": "Task_2", "name": "Request Additional Documents", "actor": "Customer Support"}}
+    {{"id": "Gateway_1", "type": "exclusive", "name": "Is Application Complete?", "next": [{{"to": "Task_3", "label": "Yes"}}, {{"to": "Task_2", "label": "No"}}]}},
+    {{"id": "Task_2", "name": "Request Additional Documents", "actor": "Customer Support", "next": "Task_1"}},
+    {{"id": "Task_3", "name": "Approve Application", "actor": "Compliance Team"}}
   ],
   "end_event": "Application Accepted",
   "swimlanes": ["Customer Support", "Compliance Team"]
 }}
 
+A step without "next" continues with the following step in the list; use "next" (a step id, or a list of {{"to", "label"}} branches) for gateways, loops and jumps, and "end" for the end event. The "type" of a step is one of user, service, manual, exclusive, parallel, inclusive or timer.
+
 SOP Text:
 {sop_content}
 """
-    return call_llm(prompt) 
\ No newline at end of file
+    template = call_llm_json(
+        prompt, agent="bpmn_template_generator", prompt_version=PROMPT_VERSION,
+        bypass_cache=bypass_cache, on_delta=on_delta, validate=validate_template
+    )
+    return json.dumps(template, indent=2) 
\ No newline at end of file
@@ -1,9 +1,21 @@
-from utils.llm_utils import call_llm
+import json
+from utils.llm_utils import call_llm_json
+from utils.bpmn_compiler import validate_template
 
-def refine_bpmn_template(sop_content, bpmn_template):
+PROMPT_VERSION = "2"
+
+def _validate_refined(value):
+    """The refined template must compile and carry its change notes separately"""
+    validate_template(value)
+    changes = value.get("changes")
+    if not isinstance(changes, list) or not all(isinstance(change, dict) for change in changes):
+        raise ValueError("'changes' must be a list of {\"change\", \"reason\"} objects")
+
+def refine_bpmn_template(sop_content, bpmn_template, bypass_cache=False, on_delta=None):
     """
     Agent 2: BPMN Template Refiner
     Checks and refines the BPMN template to ensure all critical steps are represented.
+    Returns the template as JSON, with the change notes in its "changes" field.
     """
     prompt = f"""
 You are a BPMN Process Refiner Agent. You will receive a proposed BPMN process (as JSON) and the original SOP text.
@@ -11,8 +23,10 @@ You are a BPMN Process Refiner Agent. You will receive a proposed BPMN process (
 Check if all critical steps from the SOP are represented.
 Fix incorrect flow sequences or missing elements (like approvals or exceptions).
 Ensure the swimlanes match the roles described in the SOP.
-Annotate special conditions such as escalation, retry loops, or timeouts.
-Return a corrected and enriched JSON template and clearly state what was changed or added with reasons.
+Annotate special conditions such as escalation, retry loops, or timeouts (as a "note" on the step, or in an "annotations" list of {{"text", "task"}}).
+Respond with a single JSON object only: the corrected and enriched template in the same format as the proposed one, plus a "changes" field listing what was changed or added and why:
+"changes": [{{"change": "Added a retry loop for incomplete applications", "reason": "The SOP allows resubmission"}}]
+Do not write any explanation outside the JSON object.
 
 SOP Text:
 {sop_content}
@@ -20,4 +34,8 @@ SOP Text:
 Proposed BPMN JSON:
 {bpmn_template}
 """
-    return call_llm(prompt) 
\ No newline at end of file
+    refined = call_llm_json(
+        prompt, agent="bpmn_template_refiner", prompt_version=PROMPT_VERSION,
+        bypass_cache=bypass_cache, on_delta=on_delta, validate=_validate_refined
+    )
+    return json.dumps(refined, indent=2) 
\ No newline at end of file
@@ -1,10 +1,27 @@
-from utils.llm_utils import call_llm, extract_xml_content
+from utils.llm_utils import call_llm, extract_xml_content, extract_json_content
+from utils.bpmn_layout import layout_bpmn
+from utils.bpmn_compiler import compile_bpmn_template, TemplateError
 
-def generate_bpmn_xml(refined_template):
+PROMPT_VERSION = "3"
+
+def generate_bpmn_xml(refined_template, bypass_cache=False, on_delta=None):
     """
     Agent 3: BPMN XML Generator
     Converts structured BPMN process in JSON format into valid BPMN 2.0 compliant XML.
+    Templates that match the compiler's schema are compiled locally; the LLM is
+    only called when the template cannot be parsed or compiled. It then only
+    writes the process model, and the diagram layout is computed locally.
     """
+    template = extract_json_content(refined_template, required_key="tasks")
+    if template is None:
+        print("[generate_bpmn_xml] No JSON template found, falling back to the LLM generator")
+    else:
+        try:
+            bpmn_xml = compile_bpmn_template(template)
+            print(f"[generate_bpmn_xml] Compiled the template locally ({len(template['tasks'])} tasks)")
+            return bpmn_xml
+        except TemplateError as e:
+            print(f"[generate_bpmn_xml] Template could not be compiled ({e}), falling back to the LLM generator")
     prompt = f"""
 You are a BPMN XML Generator Agent. Given a structured BPMN process in JSON format, convert it into a valid BPMN 2.0 compliant XML.
 
@@ -15,16 +32,17 @@ Ensure:
 - Correct sequence flows with sourceRef and targetRef
 - Proper lane and participant structure
 - BPMN namespaces and structure are intact
-- Add explicit <bpmn:dataObject> elements to represent business data (card info, identity info, refund amount, logs, receipt, etc.) or BPMN annotations to capture business rules, just ask. Also, I can provide a Camunda or other tooling compatible .bpmn file with correct diagram info on request.
+- Add explicit <bpmn:dataObject> elements to represent business data (card info, identity info, refund amount, logs, receipt, etc.) or BPMN annotations to capture business rules
 
 Important rules to ensure valid BPMN XML:
 1. All <bpmn:sequenceFlow> IDs **must be unique**. Do not reuse IDs for different flows.
 2. All sequence flow IDs referenced in <incoming> and <outgoing> **must be defined explicitly**.
 3. Avoid using <bpmn:ConditionExpression> (incorrect). Use:
    <bpmn:conditionExpression xsi:type="tFormalExpression">expression_here</bpmn:conditionExpression>
+4. Do NOT include a <bpmndi:BPMNDiagram> section or any coordinates. The diagram layout is generated automatically.
 
 BPMN JSON:
 {refined_template}
 """
-    bpmn_xml_raw = call_llm(prompt)
-    return extract_xml_content(bpmn_xml_raw) 
\ No newline at end of file
+    bpmn_xml_raw = call_llm(prompt, agent="bpmn_xml_generator", prompt_version=PROMPT_VERSION, bypass_cache=bypass_cache, on_delta=on_delta)
+    return layout_bpmn(extract_xml_content(bpmn_xml_raw)) 
\ No newline at end of file
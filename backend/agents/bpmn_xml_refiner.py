@@ -1,10 +1,25 @@
 from utils.llm_utils import call_llm, extract_xml_content
+from utils.bpmn_validator import repair_bpmn, format_issues
+from utils.bpmn_layout import strip_diagram
 
-def refine_bpmn_xml(bpmn_xml):
+PROMPT_VERSION = "3"
+
+def refine_bpmn_xml(bpmn_xml, bypass_cache=False, on_delta=None):
     """
     Agent 4: BPMN XML Refiner
     Corrects and improves BPMN XML before it's used for deployment or visualization.
+    Structural problems are repaired locally; the LLM is only called for the
+    problems the local pass cannot fix.
     """
+    bpmn_xml, fixes, problems = repair_bpmn(bpmn_xml)
+    if fixes:
+        print(f"[refine_bpmn_xml] Repaired {len(fixes)} structural issue(s) locally:\n{format_issues(fixes)}")
+    if not problems:
+        print("[refine_bpmn_xml] BPMN XML is valid, skipping the LLM refiner")
+        return bpmn_xml
+    print(f"[refine_bpmn_xml] {len(problems)} issue(s) need the LLM refiner:\n{format_issues(problems)}")
+    # The LLM only sees the process model; the layout is regenerated from its output
+    bpmn_xml = strip_diagram(bpmn_xml)
     prompt = f"""
 You are a **BPMN XML Refiner Agent**. You are given a **BPMN 2.0 XML string**, and your task is to correct and improve it before it's used for deployment or visualization.
 
@@ -19,15 +34,11 @@ IMPORTANT: Return ONLY the BPMN XML content starting with <?xml and ending with
   - Orphaned flows or elements not used in the diagram
   - Empty or unused labels or definitions
 -  **Fix issues** such as:
-  - Broken or disconnected `bpmndi:BPMNEdge` / `BPMNShape` references
-  - Missing layout tags for visual rendering
   - Inconsistent IDs or invalid namespace usage
 -  **Add helpful metadata**, such as:
   - `<documentation>` tags for process clarity
   - Human-readable labels on events and tasks
--  **Optimize the layout**:
-  - Ensure coordinates (`x`, `y`) of diagram shapes are spaced cleanly
-  - Avoid overlaps and improve alignment for clear BPMN viewer rendering
+-  **Do NOT include** a `bpmndi:BPMNDiagram` section or any coordinates. The diagram layout is generated automatically.
 - **Ensure compatibility** with tools like:
   - Camunda Modeler
   - bpmn.io
@@ -36,8 +47,15 @@ IMPORTANT: Return ONLY the BPMN XML content starting with <?xml and ending with
  **Output**:
 - A cleaned-up, fully valid **BPMN 2.0 XML string** ready for deployment or visualization
 
+### Problems found by validation (fix these first):
+{format_issues(problems)}
+
 BPMN XML:
 {bpmn_xml}
 """
-    final_bpmn_xml_raw = call_llm(prompt)
-    return extract_xml_content(final_bpmn_xml_raw) 
\ No newline at end of file
+    final_bpmn_xml_raw = call_llm(prompt, agent="bpmn_xml_refiner", prompt_version=PROMPT_VERSION, bypass_cache=bypass_cache, on_delta=on_delta)
+    # The LLM's output gets the same mechanical repairs, including a fresh layout
+    final_bpmn_xml, _, remaining = repair_bpmn(extract_xml_content(final_bpmn_xml_raw))
+    if remaining:
+        print(f"[refine_bpmn_xml] Issues left after the LLM refiner:\n{format_issues(remaining)}")
+    return final_bpmn_xml 
\ No newline at end of file
@@ -1,9 +1,11 @@
 from utils.llm_utils import call_llm
 
-def generate_summary(sop_content):
+PROMPT_VERSION = "1"
+
+def generate_summary(sop_content, bypass_cache=False, on_delta=None):
     """
     Agent 5: Summary Agent
     Generates a summary of the SOP content.
     """
     summary_prompt = f"Summarize the following SOP:\n{sop_content}\n\nSummary:"
-    return call_llm(summary_prompt) 
\ No newline at end of file
+    return call_llm(summary_prompt, agent="summary_agent", prompt_version=PROMPT_VERSION, bypass_cache=bypass_cache, on_delta=on_delta) 
\ No newline at end of file
@@ -0,0 +1,55 @@
+"""
+Per-request latency of S3 reads against moto's in-process S3: a new
+boto3.client('s3') per request (the old main.py pattern) versus the shared
+pooled client from utils/aws_clients.py, and an allowed-users lookup through
+the services/user_directory.py cache.
+
+    python benchmarks/bench_aws_clients.py [requests]
+
+Requires moto (pip install "moto[s3]").
+"""
+import os
+import sys
+import json
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ["AWS_S3_BUCKET"] = "bench-bucket"
+
+import boto3
+from moto import mock_aws
+
+def timed(label, requests, fn):
+    start = time.perf_counter()
+    for _ in range(requests):
+        fn()
+    elapsed = (time.perf_counter() - start) / requests
+    print(f"{label:44} {elapsed * 1000:8.3f} ms/request")
+
+def main(requests=200):
+    with mock_aws():
+        from utils.aws_clients import get_s3_client
+        from services.user_directory import USERS_KEY, get_user
+        bucket = os.environ["AWS_S3_BUCKET"]
+        shared = get_s3_client()
+        shared.create_bucket(Bucket=bucket)
+        users = [{"ads_id": f"user{i}", "role": "user"} for i in range(500)]
+        shared.put_object(Bucket=bucket, Key=USERS_KEY, Body=json.dumps({"users": users}))
+
+        def per_request_client():
+            s3 = boto3.client("s3")
+            json.loads(s3.get_object(Bucket=bucket, Key=USERS_KEY)["Body"].read())
+
+        def shared_client():
+            json.loads(shared.get_object(Bucket=bucket, Key=USERS_KEY)["Body"].read())
+
+        timed("new client + GET users file", requests, per_request_client)
+        timed("shared client + GET users file", requests, shared_client)
+        timed("cached user lookup (user_directory)", requests, lambda: get_user("user250"))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,27 @@
+"""
+Time repair_bpmn over the test corpus (backend/tests/fixtures/bpmn).
+
+    python benchmarks/bench_bpmn_validator.py [iterations]
+"""
+import os
+import sys
+import glob
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from utils.bpmn_validator import repair_bpmn
+
+def main(iterations=200):
+    for path in sorted(glob.glob(os.path.join(BACKEND, "tests", "fixtures", "bpmn", "*.bpmn"))):
+        with open(path) as f:
+            source = f.read()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            _, fixes, problems = repair_bpmn(source)
+        elapsed = (time.perf_counter() - start) / iterations
+        print(f"{os.path.basename(path):32} {elapsed * 1000:7.3f} ms/doc  {len(fixes)} fixes, {len(problems)} problems")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
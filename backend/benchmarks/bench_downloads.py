@@ -0,0 +1,100 @@
+"""
+Memory and latency of a large BPMN download against moto's in-process S3:
+the old path (download to /tmp, read it all, watermark with a regex, write it
+back and serve the file) versus stream_s3_object's on-the-fly transform.
+moto returns each object body from memory, so both peaks include moto's own
+copy of the object (roughly its size).
+
+    python benchmarks/bench_downloads.py [size_mb]
+
+Requires moto (pip install "moto[s3]").
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ["AWS_S3_BUCKET"] = "bench-bucket"
+
+from moto import mock_aws
+
+KEY = "results/uploads/large.pdf/final_bpmn_xml.bpmn"
+
+class Request:
+    headers = {}
+
+def make_bpmn(size_mb):
+    task = b'    <bpmn:task id="Task_%d" name="Step %d"/>\n'
+    body = bytearray(b'<?xml version="1.0" encoding="UTF-8"?>\n<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL" id="D">\n')
+    n = 0
+    while len(body) < size_mb * 1024 * 1024:
+        body += task % (n, n)
+        n += 1
+    return bytes(body + b"</bpmn:definitions>\n")
+
+def old_download(s3, bucket):
+    """The per-request path main.py used before downloads were streamed"""
+    path = os.path.join(tempfile.gettempdir(), "bench_download.bpmn")
+    s3.download_file(bucket, KEY, path)
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    watermark = f"\n    <!-- Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} -->\n"
+    content = re.sub(r'(<bpmn:definitions[^>]*>)', lambda m: m.group(1) + watermark, content, count=1)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    first_byte, sent = None, 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            first_byte = first_byte or time.perf_counter()
+            sent += len(chunk)
+    os.remove(path)
+    return first_byte, sent
+
+def streamed_download(bucket):
+    from services.downloads import stream_s3_object
+    response = stream_s3_object(Request(), bucket, KEY, "large.bpmn", watermark_bpmn=True)
+    async def consume():
+        first_byte, sent = None, 0
+        async for chunk in response.body_iterator:
+            first_byte = first_byte or time.perf_counter()
+            sent += len(chunk)
+        return first_byte, sent
+    return asyncio.run(consume())
+
+def measure(label, fn, runs=3):
+    fn()  # warm-up: imports, thread pool, connection
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        first_byte, sent = fn()
+        timings.append((time.perf_counter() - start, first_byte - start))
+    total, first = min(timings)
+    # Peak memory is measured on a separate run, since tracing slows everything down
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:10} total {total:6.3f}s  first byte {first:6.3f}s  "
+          f"peak Python memory {peak / 1e6:7.1f} MB  ({sent / 1e6:.1f} MB sent)")
+
+def main(size_mb=50):
+    with mock_aws():
+        from utils.aws_clients import get_s3_client
+        s3 = get_s3_client()
+        bucket = os.environ["AWS_S3_BUCKET"]
+        s3.create_bucket(Bucket=bucket)
+        s3.put_object(Bucket=bucket, Key=KEY, Body=make_bpmn(size_mb))
+        measure("old", lambda: old_download(s3, bucket))
+        measure("streamed", lambda: streamed_download(bucket))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
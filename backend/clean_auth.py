@@ -4,13 +4,14 @@ Utility script to clean up the S3 authentication file.
 """
 
 import json
-import boto3
 from config import S3_BUCKET
+from utils.aws_clients import get_s3_client
+from services.user_directory import save_allowed_users
 
 def clean_auth_file():
     """Clean up the auth file by removing invalid entries"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         
         # Get current users
         response = s3_client.get_object(Bucket=S3_BUCKET, Key='auth/allowed_users.json')
@@ -22,16 +23,8 @@ def clean_auth_file():
             if user.get("ads_id") is not None and user.get("ads_id") != "None":
                 valid_users.append(user)
         
-        # Create cleaned data
-        cleaned_data = {"users": valid_users}
-        
         # Upload cleaned file to S3
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key='auth/allowed_users.json',
-            Body=json.dumps(cleaned_data, indent=2),
-            ContentType='application/json'
-        )
+        save_allowed_users(valid_users)
         
         print(f"Cleaned auth file. Removed {len(users_data['users']) - len(valid_users)} invalid entries.")
         print(f"Remaining users: {len(valid_users)}")
@@ -1,5 +1,4 @@
 import os
-import json
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -11,22 +10,117 @@ load_dotenv()
 # AWS Configuration
 S3_BUCKET = os.getenv("AWS_S3_BUCKET")
 AWS_DEFAULT_REGION = os.getenv('AWS_DEFAULT_REGION')
+# Optional S3-compatible endpoint (e.g. a local test server)
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
+# Shared connection-pool / retry settings for every AWS client in the process
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "50"))
+AWS_MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", "5"))
+AWS_CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", "5"))
+AWS_READ_TIMEOUT = float(os.getenv("AWS_READ_TIMEOUT", "60"))
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# LLM Gateway Configuration
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "150000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "600"))
+# Structured output: repair calls allowed when a JSON response does not parse or validate
+LLM_JSON_REPAIR_ATTEMPTS = int(os.getenv("LLM_JSON_REPAIR_ATTEMPTS", "1"))
+
+# LLM Response Cache Configuration
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/tmp/llm_cache.sqlite3")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Optional shared tier in S3; disabled when empty. Keep it under cache/ (e.g. "cache/llm/")
+# so it stays out of the file listings.
+LLM_CACHE_S3_PREFIX = os.getenv("LLM_CACHE_S3_PREFIX", "")
+
+# Textract Configuration
+# Polling: start fast, back off geometrically up to a cap
+TEXTRACT_POLL_INITIAL = float(os.getenv("TEXTRACT_POLL_INITIAL", "0.5"))
+TEXTRACT_POLL_MAX = float(os.getenv("TEXTRACT_POLL_MAX", "4"))
+TEXTRACT_TIMEOUT = float(os.getenv("TEXTRACT_TIMEOUT", "900"))
+# Throttled calls are retried with jittered exponential backoff
+TEXTRACT_MAX_RETRIES = int(os.getenv("TEXTRACT_MAX_RETRIES", "5"))
+TEXTRACT_RETRY_BASE = float(os.getenv("TEXTRACT_RETRY_BASE", "1"))
+# Optional notification channel: Textract publishes completion to an SNS topic
+# that is subscribed by an SQS queue we long-poll instead of polling Textract.
+TEXTRACT_SNS_TOPIC_ARN = os.getenv("TEXTRACT_SNS_TOPIC_ARN")
+TEXTRACT_SNS_ROLE_ARN = os.getenv("TEXTRACT_SNS_ROLE_ARN")
+TEXTRACT_SQS_QUEUE_URL = os.getenv("TEXTRACT_SQS_QUEUE_URL")
+# Extraction routing: PDF pages with at least this many characters in their text
+# layer are read locally with pdfplumber; the rest are sent to Textract.
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", "40"))
+
+# Retrieval Configuration
+RETRIEVAL_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "1200"))
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "200"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+# Optional local sentence-transformers model; a hashed bag-of-words embedding is used otherwise
+RETRIEVAL_EMBEDDING_MODEL = os.getenv("RETRIEVAL_EMBEDDING_MODEL", "")
+
+# Auth Configuration
+# Seconds to trust the cached allowed users file before revalidating against S3. This is
+# also how long user additions, removals and role changes take to reach running API workers.
+USERS_CACHE_TTL = int(os.getenv("USERS_CACHE_TTL", "30"))
+# When S3 fails transiently (throttling, 5xx, network), the last good copy is served for
+# at most this many seconds after it was fetched; a missing or unreadable file denies everyone
+USERS_CACHE_MAX_STALE = int(os.getenv("USERS_CACHE_MAX_STALE", "300"))
+
+# Processing Configuration
+# Thread pool size for running independent pipeline stages and output uploads
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "4"))
+# Jobs processed at once per worker process; Textract/LLM calls are limited separately
+# by TEXTRACT_SLOTS / LLM_SLOTS below
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "8"))
+# Process-wide concurrency limits per external resource (not per job); LLM_SLOTS is the
+# upper bound for the adaptive LLM concurrency limiter in utils/llm_utils.py
+TEXTRACT_SLOTS = int(os.getenv("TEXTRACT_SLOTS", "4"))
+LLM_SLOTS = int(os.getenv("LLM_SLOTS", "8"))
+
+# Job Store Configuration
+# "sqlite" (shared by all workers on one node), "s3" (shared across nodes) or "memory"
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "/tmp/jobs.sqlite3")
+JOB_STORE_S3_PREFIX = os.getenv("JOB_STORE_S3_PREFIX", "jobs/")
+# Finished jobs older than this are evicted
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+# Workers refresh heartbeat_at on their queued/running jobs this often; an active job
+# whose heartbeat is older than JOB_STALE_SECONDS is treated as orphaned (crash/redeploy)
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "60"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+# Upper bound on /status long-poll waits
+STATUS_MAX_WAIT_SECONDS = int(os.getenv("STATUS_MAX_WAIT_SECONDS", "60"))
+
+# Upload Configuration
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+# S3 multipart part size (minimum 5 MiB) and how many parts one upload may buffer at once
+UPLOAD_PART_SIZE = max(5 * 1024 * 1024, int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))))
+UPLOAD_MAX_INFLIGHT_PARTS = int(os.getenv("UPLOAD_MAX_INFLIGHT_PARTS", "2"))
+# Sniffed document types the pipeline can extract text from
+UPLOAD_ALLOWED_MIME_TYPES = os.getenv("UPLOAD_ALLOWED_MIME_TYPES", "application/pdf,image/png,image/jpeg,image/tiff").split(",")
+
+# Results Catalog Configuration
+# Per-input manifests of the outputs under results/, written by save_outputs
+RESULTS_CATALOG_PREFIX = os.getenv("RESULTS_CATALOG_PREFIX", "catalog/")
+# How often each worker merges manifests written by other workers
+RESULTS_CATALOG_SYNC_SECONDS = int(os.getenv("RESULTS_CATALOG_SYNC_SECONDS", "60"))
+# How often each worker rebuilds its catalog from a full listing of results/ (picks up
+# outputs deleted without going through the catalog)
+RESULTS_CATALOG_REBUILD_SECONDS = int(os.getenv("RESULTS_CATALOG_REBUILD_SECONDS", "3600"))
+
+# Download Configuration
+# Default for the download endpoints' mode parameter: "stream" (bytes go through the API),
+# "presigned" (JSON with a short-lived S3 URL) or "redirect" (307 to that URL)
+DOWNLOAD_MODE = os.getenv("DOWNLOAD_MODE", "stream")
+PRESIGNED_URL_TTL = int(os.getenv("PRESIGNED_URL_TTL", "300"))
+# Each worker reuses a presigned URL for at most this long. Invalidation only reaches the
+# worker that rewrote the output, so other workers may hand out a URL to a deleted
+# served/ copy for up to this many seconds after a reprocess.
+PRESIGNED_URL_CACHE_SECONDS = int(os.getenv("PRESIGNED_URL_CACHE_SECONDS", "30"))
+
 # CORS Configuration
 CORS_ORIGINS = ["*"]
-
-# S3 Results Map
-S3_RESULTS_MAP_PATH = "/tmp/s3_results_map.json"
-if os.path.exists(S3_RESULTS_MAP_PATH):
-    with open(S3_RESULTS_MAP_PATH, "r") as f:
-        S3_RESULTS_MAP = json.load(f)
-else:
-    S3_RESULTS_MAP = {}
-
-def save_s3_results_map():
-    """Save the S3 results mapping to file"""
-    with open(S3_RESULTS_MAP_PATH, "w") as f:
-        json.dump(S3_RESULTS_MAP, f) 
\ No newline at end of file
@@ -1,54 +1,28 @@
 import os
 import uuid
-import shutil
 import json
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, File, Body, Form, Request, BackgroundTasks, HTTPException, Depends
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi import FastAPI, Body, Request, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 # Import our modular components
-from config import CORS_ORIGINS, S3_RESULTS_MAP, save_s3_results_map
-from services.file_processor import start_processing, get_job_status, get_job
-from services.chat_service import chat_with_file
-from utils.s3_utils import upload_to_s3, download_output_from_s3, list_results_structure, list_s3_files, S3_BUCKET
-from utils.llm_utils import extract_xml_content
-import re
-import boto3
-
-def add_bpmn_watermark(content):
-    """Add a watermark to BPMN XML content"""
-    watermark_comment = f"""
-    <!-- 
-    ========================================
-    BPMN Generated by Abhishek Arora
-    BPMN Generator - Professional Workflow Design
-    Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-    ========================================
-    -->
-    """
-    
-    # Find the opening <bpmn:definitions> tag and add watermark after it
-    if '<bpmn:definitions' in content:
-        # Add watermark after the opening definitions tag
-        content = re.sub(
-            r'(<bpmn:definitions[^>]*>)',
-            r'\1' + watermark_comment,
-            content,
-            count=1
-        )
-    elif '<definitions' in content:
-        # Add watermark after the opening definitions tag (without namespace)
-        content = re.sub(
-            r'(<definitions[^>]*>)',
-            r'\1' + watermark_comment,
-            content,
-            count=1
-        )
-    
-    return content
-
+from config import CORS_ORIGINS, STATUS_MAX_WAIT_SECONDS, DOWNLOAD_MODE
+from services.file_processor import start_processing, get_job_status, get_job, find_reusable_job, RESULT_OUTPUTS, PIPELINE_STAGES, get_queue_position, shutdown_processing
+from services.scheduler import PRIORITY_BATCH
+from services.upload_index import find_upload, remember_upload
+from services.uploads import StreamingUpload, UploadRejected
+from services.chat_service import chat_with_file, stream_chat_with_file
+from services.downloads import serve_download, s3_error_response
+from services.job_events import stream_job_events, iter_job_events, wait_for_job_change, job_status_event
+from services.user_directory import get_allowed_users, get_user, save_allowed_users
+from utils.s3_utils import list_input_files, list_s3_files, S3_BUCKET
+from services.results_catalog import list_results, get_outputs, summarize_outputs
+from utils.llm_utils import get_llm_metrics
+from utils.llm_cache import get_cache_stats
+from utils.aws_clients import get_s3_client
 app = FastAPI()
 
 # Add CORS middleware
@@ -62,24 +36,14 @@ app.add_middleware(
 
 # Security scheme for authentication
 security = HTTPBearer()
+# EventSource cannot send headers, so event streams also accept ?token=
+optional_security = HTTPBearer(auto_error=False)
 
 # Authentication functions
-def get_allowed_users():
-    """Fetch allowed users from S3"""
-    try:
-        s3_client = boto3.client('s3')
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key='auth/allowed_users.json')
-        users_data = json.loads(response['Body'].read().decode('utf-8'))
-        return users_data.get('users', [])
-    except Exception as e:
-        print(f"Error fetching allowed users: {e}")
-        # Return empty list if file doesn't exist or error occurs
-        return []
-
 def get_access_requests():
     """Fetch access requests from S3"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         response = s3_client.get_object(Bucket=S3_BUCKET, Key='auth/access_requests.json')
         requests_data = json.loads(response['Body'].read().decode('utf-8'))
         return requests_data.get('requests', [])
@@ -91,7 +55,7 @@ def get_access_requests():
 def save_access_requests(requests_list):
     """Save access requests to S3"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         requests_data = {"requests": requests_list}
         s3_client.put_object(
             Bucket=S3_BUCKET,
@@ -106,10 +70,9 @@ def save_access_requests(requests_list):
 
 def verify_user(ads_id: str, password: str):
     """Verify user credentials against allowed users list"""
-    allowed_users = get_allowed_users()
-    for user in allowed_users:
-        if user.get('ads_id') == ads_id and user.get('password') == password:
-            return user
+    user = get_user(ads_id)
+    if user and user.get('password') == password:
+        return user
     return None
 
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
@@ -118,22 +81,27 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         # For simplicity, we'll use the token as ads_id
         # In a real implementation, you'd verify JWT tokens
         ads_id = credentials.credentials
-        allowed_users = get_allowed_users()
         
         # Check if ads_id exists in allowed users
-        for user in allowed_users:
-            if user.get('ads_id') == ads_id:
-                return ads_id
+        if get_user(ads_id):
+            return ads_id
         
         raise HTTPException(status_code=401, detail="Invalid credentials")
     except Exception as e:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+def get_stream_user(token: str = None, credentials: HTTPAuthorizationCredentials = Depends(optional_security)):
+    """Dependency to authenticate event streams (Bearer header or ?token= query param)"""
+    ads_id = credentials.credentials if credentials else token
+    if ads_id and get_user(ads_id):
+        return ads_id
+    raise HTTPException(status_code=401, detail="Invalid credentials")
+
 # Initialize auth files in S3 if they don't exist
 def initialize_auth_files():
     """Initialize the auth files in S3 if they don't exist"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         
         # Initialize allowed users file
         try:
@@ -179,6 +147,11 @@ def initialize_auth_files():
 # Initialize auth files on startup
 initialize_auth_files()
 
+@app.on_event("shutdown")
+def drain_jobs():
+    """Let running jobs finish before the worker exits"""
+    shutdown_processing()
+
 @app.get("/health")
 def health_check():
     """Health check endpoint for AWS deployment"""
@@ -203,14 +176,8 @@ def login(ads_id: str = Body(...), password: str = Body(...)):
 @app.get("/auth/status")
 def auth_status(current_user: str = Depends(get_current_user)):
     """Check if user is authenticated"""
-    allowed_users = get_allowed_users()
-    user_role = "user"  # default role
-    
-    # Find user role
-    for user in allowed_users:
-        if user.get('ads_id') == current_user:
-            user_role = user.get('role', 'user')
-            break
+    user = get_user(current_user)
+    user_role = user.get('role', 'user') if user else "user"
     
     return {"authenticated": True, "ads_id": current_user, "role": user_role}
 
@@ -233,10 +200,8 @@ def request_access(ads_id: str = Body(...), password: str = Body(...)):
     """Submit an access request"""
     try:
         # Check if user already exists
-        allowed_users = get_allowed_users()
-        for user in allowed_users:
-            if user.get('ads_id') == ads_id:
-                raise HTTPException(status_code=400, detail="User already has access")
+        if get_user(ads_id):
+            raise HTTPException(status_code=400, detail="User already has access")
         
         # Check if request already exists
         existing_requests = get_access_requests()
@@ -295,7 +260,7 @@ def approve_request(ads_id: str = Body(...), current_user: str = Depends(get_cur
             raise HTTPException(status_code=404, detail="Request not found or already processed")
         
         # Add user to allowed users
-        allowed_users = get_allowed_users()
+        allowed_users = get_allowed_users(fresh=True)
         new_user = {
             "ads_id": target_request['ads_id'],
             "password": target_request['password'],
@@ -305,15 +270,8 @@ def approve_request(ads_id: str = Body(...), current_user: str = Depends(get_cur
         
         allowed_users.append(new_user)
         
-        # Save updated allowed users
-        s3_client = boto3.client('s3')
-        users_data = {"users": allowed_users}
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key='auth/allowed_users.json',
-            Body=json.dumps(users_data, indent=2),
-            ContentType='application/json'
-        )
+        # Save updated allowed users (also invalidates the users cache)
+        save_allowed_users(allowed_users)
         
         # Update request status
         for request in requests:
@@ -358,80 +316,58 @@ def reject_request(ads_id: str = Body(...), current_user: str = Depends(get_curr
         raise HTTPException(status_code=500, detail=f"Error rejecting request: {str(e)}")
 
 @app.post("/upload")
-def upload(file: UploadFile = File(...), current_user: str = Depends(get_current_user)):
-    """Upload a new file for processing"""
+async def upload(request: Request, force: bool = False, current_user: str = Depends(get_current_user)):
+    """Upload a new file for processing (multipart/form-data with a "file" part).
+    The body is streamed straight to S3. A file whose content was uploaded
+    before is attached to that upload's running job or existing results;
+    set force=true (query or form field) to process it again."""
     job_id = str(uuid.uuid4())
-    
-    # Create temporary file for S3 upload
-    temp_file_path = os.path.join("/tmp", f"{job_id}_{file.filename}")
-    
-    with open(temp_file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Upload to S3
     bucket = S3_BUCKET
-    s3_key = f"{job_id}_{file.filename}"
-    upload_to_s3(temp_file_path, bucket, s3_key)
+    incoming = StreamingUpload(bucket, lambda filename: f"{job_id}_{filename}")
+    try:
+        await incoming.receive(request)
+    except UploadRejected as e:
+        print(f"[upload] Rejected upload: {e}")
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
     
-    # Start processing with S3 key only
-    start_processing(job_id, s3_key, bucket, s3_key)
+    try:
+        force = force or incoming.fields.get("force", "").lower() in ("true", "1", "on")
+        if not force:
+            existing_key = await run_in_threadpool(find_upload, incoming.content_sha256)
+            reused_job_id = await run_in_threadpool(find_reusable_job, existing_key) if existing_key else None
+            if reused_job_id:
+                await incoming.abort()
+                print(f"[upload] {incoming.filename} matches earlier upload {existing_key}, reusing job {reused_job_id}")
+                return {"job_id": reused_job_id, "reused": True, "s3_key": existing_key}
+        
+        s3_key = incoming.s3_key
+        await incoming.commit()
+        await run_in_threadpool(remember_upload, incoming.content_sha256, s3_key)
+    except Exception as e:
+        await incoming.abort()
+        print(f"[upload] Error uploading {incoming.filename}: {e}")
+        return JSONResponse(status_code=500, content={"error": "Upload failed"})
     
-    # Clean up temp file
-    os.remove(temp_file_path)
+    # Start processing with S3 key only
+    await run_in_threadpool(start_processing, job_id, s3_key, bucket, s3_key, user=current_user)
     
-    return {"job_id": job_id}
+    return {"job_id": job_id, "reused": False}
 
 @app.post("/process_existing")
 def process_existing(s3_key: str = Body(..., embed=True), current_user: str = Depends(get_current_user)):
     """Process an existing file from S3"""
     try:
-        # Check if results for this S3 key already exist in S3
-        expected_outputs = [
-            ("extracted_text_s3_key", "extracted_text.txt"),
-            ("bpmn_template_s3_key", "bpmn_template.json"),
-            ("refined_bpmn_template_s3_key", "refined_bpmn_template.json"),
-            ("bpmn_xml_s3_key", "bpmn_xml.xml"),
-            ("final_bpmn_xml_s3_key", "final_bpmn_xml.bpmn"),
-            ("summary_s3_key", "summary.txt"),
-            ("result_s3_key", "result.bpmn.xml")
-        ]
-        
-        job_id = None
-        all_found = True
-        s3_keys = {}
-        
-        for key, output_name in expected_outputs:
-            s3_key_path = f"results/{s3_key}/{output_name}"
-            # Check if file exists in S3
-            import boto3
-            s3_client = boto3.client('s3')
-            try:
-                s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key_path)
-                s3_keys[key] = s3_key_path
-            except:
-                all_found = False
-        
-        if all_found:
-            # Use a deterministic job_id for this s3_key for reuse
-            job_id = f"s3_{s3_key.replace('/', '_')}"
-            job = {"status": "completed", "s3_key": s3_key, "bucket": S3_BUCKET}
-            for key, s3_key_path in s3_keys.items():
-                job[key] = s3_key_path
-            
-            # Import here to avoid circular imports
-            from services.file_processor import JOBS
-            JOBS[job_id] = job
+        # Reuse a job that is already running for this S3 key, or its existing results
+        job_id = find_reusable_job(s3_key)
+        if job_id:
             return {"job_id": job_id, "reused": True}
         
         # If not all outputs found, process as usual
         job_id = str(uuid.uuid4())
         
-        # Start processing with S3 key only (no local file needed)
-        start_processing(job_id, s3_key, S3_BUCKET, s3_key)
-        
-        # Save mapping for future reuse
-        S3_RESULTS_MAP[s3_key] = job_id
-        save_s3_results_map()
+        # Start processing with S3 key only (no local file needed), reusing the
+        # stage outputs of an earlier run that did not finish
+        start_processing(job_id, s3_key, S3_BUCKET, s3_key, user=current_user, resume=True)
         
         return {"job_id": job_id, "reused": False}
         
@@ -439,9 +375,19 @@ def process_existing(s3_key: str = Body(..., embed=True), current_user: str = De
         print(f"[process_existing] Error: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+# Stages a reprocess can restart from
+PIPELINE_STAGE_NAMES = [stage[0] for stage in PIPELINE_STAGES]
+
 @app.post("/reprocess")
-def reprocess(s3_key: str = Body(..., embed=True), current_user: str = Depends(get_current_user)):
-    """Reprocess an existing file from S3 and replace previous outputs"""
+def reprocess(s3_key: str = Body(..., embed=True), fresh: bool = Body(False, embed=True),
+              resume: bool = Body(False, embed=True), from_stage: str = Body(None, embed=True),
+              current_user: str = Depends(get_current_user)):
+    """Reprocess an existing file from S3 and replace previous outputs.
+    Set fresh=true to bypass the LLM response cache and force new generations.
+    Set resume=true to reuse the stage outputs that are still valid, or
+    from_stage (e.g. "final_bpmn_xml") to rerun only that stage and the ones after it."""
+    if from_stage and from_stage not in PIPELINE_STAGE_NAMES:
+        return JSONResponse(status_code=400, content={"error": f"Unknown stage {from_stage}", "stages": PIPELINE_STAGE_NAMES})
     try:
         print(f"[reprocess] Starting reprocessing for S3 key: {s3_key}")
         
@@ -449,11 +395,8 @@ def reprocess(s3_key: str = Body(..., embed=True), current_user: str = Depends(g
         job_id = str(uuid.uuid4())
         
         # Start processing with S3 key (this will overwrite existing outputs)
-        start_processing(job_id, s3_key, S3_BUCKET, s3_key)
-        
-        # Save mapping for future reuse
-        S3_RESULTS_MAP[s3_key] = job_id
-        save_s3_results_map()
+        start_processing(job_id, s3_key, S3_BUCKET, s3_key, bypass_llm_cache=fresh, user=current_user,
+                         resume=resume, from_stage=from_stage)
         
         print(f"[reprocess] Started reprocessing job {job_id} for {s3_key}")
         return {"job_id": job_id, "action": "reprocessing", "s3_key": s3_key}
@@ -463,7 +406,7 @@ def reprocess(s3_key: str = Body(..., embed=True), current_user: str = Depends(g
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.post("/reprocess_batch")
-def reprocess_batch(s3_keys: list = Body(..., embed=True), current_user: str = Depends(get_current_user)):
+def reprocess_batch(s3_keys: list = Body(..., embed=True), fresh: bool = Body(False, embed=True), current_user: str = Depends(get_current_user)):
     """Reprocess multiple existing files from S3 and replace previous outputs"""
     try:
         print(f"[reprocess_batch] Starting batch reprocessing for {len(s3_keys)} files")
@@ -475,11 +418,9 @@ def reprocess_batch(s3_keys: list = Body(..., embed=True), current_user: str = D
             job_id = str(uuid.uuid4())
             
             # Start processing with S3 key (this will overwrite existing outputs)
-            start_processing(job_id, s3_key, S3_BUCKET, s3_key)
-            
-            # Save mapping for future reuse
-            S3_RESULTS_MAP[s3_key] = job_id
-            save_s3_results_map()
+            # Batch jobs queue behind interactive uploads
+            start_processing(job_id, s3_key, S3_BUCKET, s3_key, bypass_llm_cache=fresh,
+                             priority=PRIORITY_BATCH, user=current_user)
             
             job_ids.append({"job_id": job_id, "s3_key": s3_key})
             print(f"[reprocess_batch] Started reprocessing job {job_id} for {s3_key}")
@@ -492,15 +433,62 @@ def reprocess_batch(s3_keys: list = Body(..., embed=True), current_user: str = D
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.get("/status/{job_id}")
-def status(job_id: str, current_user: str = Depends(get_current_user)):
-    """Get the status of a processing job"""
+async def status(job_id: str, wait: int = 0, since: int = -1, current_user: str = Depends(get_current_user)):
+    """
+    Get the status of a processing job. With wait (seconds, long-poll) the
+    response is held until the job's version is newer than since.
+    """
+    load_job = lambda: get_job_status(job_id)
+    if wait > 0:
+        job = await wait_for_job_change(job_id, load_job, since, min(wait, STATUS_MAX_WAIT_SECONDS))
+    else:
+        job = await run_in_threadpool(load_job)
+    if not job:
+        return JSONResponse(status_code=404, content={"status": "not_found"})
+    response = job_status_event(job)
+    if job["status"] == "queued":
+        response["queue_position"] = get_queue_position(job_id)
+    return response
+
+@app.get("/jobs/{job_id}/events")
+def job_events(job_id: str, current_user: str = Depends(get_stream_user)):
+    """Server-Sent Events stream of a job's status, stage and token events"""
     job = get_job_status(job_id)
     if not job:
         return JSONResponse(status_code=404, content={"status": "not_found"})
-    return {"status": job["status"]}
+    return StreamingResponse(
+        stream_job_events(job_id, lambda: get_job_status(job_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/ws/jobs/{job_id}")
+async def job_events_ws(websocket: WebSocket, job_id: str, token: str = None):
+    """WebSocket stream of a job's events (same messages as /jobs/{job_id}/events)"""
+    if not token or not await run_in_threadpool(get_user, token):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    try:
+        async for message in iter_job_events(job_id, lambda: get_job_status(job_id)):
+            if message is not None:
+                await websocket.send_json(message)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/llm_cache/stats")
+def llm_cache_stats(current_user: str = Depends(get_current_user)):
+    """Get LLM response cache hit/miss counters for this worker"""
+    return get_cache_stats()
+
+@app.get("/llm/metrics")
+def llm_metrics(current_user: str = Depends(get_current_user)):
+    """Get LLM gateway counters (queue wait, throttles, retries) for this worker"""
+    return get_llm_metrics()
 
 @app.get("/download/{job_id}")
-def download(job_id: str, background_tasks: BackgroundTasks):
+def download(job_id: str, request: Request, mode: str = DOWNLOAD_MODE):
     """Download the final BPMN file from S3"""
     job = get_job(job_id)
     if not job or job["status"] != "completed":
@@ -512,53 +500,15 @@ def download(job_id: str, background_tasks: BackgroundTasks):
         return JSONResponse(status_code=404, content={"error": "Result not found"})
     
     bpmn_filename = f"bpmn_{job_id}.bpmn"
-    
-    # Download from S3 to temp file
-    temp_file_path = os.path.join("/tmp", f"{job_id}_result.bpmn")
     try:
-        # Download from S3
-        import boto3
-        s3_client = boto3.client('s3')
-        s3_client.download_file(S3_BUCKET, s3_key, temp_file_path)
-        
-        # Check if file needs cleaning
-        with open(temp_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # If content contains explanatory text, clean it
-        if content.find('Certainly!') != -1 or content.find('**refined, deployment-ready BPMN 2.0 XML**') != -1:
-            clean_content = extract_xml_content(content)
-            content = clean_content
-            print(f"[download] Cleaned BPMN file for job {job_id}")
-        
-
-        
-        # Add watermark to BPMN files
-        content = add_bpmn_watermark(content)
-        
-        # Write the watermarked content back to temp file
-        with open(temp_file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        print(f"[download] Added watermark to BPMN file for job {job_id}")
-        
-        # Add cleanup task to background
-        def cleanup_temp_file():
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-        
-        background_tasks.add_task(cleanup_temp_file)
-        
-        return FileResponse(temp_file_path, filename=bpmn_filename)
-        
+        # Cleaned and watermarked as it streams from S3
+        return serve_download(request, S3_BUCKET, s3_key, bpmn_filename, watermark_bpmn=True, mode=mode)
     except Exception as e:
-        # Clean up temp file on error
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
         print(f"[download] Error downloading BPMN file for job {job_id}: {e}")
-        return JSONResponse(status_code=500, content={"error": "Failed to download file"})
+        return s3_error_response(e)
 
 @app.get("/download/{job_id}/{output_type}")
-def download_intermediate(job_id: str, output_type: str, background_tasks: BackgroundTasks):
+def download_intermediate(job_id: str, output_type: str, request: Request, mode: str = DOWNLOAD_MODE):
     """Download intermediate output files from S3"""
     job = get_job(job_id)
     if not job or job["status"] not in ["completed", "processing"]:
@@ -580,54 +530,17 @@ def download_intermediate(job_id: str, output_type: str, background_tasks: Backg
     }
     ext = ext_map.get(output_type, ".txt")
     filename = f"{output_type}_{job_id}{ext}"
-    
-    # Download from S3 to temp file
-    temp_file_path = os.path.join("/tmp", f"{job_id}_{output_type}{ext}")
     try:
-        # Download from S3
-        import boto3
-        s3_client = boto3.client('s3')
-        s3_client.download_file(S3_BUCKET, s3_key, temp_file_path)
-        
-        # Check if this is a BPMN file that needs cleaning
-        if output_type in ["bpmn_xml", "final_bpmn_xml"]:
-            try:
-                with open(temp_file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                # If content contains explanatory text, clean it
-                if content.find('Certainly!') != -1 or content.find('**refined, deployment-ready BPMN 2.0 XML**') != -1:
-                    clean_content = extract_xml_content(content)
-                    content = clean_content
-                    print(f"[download_intermediate] Cleaned {output_type} file for job {job_id}")
-                
-
-                
-                # Add watermark to BPMN files
-                content = add_bpmn_watermark(content)
-                
-                # Write the watermarked content back to temp file
-                with open(temp_file_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                print(f"[download_intermediate] Added watermark to {output_type} file for job {job_id}")
-            except Exception as e:
-                print(f"[download_intermediate] Error cleaning {output_type} file for job {job_id}: {e}")
-        
-        # Add cleanup task to background
-        def cleanup_temp_file():
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-        
-        background_tasks.add_task(cleanup_temp_file)
-        
-        return FileResponse(temp_file_path, filename=filename)
-        
+        # BPMN outputs are cleaned and watermarked as they stream
+        return serve_download(
+            request, S3_BUCKET, s3_key, filename,
+            watermark_bpmn=output_type in ["bpmn_xml", "final_bpmn_xml"],
+            mode=mode,
+            finalized=job["status"] == "completed"
+        )
     except Exception as e:
-        # Clean up temp file on error
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
         print(f"[download_intermediate] Error downloading {output_type} file for job {job_id}: {e}")
-        return JSONResponse(status_code=500, content={"error": "Failed to download file"})
+        return s3_error_response(e)
 
 @app.post("/chat")
 def chat(job_id: str = Body(...), prompt: str = Body(...), current_user: str = Depends(get_current_user)):
@@ -635,6 +548,24 @@ def chat(job_id: str = Body(...), prompt: str = Body(...), current_user: str = D
     job = get_job(job_id)
     return chat_with_file(job_id, prompt, job)
 
+@app.post("/chat/stream")
+def chat_stream(job_id: str = Body(...), prompt: str = Body(...), current_user: str = Depends(get_current_user)):
+    """Chat with a processed file, streaming the response as Server-Sent Events"""
+    job = get_job(job_id)
+    if not job or "s3_key" not in job:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+
+    def events():
+        try:
+            for delta in stream_chat_with_file(job_id, prompt, job):
+                yield f"event: token\ndata: {json.dumps({'delta': delta})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"[chat_stream] Error: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/files")
 def list_files(current_user: str = Depends(get_current_user)):
     """List all files in S3 bucket"""
@@ -762,58 +693,49 @@ def job_outputs(job_id: str, request: Request):
     return {"outputs": outputs, "status": status}
 
 @app.get("/results_structure")
-def results_structure(current_user: str = Depends(get_current_user)):
-    """Get the structure of all results in S3 with timestamps"""
-    structure, timestamps = list_results_structure()
+def results_structure(limit: int = None, cursor: str = None, current_user: str = Depends(get_current_user)):
+    """Get the structure of all results in S3 with timestamps.
+    Pass limit (and the returned next_cursor) to page through the results."""
+    page, next_cursor = list_results(cursor, limit)
+    structure = {s3_key: list(outputs) for s3_key, outputs in page}
+    timestamps = {s3_key: summarize_outputs(outputs) for s3_key, outputs in page}
     
     # List all input files in S3 (excluding results/) with their timestamps
-    import boto3
-    s3_client = boto3.client('s3')
-    response = s3_client.list_objects_v2(Bucket=S3_BUCKET)
-    files = response.get("Contents", [])
     input_files = []
     input_file_timestamps = {}
     
-    for obj in files:
+    for obj in list_input_files():
         key = obj["Key"]
-        if key.startswith("results/") or key.startswith("auth/") or key.endswith("/"):
-            continue
         input_files.append(key)
         # Store the original file timestamp
         input_file_timestamps[key] = {
             "last_modified": obj.get("LastModified"),
-            "size": obj.get("ContentLength")
+            "size": obj.get("Size")
         }
     
     return {
         "results": structure, 
         "input_files": input_files,
         "timestamps": timestamps,
-        "input_file_timestamps": input_file_timestamps
+        "input_file_timestamps": input_file_timestamps,
+        "next_cursor": next_cursor
     }
 
+# Outputs every complete run writes under results/<key>/
+EXPECTED_OUTPUTS = [output_name for _, output_name in RESULT_OUTPUTS]
+
 @app.get("/reprocessable_files")
-def get_reprocessable_files(current_user: str = Depends(get_current_user)):
+def get_reprocessable_files(limit: int = None, cursor: str = None, current_user: str = Depends(get_current_user)):
     """Get list of files that can be reprocessed (have existing results)"""
     try:
-        structure, timestamps = list_results_structure()
+        page, next_cursor = list_results(cursor, limit)
         
         # Files that can be reprocessed are those that have results
         reprocessable_files = []
         
-        for s3_key, outputs in structure.items():
+        for s3_key, outputs in page:
             # Check if all expected outputs exist
-            expected_outputs = [
-                "bpmn_template.json",
-                "bpmn_xml.xml", 
-                "extracted_text.txt",
-                "final_bpmn_xml.bpmn",
-                "refined_bpmn_template.json",
-                "result.bpmn.xml",
-                "summary.txt"
-            ]
-            
-            if all(output in outputs for output in expected_outputs):
+            if all(output in outputs for output in EXPECTED_OUTPUTS):
                 reprocessable_files.append({
                     "s3_key": s3_key,
                     "outputs_count": len(outputs),
@@ -824,13 +746,14 @@ def get_reprocessable_files(current_user: str = Depends(get_current_user)):
                     "s3_key": s3_key,
                     "outputs_count": len(outputs),
                     "has_all_outputs": False,
-                    "missing_outputs": [output for output in expected_outputs if output not in outputs]
+                    "missing_outputs": [output for output in EXPECTED_OUTPUTS if output not in outputs]
                 })
         
         return {
             "reprocessable_files": reprocessable_files,
             "total_files": len(reprocessable_files),
-            "complete_files": len([f for f in reprocessable_files if f["has_all_outputs"]])
+            "complete_files": len([f for f in reprocessable_files if f["has_all_outputs"]]),
+            "next_cursor": next_cursor
         }
         
     except Exception as e:
@@ -838,70 +761,29 @@ def get_reprocessable_files(current_user: str = Depends(get_current_user)):
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.get("/results/{input_key:path}/{output_name}")
-def serve_result_file(input_key: str, output_name: str, background_tasks: BackgroundTasks):
+def serve_result_file(input_key: str, output_name: str, request: Request, mode: str = DOWNLOAD_MODE):
     """Serve result files from S3"""
     # input_key is the S3 key (may contain slashes)
     # output_name is the file name
     s3_key = f"results/{input_key}/{output_name}"
-    
-    # Download from S3 to temp file
-    temp_file_path = os.path.join("/tmp", f"{input_key.replace('/', '_')}_{output_name}")
     try:
-        # Download from S3
-        import boto3
-        s3_client = boto3.client('s3')
-        s3_client.download_file(S3_BUCKET, s3_key, temp_file_path)
-        
-        # Check if this is a BPMN file that needs cleaning
-        if output_name.endswith('.bpmn') or output_name.endswith('.xml'):
-            try:
-                with open(temp_file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                # If content contains explanatory text, clean it
-                if content.find('Certainly!') != -1 or content.find('**refined, deployment-ready BPMN 2.0 XML**') != -1:
-                    clean_content = extract_xml_content(content)
-                    content = clean_content
-                    print(f"[serve_result_file] Cleaned BPMN file {output_name}")
-                
-
-                
-                # Add watermark to BPMN files
-                content = add_bpmn_watermark(content)
-                
-                # Write the watermarked content back to temp file
-                with open(temp_file_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                print(f"[serve_result_file] Added watermark to BPMN file {output_name}")
-            except Exception as e:
-                print(f"[serve_result_file] Error cleaning BPMN file {output_name}: {e}")
-        
-        # Add cleanup task to background
-        def cleanup_temp_file():
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-        
-        background_tasks.add_task(cleanup_temp_file)
-        
-        return FileResponse(temp_file_path, filename=output_name)
-        
+        # BPMN files are cleaned and watermarked as they stream
+        is_bpmn = output_name.endswith('.bpmn') or output_name.endswith('.xml')
+        return serve_download(request, S3_BUCKET, s3_key, output_name, watermark_bpmn=is_bpmn, mode=mode)
     except Exception as e:
-        # Clean up temp file on error
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
         print(f"[serve_result_file] Error downloading file {s3_key}: {e}")
-        return JSONResponse(status_code=404, content={"error": "File not found"}) 
+        return s3_error_response(e, status_code=404, message="File not found")
 
 @app.get("/file_timestamps/{input_key}")
 def get_file_timestamps(input_key: str):
     """Get detailed timestamp information for a specific file"""
     try:
-        # Get the results structure and timestamps
-        structure, timestamps = list_results_structure()
+        # Get the input's outputs from the results catalog
+        outputs = get_outputs(input_key)
+        summary = summarize_outputs(outputs)
         
         # Get input file timestamp
-        import boto3
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         input_timestamp = None
         try:
             response = s3_client.head_object(Bucket=S3_BUCKET, Key=input_key)
@@ -909,26 +791,18 @@ def get_file_timestamps(input_key: str):
         except:
             pass
         
-        # Get output file timestamps
-        output_timestamps = {}
-        if input_key in structure:
-            for output_name in structure[input_key]:
-                s3_key = f"results/{input_key}/{output_name}"
-                try:
-                    response = s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key)
-                    output_timestamps[output_name] = {
-                        "last_modified": response.get("LastModified"),
-                        "size": response.get("ContentLength")
-                    }
-                except:
-                    pass
+        # Output file timestamps come straight from the catalog
+        output_timestamps = {
+            output_name: {"last_modified": info["last_modified"], "size": info["size"]}
+            for output_name, info in outputs.items()
+        }
         
         return {
             "input_key": input_key,
             "input_timestamp": input_timestamp,
             "output_timestamps": output_timestamps,
-            "latest_processing": timestamps.get(input_key, {}).get("last_modified"),
-            "files_count": timestamps.get(input_key, {}).get("files_count", 0)
+            "latest_processing": summary["last_modified"],
+            "files_count": summary["files_count"]
         }
         
     except Exception as e:
@@ -5,15 +5,16 @@ Usage: python manage_requests.py <command> [options]
 """
 
 import json
-import boto3
 import sys
 from datetime import datetime
 from config import S3_BUCKET
+from utils.aws_clients import get_s3_client
+from services.user_directory import save_allowed_users as write_allowed_users
 
 def get_access_requests():
     """Fetch access requests from S3"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         response = s3_client.get_object(Bucket=S3_BUCKET, Key='auth/access_requests.json')
         requests_data = json.loads(response['Body'].read().decode('utf-8'))
         return requests_data.get('requests', [])
@@ -24,7 +25,7 @@ def get_access_requests():
 def save_access_requests(requests_list):
     """Save access requests to S3"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         requests_data = {"requests": requests_list}
         s3_client.put_object(
             Bucket=S3_BUCKET,
@@ -40,7 +41,7 @@ def save_access_requests(requests_list):
 def get_allowed_users():
     """Fetch allowed users from S3"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         response = s3_client.get_object(Bucket=S3_BUCKET, Key='auth/allowed_users.json')
         users_data = json.loads(response['Body'].read().decode('utf-8'))
         return users_data.get('users', [])
@@ -51,14 +52,7 @@ def get_allowed_users():
 def save_allowed_users(users_list):
     """Save allowed users to S3"""
     try:
-        s3_client = boto3.client('s3')
-        users_data = {"users": users_list}
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key='auth/allowed_users.json',
-            Body=json.dumps(users_data, indent=2),
-            ContentType='application/json'
-        )
+        write_allowed_users(users_list)
         return True
     except Exception as e:
         print(f"Error saving allowed users: {e}")
@@ -5,14 +5,15 @@ Usage: python remove_user.py <ads_id>
 """
 
 import json
-import boto3
 import sys
-from config import S3_BUCKET
+from config import S3_BUCKET, USERS_CACHE_TTL
+from utils.aws_clients import get_s3_client
+from services.user_directory import save_allowed_users
 
 def remove_user_from_s3(ads_id: str):
     """Remove a user from the S3 auth file"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         
         # Get existing users
         try:
@@ -32,14 +33,10 @@ def remove_user_from_s3(ads_id: str):
             return False
         
         # Upload updated file to S3
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key='auth/allowed_users.json',
-            Body=json.dumps(users_data, indent=2),
-            ContentType='application/json'
-        )
+        save_allowed_users(users_data["users"])
         
         print(f"Successfully removed user with ADS ID: {ads_id}")
+        print(f"Running API workers pick up the change within {USERS_CACHE_TTL} seconds")
         return True
         
     except Exception as e:
@@ -49,7 +46,7 @@ def remove_user_from_s3(ads_id: str):
 def list_users():
     """List all users in the S3 auth file"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         response = s3_client.get_object(Bucket=S3_BUCKET, Key='auth/allowed_users.json')
         users_data = json.loads(response['Body'].read().decode('utf-8'))
         
@@ -1,26 +1,50 @@
-from utils.text_extraction import extract_text_from_s3
-from utils.llm_utils import call_llm
+from services.text_store import get_extracted_text, get_source_etag, get_summary
+from services.retrieval import get_index, search, RETRIEVAL_TOP_K
+from utils.llm_utils import call_llm, stream_llm
 
-def chat_with_file(job_id, prompt, job_data):
-    """Handle chat interactions with processed files using S3"""
-    if not job_data or "s3_key" not in job_data:
-        return {"error": "Job not found"}
-    
-    # Extract text from S3 for context
+def _prepare_chat(prompt, job_data):
+    """Resolve special commands or build the LLM prompt. Returns (direct_response, full_prompt)."""
     bucket = job_data.get("bucket")
     s3_key = job_data.get("s3_key")
+    etag = get_source_etag(bucket, s3_key)
     
-    context = extract_text_from_s3(bucket, s3_key)
+    def load_text():
+        # Reuses stored results before falling back to OCR
+        return get_extracted_text(bucket, s3_key, etag)
     
     # Handle special commands
     if prompt.strip().lower() == "show me the extracted text only.":
-        return {"response": context}
+        return load_text(), None
     
     if prompt.strip().lower() == "summarize the sop":
-        summary = job_data.get("summary", "No summary available.")
-        return {"response": summary}
+        return get_summary(job_data) or "No summary available.", None
+    
+    # Only send the chunks most relevant to the prompt (small documents fit whole)
+    index = get_index(bucket, s3_key, etag, load_text)
+    if len(index["chunks"]) <= RETRIEVAL_TOP_K:
+        context = load_text()
+    else:
+        context = "\n...\n".join(search(index, prompt))
     
     # Structure the prompt for OpenAI
     full_prompt = f"Given the following extracted SOP text:\n{context}\n\nUser prompt: {prompt}\n\nPlease answer based on the SOP."
-    response = call_llm(full_prompt)
-    return {"response": response} 
\ No newline at end of file
+    return None, full_prompt
+
+def chat_with_file(job_id, prompt, job_data):
+    """Handle chat interactions with processed files using S3"""
+    if not job_data or "s3_key" not in job_data:
+        return {"error": "Job not found"}
+    
+    direct_response, full_prompt = _prepare_chat(prompt, job_data)
+    if full_prompt is None:
+        return {"response": direct_response}
+    response = call_llm(full_prompt, agent="chat")
+    return {"response": response}
+
+def stream_chat_with_file(job_id, prompt, job_data):
+    """Generator of response text deltas for a chat message (see chat_with_file)"""
+    direct_response, full_prompt = _prepare_chat(prompt, job_data)
+    if full_prompt is None:
+        yield direct_response
+        return
+    yield from stream_llm(full_prompt, agent="chat")
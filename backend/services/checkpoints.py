@@ -0,0 +1,36 @@
+import hashlib
+from utils.s3_utils import s3, S3_BUCKET
+
+def stage_key(name, version, *inputs):
+    """
+    Fingerprint of a stage run: its name, version (prompt version or source
+    ETag) and input contents. A checkpoint is only reused when it matches.
+    """
+    digest = hashlib.sha256(f"{name}\0{version}".encode('utf-8'))
+    for value in inputs:
+        digest.update(b"\0")
+        digest.update((value or "").encode('utf-8'))
+    return digest.hexdigest()
+
+def save_checkpoint(s3_input_key, output_name, content, key, metadata=None):
+    """Write a stage output to results/<key>/<output_name> as soon as it is produced"""
+    output_key = f"results/{s3_input_key}/{output_name}"
+    s3.put_object(
+        Bucket=S3_BUCKET,
+        Key=output_key,
+        Body=(content or "").encode('utf-8'),
+        Metadata={**(metadata or {}), "stage-key": key}
+    )
+    return output_key
+
+def load_checkpoint(s3_input_key, output_name, key):
+    """Stage output from an earlier run, or None if it is missing, empty or from different inputs"""
+    try:
+        response = s3.get_object(Bucket=S3_BUCKET, Key=f"results/{s3_input_key}/{output_name}")
+    except Exception:
+        return None
+    if response.get("Metadata", {}).get("stage-key") != key:
+        response['Body'].close()
+        return None
+    content = response['Body'].read().decode('utf-8')
+    return content if content.strip() else None
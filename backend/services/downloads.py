@@ -0,0 +1,375 @@
+import re
+import time
+import threading
+import mimetypes
+from botocore.exceptions import ClientError
+from fastapi.responses import Response, StreamingResponse, JSONResponse, RedirectResponse
+from config import PRESIGNED_URL_TTL, PRESIGNED_URL_CACHE_SECONDS
+from utils.aws_clients import get_s3_client
+
+CHUNK_SIZE = 64 * 1024
+# The <definitions> tag and any explanatory LLM preamble must appear within this many bytes
+HEAD_PROBE_BYTES = 64 * 1024
+# Bump when the watermark or cleaning changes so cached copies are revalidated
+TRANSFORM_VERSION = "wm1"
+CLEANUP_MARKERS = (b"Certainly!", b"**refined, deployment-ready BPMN 2.0 XML**")
+XML_END_TAG = b"</bpmn:definitions>"
+DEFINITIONS_TAG = re.compile(rb"<(?:bpmn:)?definitions[^>]*>")
+# Cleaned and watermarked BPMN outputs, mirroring results/ (written by save_outputs)
+SERVED_PREFIX = "served/"
+# (bucket, key, filename) -> (url, created_at)
+_presigned_urls = {}
+_presigned_lock = threading.Lock()
+
+def bpmn_watermark(generated_on):
+    """Watermark comment inserted after the opening <definitions> tag"""
+    return f"""
+    <!--
+    ========================================
+    BPMN Generated by Abhishek Arora
+    BPMN Generator - Professional Workflow Design
+    Generated on: {generated_on.strftime('%Y-%m-%d %H:%M:%S')}
+    ========================================
+    -->
+    """.encode('utf-8')
+
+def _plan_bpmn(head):
+    """
+    Work out the transform for a BPMN object from its first bytes.
+    Returns (skip, insert_at, clean): source bytes to drop from the start
+    (explanatory text before the XML), the source offset after the
+    <definitions> tag (None if not found), and whether to stop after
+    </bpmn:definitions>.
+    """
+    skip = 0
+    clean = any(marker in head for marker in CLEANUP_MARKERS)
+    if clean:
+        xml_start = head.find(b"<?xml")
+        if xml_start == -1:
+            xml_start = head.find(b"<bpmn:definitions")
+        if xml_start == -1:
+            clean = False
+        else:
+            skip = xml_start
+    # Match the namespaced tag first, as add_bpmn_watermark did
+    match = re.search(rb"<bpmn:definitions[^>]*>", head[skip:]) or DEFINITIONS_TAG.search(head[skip:])
+    insert_at = skip + match.end() if match else None
+    return skip, insert_at, clean
+
+def postprocess_bpmn(content, generated_on):
+    """
+    Clean and watermark a whole BPMN document (the served artifact written at
+    save time). Uses the same transform that is applied to streamed legacy
+    outputs.
+    """
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    watermark = bpmn_watermark(generated_on)
+    skip, insert_at, clean = _plan_bpmn(data)
+    return b"".join(_transform([data], 0, skip, insert_at, clean, watermark))
+
+def served_key(results_key):
+    """Key of the precomputed served artifact for a results/ output"""
+    return SERVED_PREFIX + results_key[len("results/"):]
+
+def invalidate_served(bucket, results_key):
+    """
+    Delete the served artifact of a results/ output that is about to be
+    rewritten (e.g. by a stage checkpoint), along with any presigned URLs
+    cached for it here, so downloads transform the new output until
+    save_outputs writes a fresh served copy.
+    """
+    target = served_key(results_key)
+    get_s3_client().delete_object(Bucket=bucket, Key=target)
+    with _presigned_lock:
+        for cache_key in [k for k in _presigned_urls if k[:2] == (bucket, target)]:
+            del _presigned_urls[cache_key]
+
+def _read_head(chunks):
+    """Read up to HEAD_PROBE_BYTES from a chunk iterator; returns (head, leftover chunks)"""
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= HEAD_PROBE_BYTES:
+            break
+    return head, chunks
+
+def _transform(chunks, source_offset, skip, insert_at, clean, watermark):
+    """Apply the BPMN transform to source chunks that start at source_offset"""
+    tail = b""
+    for chunk in chunks:
+        start = source_offset
+        source_offset += len(chunk)
+        if start < skip:
+            chunk = chunk[skip - start:]
+            start = skip
+            if not chunk:
+                continue
+        if insert_at is not None and start <= insert_at < source_offset:
+            split = insert_at - start
+            chunk = chunk[:split] + watermark + chunk[split:]
+        if clean:
+            # Stop after the closing tag, which may straddle chunks
+            data = tail + chunk
+            end = data.find(XML_END_TAG)
+            if end != -1:
+                yield data[:end + len(XML_END_TAG)]
+                return
+            keep = len(XML_END_TAG) - 1
+            tail = data[-keep:]
+            if data[:-keep]:
+                yield data[:-keep]
+        else:
+            yield chunk
+    if tail:
+        yield tail
+
+def _slice(chunks, skip, length):
+    """Yield length bytes of a chunk stream after skipping skip bytes"""
+    for chunk in chunks:
+        if skip:
+            if len(chunk) <= skip:
+                skip -= len(chunk)
+                continue
+            chunk = chunk[skip:]
+            skip = 0
+        if len(chunk) >= length:
+            yield chunk[:length]
+            return
+        length -= len(chunk)
+        yield chunk
+
+def _iter_body(body):
+    """Iterate an S3 streaming body in chunks, closing it when done"""
+    try:
+        yield from body.iter_chunks(chunk_size=CHUNK_SIZE)
+    finally:
+        body.close()
+
+def _parse_range(range_header, total):
+    """Parse a single "bytes=a-b" range into inclusive (start, end); None if absent or unsupported"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (range_header or "").strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        start, end = max(0, total - int(match.group(2))), total - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+    return start, end
+
+def _client_etag(if_none_match, suffix):
+    """S3 ETag the client already has, from an If-None-Match carrying our derived ETag"""
+    value = (if_none_match or "").strip().strip('"')
+    if suffix:
+        if not value.endswith(f"-{suffix}"):
+            return None
+        value = value[:-len(suffix) - 1]
+    return f'"{value}"' if value else None
+
+def _error_code(error):
+    return error.response.get("Error", {}).get("Code")
+
+def _get_object(s3, request, get_args):
+    """get_object that maps conditional/range failures to responses; returns (response, early_response)"""
+    try:
+        return s3.get_object(**get_args), None
+    except ClientError as e:
+        if _error_code(e) in ("304", "NotModified"):
+            return None, Response(status_code=304, headers={"ETag": request.headers.get("if-none-match")})
+        if _error_code(e) == "InvalidRange":
+            return None, Response(status_code=416, headers={"Content-Range": "bytes */*"})
+        raise
+
+def _download_headers(etag, filename):
+    return {
+        "ETag": f'"{etag}"',
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Cache-Control": "private, no-cache"
+    }
+
+def _stream_as_is(s3, request, bucket, key, filename):
+    """Stream an object byte-for-byte; S3 handles Range and If-None-Match itself"""
+    get_args = {"Bucket": bucket, "Key": key}
+    if request.headers.get("if-none-match"):
+        get_args["IfNoneMatch"] = request.headers["if-none-match"]
+    if request.headers.get("range"):
+        get_args["Range"] = request.headers["range"]
+    response, early = _get_object(s3, request, get_args)
+    if early is not None:
+        return early
+    headers = _download_headers(response["ETag"].strip('"'), filename)
+    headers["Accept-Ranges"] = "bytes"
+    headers["Content-Length"] = str(response["ContentLength"])
+    if response.get("Metadata", {}).get("content-sha256"):
+        headers["X-Content-SHA256"] = response["Metadata"]["content-sha256"]
+    status_code = 200
+    if "ContentRange" in response:
+        headers["Content-Range"] = response["ContentRange"]
+        status_code = 206
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return StreamingResponse(_iter_body(response["Body"]), status_code=status_code, headers=headers, media_type=media_type)
+
+def stream_s3_object(request, bucket, key, filename, watermark_bpmn=False):
+    """
+    Stream an S3 object to the client without spooling it to disk. With
+    watermark_bpmn, the precomputed served artifact is streamed when it
+    exists; older outputs are cleaned and watermarked as the bytes stream
+    through. Supports ETag/If-None-Match and single-range Range requests.
+    Raises ClientError (e.g. NoSuchKey) before any bytes are sent.
+    """
+    s3 = get_s3_client()
+    if not watermark_bpmn:
+        return _stream_as_is(s3, request, bucket, key, filename)
+    if key.startswith("results/"):
+        try:
+            return _stream_as_is(s3, request, bucket, served_key(key), filename)
+        except ClientError as e:
+            if _error_code(e) not in ("NoSuchKey", "404"):
+                raise
+    return _stream_transformed(s3, request, bucket, key, filename)
+
+def _stream_transformed(s3, request, bucket, key, filename):
+    """Stream a raw BPMN output, cleaning and watermarking it on the fly"""
+    range_header = request.headers.get("range")
+    get_args = {"Bucket": bucket, "Key": key}
+    client_etag = _client_etag(request.headers.get("if-none-match"), TRANSFORM_VERSION)
+    if client_etag:
+        get_args["IfNoneMatch"] = client_etag
+    if range_header:
+        get_args["Range"] = f"bytes=0-{HEAD_PROBE_BYTES - 1}"
+    response, early = _get_object(s3, request, get_args)
+    if early is not None:
+        return early
+
+    etag = response["ETag"].strip('"')
+    headers = _download_headers(f"{etag}-{TRANSFORM_VERSION}", filename)
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    # Watermark carries the object's own timestamp so the output (and its ETag) is stable
+    watermark = bpmn_watermark(response["LastModified"])
+    source_size = int(response.get("ContentRange", "").rpartition("/")[2] or response["ContentLength"])
+    chunks = _iter_body(response["Body"])
+    head, chunks = _read_head(chunks)
+    skip, insert_at, clean = _plan_bpmn(head)
+    if "ContentRange" in response and len(head) < source_size:
+        # Only the head was fetched; the rest is read by a second request
+        response["Body"].close()
+        chunks = None
+
+    def open_source(offset):
+        if chunks is not None:
+            return _prepend(head[offset:], _slice(chunks, max(0, offset - len(head)), source_size))
+        return _iter_body(s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={offset}-")["Body"])
+
+    if clean:
+        # Output length is only known once the closing tag is found, so ranges are not offered
+        body = _transform(open_source(0), 0, skip, insert_at, clean, watermark)
+        return StreamingResponse(body, headers=headers, media_type=media_type)
+
+    added = len(watermark) if insert_at is not None else 0
+    total = source_size + added
+    headers["Accept-Ranges"] = "bytes"
+    # Unsupported range syntax (e.g. multiple ranges) is served as the whole file
+    byte_range = _parse_range(range_header, total) if range_header else None
+    if byte_range is None:
+        headers["Content-Length"] = str(total)
+        body = _transform(open_source(0), 0, 0, insert_at, False, watermark)
+        return StreamingResponse(body, headers=headers, media_type=media_type)
+
+    start, end = byte_range
+    if start >= total or start > end:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+    # Map the output range back to a source offset, keeping the watermark insertion point in view
+    range_insert_at = insert_at
+    if insert_at is None:
+        source_start = output_start = start
+    elif start < insert_at + added:
+        source_start = output_start = min(start, insert_at)
+    else:
+        # Range starts after the watermark
+        source_start, output_start, range_insert_at = start - added, start, None
+    body = _slice(
+        _transform(open_source(source_start), source_start, 0, range_insert_at, False, watermark),
+        start - output_start, end - start + 1
+    )
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    return StreamingResponse(body, status_code=206, headers=headers, media_type=media_type)
+
+def _prepend(head, chunks):
+    if head:
+        yield head
+    yield from chunks
+
+def _cached_presigned_url(cache_key, now):
+    """A cached (url, created_at) still within its reuse window, or None (caller holds _presigned_lock)"""
+    cached = _presigned_urls.get(cache_key)
+    if cached and now - cached[1] < min(PRESIGNED_URL_CACHE_SECONDS, PRESIGNED_URL_TTL / 2):
+        return cached
+    return None
+
+def presigned_url(bucket, key, filename):
+    """
+    Short-lived presigned GET URL for an object, reused per (key, filename)
+    for up to PRESIGNED_URL_CACHE_SECONDS. Returns (url, seconds_left).
+    """
+    cache_key = (bucket, key, filename)
+    now = time.time()
+    with _presigned_lock:
+        cached = _cached_presigned_url(cache_key, now)
+        if cached:
+            return cached[0], int(cached[1] + PRESIGNED_URL_TTL - now)
+    url = get_s3_client().generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": bucket,
+            "Key": key,
+            "ResponseContentDisposition": f'attachment; filename="{filename}"'
+        },
+        ExpiresIn=PRESIGNED_URL_TTL
+    )
+    with _presigned_lock:
+        # Drop entries past their reuse window so the cache stays bounded
+        for stale in [k for k in _presigned_urls if not _cached_presigned_url(k, now)]:
+            del _presigned_urls[stale]
+        _presigned_urls[cache_key] = (url, now)
+    return url, PRESIGNED_URL_TTL
+
+def _served_exists(bucket, key):
+    """Check (once per reused URL) whether a served artifact exists"""
+    try:
+        get_s3_client().head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if _error_code(e) in ("NoSuchKey", "404", "NotFound"):
+            return False
+        raise
+
+def serve_download(request, bucket, key, filename, watermark_bpmn=False, mode="stream", finalized=True):
+    """
+    Serve a download in the requested mode: "stream" through the API,
+    "presigned" (JSON with a short-lived URL) or "redirect" (307 to it).
+    Presigned modes only apply to finalized artifacts; BPMN outputs without a
+    served artifact are always streamed, since they need the watermark
+    transform.
+    """
+    if mode in ("presigned", "redirect") and finalized:
+        target = key
+        if watermark_bpmn:
+            target = served_key(key) if key.startswith("results/") else None
+            with _presigned_lock:
+                known = _cached_presigned_url((bucket, target, filename), time.time()) is not None
+            if target and not known and not _served_exists(bucket, target):
+                target = None
+        if target:
+            url, expires_in = presigned_url(bucket, target, filename)
+            if mode == "redirect":
+                return RedirectResponse(url, status_code=307)
+            return {"url": url, "expires_in": expires_in, "filename": filename}
+    return stream_s3_object(request, bucket, key, filename, watermark_bpmn=watermark_bpmn)
+
+def s3_error_response(error, status_code=500, message="Failed to download file"):
+    """JSON error for a failed download (missing objects are always 404)"""
+    if isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+        status_code = 404
+    return JSONResponse(status_code=status_code, content={"error": message})
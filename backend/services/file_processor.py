@@ -1,124 +1,344 @@
 import os
+import time
+import hashlib
 import threading
-from utils.text_extraction import extract_text_from_file, extract_text_from_s3
-from utils.s3_utils import upload_output_to_s3, S3_BUCKET
-from agents.bpmn_template_generator import generate_bpmn_template
-from agents.bpmn_template_refiner import refine_bpmn_template
-from agents.bpmn_xml_generator import generate_bpmn_xml
-from agents.bpmn_xml_refiner import refine_bpmn_xml
-from agents.summary_agent import generate_summary
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from config import PIPELINE_MAX_WORKERS, JOB_HEARTBEAT_SECONDS, JOB_STALE_SECONDS
+from utils.text_extraction import extract_text_from_s3_object
+from utils.s3_utils import s3, upload_output_to_s3, list_output_objects, S3_BUCKET
+from agents import bpmn_template_generator, bpmn_template_refiner, bpmn_xml_generator, bpmn_xml_refiner, summary_agent
+from services.pipeline import run_stages
+from services.text_store import get_source_etag, remember_extracted_text
+from services.retrieval import build_index, remember_index, serialize_index, INDEX_OUTPUT_NAME
+from services.job_store import job_store, ACTIVE_STATUSES
+from services.scheduler import scheduler, PRIORITY_INTERACTIVE
+from services.job_events import publish, has_subscribers
+from services.downloads import postprocess_bpmn, served_key, invalidate_served
+from services.results_catalog import record_outputs
+from services.checkpoints import stage_key, save_checkpoint, load_checkpoint
 
-# Global jobs storage
-JOBS = {}
+# Agent DAG: the summary only needs the extracted text, so it runs
+# alongside the template -> refine -> XML -> refine chain.
+# (name, dependencies, output file extension, agent module)
+PIPELINE_STAGES = [
+    ("extracted_text", (), "txt", None),
+    ("bpmn_template", ("extracted_text",), "json", bpmn_template_generator),
+    ("refined_bpmn_template", ("extracted_text", "bpmn_template"), "json", bpmn_template_refiner),
+    ("bpmn_xml", ("refined_bpmn_template",), "xml", bpmn_xml_generator),
+    ("final_bpmn_xml", ("bpmn_xml",), "bpmn", bpmn_xml_refiner),
+    ("summary", ("extracted_text",), "txt", summary_agent)
+]
+AGENT_FUNCTIONS = {
+    "bpmn_template": bpmn_template_generator.generate_bpmn_template,
+    "refined_bpmn_template": bpmn_template_refiner.refine_bpmn_template,
+    "bpmn_xml": bpmn_xml_generator.generate_bpmn_xml,
+    "final_bpmn_xml": bpmn_xml_refiner.refine_bpmn_xml,
+    "summary": summary_agent.generate_summary
+}
+# Served (watermarked) artifacts derived from each BPMN stage output;
+# result.bpmn.xml is a copy of final_bpmn_xml written by save_outputs
+SERVED_OUTPUTS = {
+    "bpmn_xml": ("bpmn_xml.xml",),
+    "final_bpmn_xml": ("final_bpmn_xml.bpmn", "result.bpmn.xml")
+}
+
+def stages_from(stage):
+    """A stage and every stage downstream of it"""
+    selected = {stage}
+    for name, deps, _, _ in PIPELINE_STAGES:
+        if selected.intersection(deps):
+            selected.add(name)
+    return selected
 
 def process_file(job_id, s3_key):
     """Main file processing function that orchestrates all agents using S3"""
     try:
         print(f"[process_file] Starting job {job_id} for S3 key {s3_key}")
-        job = JOBS.get(job_id)
+        job = job_store.get(job_id)
         if job is not None:
             bucket = job.get("bucket")
         else:
             bucket = S3_BUCKET
+        # Source version the outputs are derived from (invalidates stored text when the source changes)
+        source_etag = get_source_etag(bucket, s3_key)
+        job_store.update(job_id, status="processing", started_at=datetime.now().isoformat(), stages={}, source_etag=source_etag, heartbeat_at=time.time())
+        # Skip the LLM response cache when a fresh generation was requested
+        fresh = bool(job and job.get("bypass_llm_cache", False))
+        # Resume: reuse checkpoints whose inputs still match, rerunning from_stage and everything after it
+        resume = bool(job and job.get("resume", False))
+        rerun = stages_from(job["from_stage"]) if job and job.get("from_stage") else set()
+        metadata = {"source-etag": source_etag} if source_etag else None
 
-        # 1. Extract text from S3
-        sop_content = extract_text_from_s3(bucket, s3_key)
-        print(f"[process_file] Extracted text for job {job_id}:\n{sop_content}")
-        JOBS[job_id]["extracted_text"] = sop_content
+        def agent(fn, stage):
+            # Stream the agent's tokens to anyone subscribed to the job's events
+            def on_delta(delta):
+                if has_subscribers(job_id):
+                    publish(job_id, "token", {"stage": stage, "delta": delta})
+            return partial(fn, bypass_cache=fresh, on_delta=on_delta)
 
-        # 2. Agent 1: BPMN Template Generator
-        bpmn_template = generate_bpmn_template(sop_content)
-        JOBS[job_id]["bpmn_template"] = bpmn_template
-        print("[process_file] Agent 1 (BPMN Template Generator) complete.")
+        def checkpointed(name, ext, version, compute):
+            # Each stage output is saved under results/ as soon as it is produced
+            output_name = f"{name}.{ext}"
+            def run(*inputs):
+                key = stage_key(name, version, *inputs)
+                content = None
+                if resume and name not in rerun and version:
+                    content = load_checkpoint(s3_key, output_name, key)
+                    if content is not None:
+                        job_store.set_stage(job_id, name, resumed=True)
+                        print(f"[process_file] Stage '{name}' resumed from checkpoint for job {job_id}")
+                if content is None:
+                    content = compute(*inputs)
+                    if s3_key:
+                        # Served copies of the previous run must not outlive the output they came from
+                        for served_name in SERVED_OUTPUTS.get(name, ()):
+                            invalidate_served(S3_BUCKET, f"results/{s3_key}/{served_name}")
+                        save_checkpoint(s3_key, output_name, content, key, metadata)
+                        try:
+                            record_outputs(s3_key)
+                        except Exception as e:
+                            print(f"[process_file] Error recording checkpoint '{output_name}' in the results catalog: {e}")
+                if s3_key:
+                    job_store.update(job_id, **{f"{name}_s3_key": f"results/{s3_key}/{output_name}"})
+                return content
+            return run
 
-        # 3. Agent 2: BPMN Template Refiner
-        refined_template = refine_bpmn_template(sop_content, bpmn_template)
-        JOBS[job_id]["refined_bpmn_template"] = refined_template
-        print("[process_file] Agent 2 (BPMN Template Refiner) complete.")
+        stages = []
+        for name, deps, ext, module in PIPELINE_STAGES:
+            if module is None:
+                # Text extraction is versioned by the source document itself
+                compute, version = (lambda: extract_text_from_s3_object(bucket, s3_key)), source_etag
+            else:
+                compute, version = agent(AGENT_FUNCTIONS[name], name), module.PROMPT_VERSION
+            stages.append((name, deps, checkpointed(name, ext, version, compute)))
 
-        # 4. Agent 3: BPMN XML Generator
-        bpmn_xml = generate_bpmn_xml(refined_template)
-        JOBS[job_id]["bpmn_xml"] = bpmn_xml
-        print(f"[process_file] Agent 3 (BPMN XML Generator) complete. XML length: {len(bpmn_xml) if bpmn_xml else 0} chars")
+        def on_stage_start(name):
+            job_store.set_stage(job_id, name, started_at=datetime.now().isoformat(), finished_at=None)
 
-        # 5. Agent 4: BPMN XML Refiner
-        final_bpmn_xml = refine_bpmn_xml(bpmn_xml)
-        
+        def on_stage_end(name, result):
+            # Outputs live under results/; the job record keeps only their sizes so status reads stay small
+            job_store.set_stage(job_id, name, finished_at=datetime.now().isoformat(), chars=len(result or ""))
+            print(f"[process_file] Stage '{name}' complete for job {job_id}. Output length: {len(result) if result else 0} chars")
 
-        
-        JOBS[job_id]["final_bpmn_xml"] = final_bpmn_xml
-        print(f"[process_file] Agent 4 (BPMN XML Refiner) complete. XML length: {len(final_bpmn_xml) if final_bpmn_xml else 0} chars")
+        results = run_stages(stages, max_workers=PIPELINE_MAX_WORKERS, on_start=on_stage_start, on_end=on_stage_end)
+
+        remember_extracted_text(bucket, s3_key, source_etag, results["extracted_text"])
 
-        # 6. Agent 5: Summary Agent
-        summary = generate_summary(sop_content)
-        JOBS[job_id]["summary"] = summary
-        print("[process_file] Agent 5 (Summary) complete.")
+        # Build the chat retrieval index once per job
+        retrieval_index = build_index(results["extracted_text"], source_etag)
+        remember_index(s3_key, retrieval_index)
 
-        # 7. Save all outputs to files
-        save_outputs(job_id, s3_key, sop_content, bpmn_template, refined_template, bpmn_xml, final_bpmn_xml, summary)
+        # Save the remaining outputs (stage outputs are already checkpointed)
+        save_outputs(
+            job_id, s3_key,
+            results["extracted_text"], results["bpmn_template"], results["refined_bpmn_template"],
+            results["bpmn_xml"], results["final_bpmn_xml"], results["summary"],
+            retrieval_index=retrieval_index,
+            checkpointed=[f"{name}.{ext}" for name, _, ext, _ in PIPELINE_STAGES]
+        )
 
-        # 8. Mark job as completed
-        JOBS[job_id]["status"] = "completed"
+        # Mark job as completed
+        job_store.update(job_id, status="completed", completed_at=datetime.now().isoformat())
         print(f"[process_file] Job {job_id} completed successfully.")
 
     except Exception as e:
         print(f"[process_file] Error processing job {job_id}: {e}")
-        JOBS[job_id]["status"] = "failed"
-        JOBS[job_id]["error"] = str(e)
+        job_store.update(job_id, status="failed", error=str(e))
 
-def save_outputs(job_id, s3_key, sop_content, bpmn_template, refined_template, bpmn_xml, final_bpmn_xml, summary):
-    """Save all intermediate outputs to S3 only"""
-    outputs = [
-        ("extracted_text", sop_content or "", "txt"),
-        ("bpmn_template", bpmn_template or "", "json"),
-        ("refined_bpmn_template", refined_template or "", "json"),
-        ("bpmn_xml", bpmn_xml or "", "xml"),
-        ("final_bpmn_xml", final_bpmn_xml or "", "bpmn"),
-        ("summary", summary or "", "txt")
-    ]
+# Job fields and file names of the outputs every complete run writes under results/<key>/
+RESULT_OUTPUTS = [
+    ("extracted_text_s3_key", "extracted_text.txt"),
+    ("bpmn_template_s3_key", "bpmn_template.json"),
+    ("refined_bpmn_template_s3_key", "refined_bpmn_template.json"),
+    ("bpmn_xml_s3_key", "bpmn_xml.xml"),
+    ("final_bpmn_xml_s3_key", "final_bpmn_xml.bpmn"),
+    ("summary_s3_key", "summary.txt"),
+    ("result_s3_key", "result.bpmn.xml")
+]
 
-    for output_name, content, ext in outputs:
-        # Create temporary file for S3 upload
-        temp_file_path = os.path.join("/tmp", f"{job_id}_{output_name}.{ext}")
+def _upload_output(job_id, s3_key, output_name, content, ext, job_field, metadata=None):
+    """Write one output to a temp file and upload it to S3"""
+    temp_file_path = os.path.join("/tmp", f"{job_id}_{output_name}.{ext}")
+    try:
         with open(temp_file_path, "w") as f:
             f.write(content)
         
         # Upload to S3
         if s3_key:
-            upload_output_to_s3(temp_file_path, s3_key, f"{output_name}.{ext}")
+            upload_output_to_s3(temp_file_path, s3_key, f"{output_name}.{ext}", metadata)
         
         # Store S3 reference in job (not local path)
-        JOBS[job_id][f"{output_name}_s3_key"] = f"results/{s3_key}/{output_name}.{ext}"
-        
+        job_store.update(job_id, **{job_field: f"results/{s3_key}/{output_name}.{ext}"})
+    finally:
         # Clean up temp file
-        os.remove(temp_file_path)
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+def _upload_retrieval_index(job_id, s3_key, index_data, metadata=None):
+    """Upload the serialised chat retrieval index next to the other outputs"""
+    output_key = f"results/{s3_key}/{INDEX_OUTPUT_NAME}"
+    extra_args = {"Metadata": metadata} if metadata else {}
+    s3.put_object(Bucket=S3_BUCKET, Key=output_key, Body=index_data, **extra_args)
+    job_store.update(job_id, retrieval_index_s3_key=output_key)
+
+def _upload_served_artifact(job_id, s3_key, output_name, content, job_field, generated_on, metadata=None):
+    """Upload the cleaned and watermarked copy of a BPMN output that downloads serve as-is"""
+    served = postprocess_bpmn(content, generated_on)
+    digest = hashlib.sha256(served).hexdigest()
+    s3.put_object(
+        Bucket=S3_BUCKET,
+        Key=served_key(f"results/{s3_key}/{output_name}"),
+        Body=served,
+        ContentType="application/xml",
+        Metadata={**(metadata or {}), "content-sha256": digest}
+    )
+    job_store.update(job_id, **{job_field.replace("_s3_key", "_sha256"): digest})
+
+def save_outputs(job_id, s3_key, sop_content, bpmn_template, refined_template, bpmn_xml, final_bpmn_xml, summary,
+                 retrieval_index=None, checkpointed=()):
+    """Save all intermediate outputs to S3 only (outputs named in checkpointed are already uploaded)"""
+    outputs = [
+        ("extracted_text", sop_content or "", "txt", "extracted_text_s3_key"),
+        ("bpmn_template", bpmn_template or "", "json", "bpmn_template_s3_key"),
+        ("refined_bpmn_template", refined_template or "", "json", "refined_bpmn_template_s3_key"),
+        ("bpmn_xml", bpmn_xml or "", "xml", "bpmn_xml_s3_key"),
+        ("final_bpmn_xml", final_bpmn_xml or "", "bpmn", "final_bpmn_xml_s3_key"),
+        ("summary", summary or "", "txt", "summary_s3_key"),
+        # Final result
+        ("result.bpmn", final_bpmn_xml or "", "xml", "result_s3_key")
+    ]
 
-    # Save final result to S3
-    temp_result_path = os.path.join("/tmp", f"{job_id}.bpmn.xml")
-    with open(temp_result_path, "w") as f:
-        f.write(final_bpmn_xml or "")
-    
+    source_etag = (job_store.get(job_id) or {}).get("source_etag")
+    metadata = {"source-etag": source_etag} if source_etag else None
+
+    # The uploads are independent of each other, so run them concurrently
+    with ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(_upload_output, job_id, s3_key, output_name, content, ext, job_field, metadata)
+            for output_name, content, ext, job_field in outputs
+            if f"{output_name}.{ext}" not in checkpointed or not s3_key
+        ]
+        # BPMN downloads are cleaned and watermarked once here rather than per request
+        if s3_key:
+            generated_on = datetime.now()
+            futures += [
+                executor.submit(_upload_served_artifact, job_id, s3_key, f"{output_name}.{ext}", content, job_field, generated_on, metadata)
+                for output_name, content, ext, job_field in outputs
+                if ext in ("xml", "bpmn")
+            ]
+        index_data = serialize_index(retrieval_index) if retrieval_index is not None and s3_key else None
+        if index_data is not None:
+            futures.append(executor.submit(_upload_retrieval_index, job_id, s3_key, index_data, metadata))
+        for future in futures:
+            future.result()
+
+    # Keep the results catalog current without relisting the bucket
     if s3_key:
-        upload_output_to_s3(temp_result_path, s3_key, "result.bpmn.xml")
-    
-    JOBS[job_id]["result_s3_key"] = f"results/{s3_key}/result.bpmn.xml"
-    
-    # Clean up temp file
-    os.remove(temp_result_path)
-
-def start_processing(job_id, s3_key, bucket=None, original_s3_key=None):
-    """Start file processing in a background thread using S3"""
-    JOBS[job_id] = {
-        "status": "processing", 
+        record_outputs(s3_key)
+
+def start_processing(job_id, s3_key, bucket=None, original_s3_key=None, bypass_llm_cache=False,
+                     priority=PRIORITY_INTERACTIVE, user=None, resume=False, from_stage=None):
+    """
+    Queue file processing on the bounded job scheduler using S3.
+    resume reuses valid stage checkpoints from earlier runs; from_stage
+    (which implies resume) reruns that stage and everything downstream of it.
+    """
+    job_store.put(job_id, {
+        "status": "queued", 
         "s3_key": s3_key, 
-        "bucket": bucket or S3_BUCKET
-    }
-    threading.Thread(target=process_file, args=(job_id, s3_key)).start()
+        "bucket": bucket or S3_BUCKET,
+        "bypass_llm_cache": bypass_llm_cache,
+        "priority": priority,
+        "user": user,
+        "resume": resume or bool(from_stage),
+        "from_stage": from_stage,
+        "created_at": datetime.now().isoformat(),
+        "heartbeat_at": time.time()
+    })
+    _ensure_heartbeat()
+    scheduler.submit(job_id, process_file, (job_id, s3_key), priority=priority, user=user)
+
+def get_queue_position(job_id):
+    """Position of a queued job in the scheduler (None once it has started)"""
+    return scheduler.queue_position(job_id)
+
+def shutdown_processing(timeout=30):
+    """Drain the scheduler: finish running jobs and fail the ones that never started"""
+    def abandon(job_id):
+        job_store.update(job_id, status="failed", error="Server shut down before the job started; please reprocess")
+    return scheduler.shutdown(timeout, on_abandoned=abandon)
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        for job_id in scheduler.job_ids():
+            try:
+                job_store.heartbeat(job_id)
+            except Exception as e:
+                print(f"[heartbeat] Error refreshing job {job_id}: {e}")
+
+_heartbeat_thread = None
+_heartbeat_lock = threading.Lock()
+
+def _ensure_heartbeat():
+    """Start the thread that keeps this worker's queued and running jobs from looking orphaned"""
+    global _heartbeat_thread
+    with _heartbeat_lock:
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="job-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
+def fail_if_orphaned(job_id, job):
+    """
+    Mark an active job failed when no worker has refreshed its heartbeat
+    within JOB_STALE_SECONDS (its worker crashed, was redeployed or timed out
+    on shutdown). Returns the current job record.
+    """
+    if not job or job.get("status") not in ACTIVE_STATUSES:
+        return job
+    # Records written before heartbeats existed only have updated_at (if that)
+    last_seen = job.get("heartbeat_at", job.get("updated_at", 0))
+    if time.time() - last_seen <= JOB_STALE_SECONDS:
+        return job
+    print(f"[fail_if_orphaned] Job {job_id} has no live worker (last heartbeat {last_seen}), marking it failed")
+    return job_store.update(job_id, status="failed", error="The server stopped before the job finished; please reprocess") or job
 
 def get_job_status(job_id):
     """Get the status of a job"""
-    return JOBS.get(job_id)
+    return fail_if_orphaned(job_id, job_store.get(job_id))
 
 def get_job(job_id):
     """Get a job by ID"""
-    return JOBS.get(job_id) 
\ No newline at end of file
+    return job_store.get(job_id)
+
+def get_latest_job_for_key(s3_key):
+    """Get (job_id, job) of the most recent job for a source S3 key"""
+    return job_store.find_by_s3_key(s3_key)
+
+def find_reusable_job(s3_key):
+    """
+    Job ID to attach to instead of processing a source key again: a queued or
+    running job for it (unless it was orphaned), or a job registered for its existing results (None if
+    neither exists).
+    """
+    latest_job_id, latest_job = job_store.find_by_s3_key(s3_key)
+    latest_job = fail_if_orphaned(latest_job_id, latest_job)
+    if latest_job and latest_job.get("status") in ACTIVE_STATUSES:
+        return latest_job_id
+    # One prefix listing instead of a HEAD per output
+    existing = list_output_objects(s3_key)
+    if all(output_name in existing for _, output_name in RESULT_OUTPUTS):
+        return register_existing_results(s3_key, {
+            job_field: f"results/{s3_key}/{output_name}" for job_field, output_name in RESULT_OUTPUTS
+        })
+    return None
+
+def register_existing_results(s3_key, output_keys):
+    """Record a completed job for results that already exist in S3, with a deterministic job ID"""
+    job_id = f"s3_{s3_key.replace('/', '_')}"
+    job = {"status": "completed", "s3_key": s3_key, "bucket": S3_BUCKET}
+    job.update(output_keys)
+    job_store.put(job_id, job)
+    return job_id 
\ No newline at end of file
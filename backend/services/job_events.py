@@ -0,0 +1,146 @@
+import json
+import asyncio
+import threading
+from datetime import datetime
+
+TERMINAL_STATUSES = ("completed", "failed")
+# Messages buffered per subscriber; a slower client is resynced from the job record instead
+SUBSCRIBER_QUEUE_MAX = 1000
+
+_subscribers = {}
+_lock = threading.Lock()
+
+def publish(job_id, event, data):
+    """Publish an event to every subscriber of a job (safe to call from any thread)"""
+    message = _message(event, data)
+    with _lock:
+        subscribers = list(_subscribers.get(job_id, ()))
+    for loop, queue in subscribers:
+        try:
+            loop.call_soon_threadsafe(_deliver, queue, message)
+        except RuntimeError:
+            # The subscriber's event loop has already closed
+            pass
+
+def _deliver(queue, message):
+    """Queue a message for one subscriber (runs on the subscriber's event loop)"""
+    if queue.full():
+        # Too far behind: drop its backlog and have it re-read the job instead
+        while not queue.empty():
+            queue.get_nowait()
+        message = _message("resync", {})
+    queue.put_nowait(message)
+
+def has_subscribers(job_id):
+    """Check if anyone is listening to a job (lets producers skip per-token work)"""
+    with _lock:
+        return bool(_subscribers.get(job_id))
+
+def subscribe(job_id):
+    """Subscribe to a job from the running event loop. Returns (loop, queue)."""
+    subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_MAX))
+    with _lock:
+        _subscribers.setdefault(job_id, []).append(subscriber)
+    return subscriber
+
+def unsubscribe(job_id, subscriber):
+    with _lock:
+        subscribers = _subscribers.get(job_id, [])
+        if subscriber in subscribers:
+            subscribers.remove(subscriber)
+        if not subscribers:
+            _subscribers.pop(job_id, None)
+
+def job_status_event(job):
+    """Public status view of a job record (used by /status and the event bus)"""
+    event = {"status": job.get("status"), "version": job.get("version", 0)}
+    if job.get("status") == "failed" and job.get("error"):
+        event["error"] = job["error"]
+    return event
+
+def _message(event, data):
+    return {"event": event, "data": data, "timestamp": datetime.now().isoformat()}
+
+async def _load(load_job):
+    return await asyncio.get_running_loop().run_in_executor(None, load_job)
+
+def format_sse(message):
+    """Format an event as a Server-Sent Events frame"""
+    return f"event: {message['event']}\ndata: {json.dumps(message)}\n\n"
+
+async def iter_job_events(job_id, load_job, recheck=15):
+    """
+    Async generator of a job's event messages, starting with a snapshot of the
+    job and ending once it completes or fails. Yields None every recheck seconds
+    without events (for keepalives); at that point the job is re-read so that
+    transitions made by other workers are still delivered.
+    """
+    subscriber = subscribe(job_id)
+    queue = subscriber[1]
+    try:
+        job = await _load(load_job)
+        if job is None:
+            return
+        version = job.get("version", 0)
+        snapshot = job_status_event(job)
+        snapshot["stages"] = job.get("stages", {})
+        yield _message("status", snapshot)
+        if job.get("status") in TERMINAL_STATUSES:
+            return
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=recheck)
+            except asyncio.TimeoutError:
+                message = None
+            if message is None or message["event"] == "resync":
+                job = await _load(load_job)
+                if job is not None and job.get("version", 0) > version:
+                    message = _message("status", job_status_event(job))
+                else:
+                    if message is None:
+                        yield None
+                    continue
+            elif message["data"].get("version", version + 1) <= version:
+                # Already reflected in the snapshot (published between subscribing and loading it)
+                continue
+            version = max(version, message["data"].get("version", 0))
+            yield message
+            if message["event"] == "status" and message["data"].get("status") in TERMINAL_STATUSES:
+                return
+    finally:
+        unsubscribe(job_id, subscriber)
+
+async def stream_job_events(job_id, load_job, keepalive=15):
+    """Async generator of SSE frames for a job (see iter_job_events)"""
+    async for message in iter_job_events(job_id, load_job, keepalive):
+        if message is None:
+            # Comment frame keeps proxies from closing an idle connection
+            yield ": keepalive\n\n"
+        else:
+            yield format_sse(message)
+
+async def wait_for_job_change(job_id, load_job, since, timeout, recheck=5):
+    """
+    Long-poll helper: return the job once its version is newer than since, or
+    the current job when timeout seconds pass without a change.
+    """
+    subscriber = subscribe(job_id)
+    queue = subscriber[1]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            job = await _load(load_job)
+            if job is None or job.get("version", 0) > since or loop.time() >= deadline:
+                return job
+            # A local status/stage event triggers a re-read; other workers' writes are caught by the recheck
+            recheck_at = min(loop.time() + recheck, deadline)
+            try:
+                while True:
+                    message = await asyncio.wait_for(queue.get(), timeout=max(0, recheck_at - loop.time()))
+                    if message["event"] != "token":
+                        break
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        unsubscribe(job_id, subscriber)
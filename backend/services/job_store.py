@@ -0,0 +1,324 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from config import S3_BUCKET, JOB_STORE_BACKEND, JOB_STORE_PATH, JOB_STORE_S3_PREFIX, JOB_TTL_SECONDS
+from utils.aws_clients import get_s3_client
+from services.job_events import publish, job_status_event
+
+# Jobs in these states are never evicted
+ACTIVE_STATUSES = ("queued", "processing")
+# How often (seconds) a store sweeps expired jobs as a side effect of writes
+EVICTION_INTERVAL = 600
+
+class JobStore:
+    """
+    Pluggable job storage. Job records are plain JSON-serialisable dicts with
+    at least "status" and "s3_key", plus a "version" that increases on every
+    write. Status and stage transitions are published to the job event bus.
+    Backends implement _load, _save, _modify, find_by_s3_key and
+    evict_expired; _modify must apply its callback atomically.
+    """
+
+    def __init__(self, ttl_seconds=JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._last_eviction = time.monotonic()
+
+    def get(self, job_id):
+        """Get a job record (None if unknown)"""
+        return self._load(job_id)
+
+    def put(self, job_id, job):
+        """Create or replace a job record"""
+        job = dict(job)
+        previous = self._load(job_id)
+        job["version"] = (previous or {}).get("version", 0) + 1
+        self._save(job_id, job)
+        publish(job_id, "status", job_status_event(job))
+        self._maybe_evict()
+
+    def update(self, job_id, **fields):
+        """Merge fields into a job record and return the updated record"""
+        previous = {}
+        def apply(job):
+            previous["status"] = job.get("status")
+            job.update(fields)
+            job["version"] = job.get("version", 0) + 1
+        job = self._modify(job_id, apply)
+        if job is not None and job.get("status") != previous.get("status"):
+            publish(job_id, "status", job_status_event(job))
+        return job
+
+    def set_stage(self, job_id, stage, **fields):
+        """Merge fields into job["stages"][stage] (e.g. started_at / finished_at)"""
+        def apply(job):
+            stages = job.setdefault("stages", {})
+            stages.setdefault(stage, {}).update(fields)
+            job["version"] = job.get("version", 0) + 1
+        job = self._modify(job_id, apply)
+        if job is not None:
+            state = "finished" if job["stages"][stage].get("finished_at") else "started"
+            publish(job_id, "stage", {"stage": stage, "state": state, "version": job["version"]})
+        return job
+
+    def heartbeat(self, job_id):
+        """Record that a worker still holds the job (does not bump the version or wake watchers)"""
+        def apply(job):
+            job["heartbeat_at"] = time.time()
+        return self._modify(job_id, apply)
+
+    def _maybe_evict(self):
+        if time.monotonic() - self._last_eviction < EVICTION_INTERVAL:
+            return
+        self._last_eviction = time.monotonic()
+        try:
+            evicted = self.evict_expired()
+            if evicted:
+                print(f"[job_store] Evicted {evicted} expired jobs")
+        except Exception as e:
+            print(f"[job_store] Error evicting expired jobs: {e}")
+
+    def _load(self, job_id):
+        raise NotImplementedError
+
+    def _save(self, job_id, job):
+        raise NotImplementedError
+
+    def _modify(self, job_id, apply):
+        raise NotImplementedError
+
+    def find_by_s3_key(self, s3_key):
+        """Get (job_id, job) of the most recently updated job for a source key, or (None, None)"""
+        raise NotImplementedError
+
+    def evict_expired(self):
+        """Delete finished jobs older than the TTL; returns the number evicted"""
+        raise NotImplementedError
+
+class MemoryJobStore(JobStore):
+    """In-process store (single worker only; jobs are lost on restart)"""
+
+    def __init__(self, ttl_seconds=JOB_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _load(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job is not None else None
+
+    def _save(self, job_id, job):
+        job["updated_at"] = time.time()
+        with self._lock:
+            self._jobs[job_id] = job
+
+    def _modify(self, job_id, apply):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            apply(job)
+            job["updated_at"] = time.time()
+            return json.loads(json.dumps(job))
+
+    def find_by_s3_key(self, s3_key):
+        with self._lock:
+            matches = [(job.get("updated_at", 0), job_id) for job_id, job in self._jobs.items() if job.get("s3_key") == s3_key]
+        if not matches:
+            return None, None
+        job_id = max(matches)[1]
+        return job_id, self._load(job_id)
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.get("status") not in ACTIVE_STATUSES and job.get("updated_at", 0) < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+class SQLiteJobStore(JobStore):
+    """SQLite (WAL) store shared by all uvicorn workers on one node"""
+
+    def __init__(self, path=JOB_STORE_PATH, ttl_seconds=JOB_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, s3_key TEXT, status TEXT, data TEXT NOT NULL, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_s3_key ON jobs(s3_key, updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_updated ON jobs(status, updated_at)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # Autocommit mode; transactions are opened explicitly where needed
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _load(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return json.loads(row[0]) if row else None
+        finally:
+            conn.close()
+
+    def _save(self, job_id, job):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (job_id, s3_key, status, data, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(job_id) DO UPDATE SET s3_key = excluded.s3_key, status = excluded.status, "
+                "data = excluded.data, updated_at = excluded.updated_at",
+                (job_id, job.get("s3_key"), job.get("status"), json.dumps(job), now, now)
+            )
+        finally:
+            conn.close()
+
+    def _modify(self, job_id, apply):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            job = json.loads(row[0])
+            apply(job)
+            conn.execute(
+                "UPDATE jobs SET s3_key = ?, status = ?, data = ?, updated_at = ? WHERE job_id = ?",
+                (job.get("s3_key"), job.get("status"), json.dumps(job), time.time(), job_id)
+            )
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def find_by_s3_key(self, s3_key):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT job_id, data FROM jobs WHERE s3_key = ? ORDER BY updated_at DESC LIMIT 1", (s3_key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return (row[0], json.loads(row[1])) if row else (None, None)
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        placeholders = ", ".join("?" for _ in ACTIVE_STATUSES)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"DELETE FROM jobs WHERE updated_at < ? AND status NOT IN ({placeholders})",
+                (cutoff, *ACTIVE_STATUSES)
+            )
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+class S3JobStore(JobStore):
+    """
+    S3/JSON store shared across nodes: one object per job plus a per-source-key
+    pointer for lookups by s3_key. Writes are atomic within a process only.
+    """
+
+    def __init__(self, bucket=S3_BUCKET, prefix=JOB_STORE_S3_PREFIX, ttl_seconds=JOB_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+        self._lock = threading.Lock()
+
+    def _job_key(self, job_id):
+        return f"{self.prefix}/{job_id}.json"
+
+    def _pointer_key(self, s3_key):
+        return f"{self.prefix}/by_s3_key/{hashlib.sha256(s3_key.encode('utf-8')).hexdigest()}.json"
+
+    def _load(self, job_id):
+        try:
+            response = get_s3_client().get_object(Bucket=self.bucket, Key=self._job_key(job_id))
+        except Exception:
+            return None
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+    def _write(self, job_id, job):
+        job["updated_at"] = time.time()
+        s3 = get_s3_client()
+        s3.put_object(Bucket=self.bucket, Key=self._job_key(job_id), Body=json.dumps(job), ContentType='application/json')
+        if job.get("s3_key"):
+            s3.put_object(
+                Bucket=self.bucket,
+                Key=self._pointer_key(job["s3_key"]),
+                Body=json.dumps({"job_id": job_id}),
+                ContentType='application/json'
+            )
+
+    def _save(self, job_id, job):
+        with self._lock:
+            self._write(job_id, job)
+
+    def _modify(self, job_id, apply):
+        with self._lock:
+            job = self._load(job_id)
+            if job is None:
+                return None
+            apply(job)
+            self._write(job_id, job)
+            return job
+
+    def find_by_s3_key(self, s3_key):
+        try:
+            response = get_s3_client().get_object(Bucket=self.bucket, Key=self._pointer_key(s3_key))
+            job_id = json.loads(response['Body'].read().decode('utf-8'))["job_id"]
+        except Exception:
+            return None, None
+        job = self._load(job_id)
+        return (job_id, job) if job is not None else (None, None)
+
+    def evict_expired(self):
+        s3 = get_s3_client()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        evicted = 0
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/"):
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                if "/by_s3_key/" in key or obj["LastModified"] >= cutoff:
+                    continue
+                job_id = key[len(self.prefix) + 1:-len(".json")]
+                job = self._load(job_id)
+                if job is None or job.get("status") in ACTIVE_STATUSES:
+                    continue
+                s3.delete_object(Bucket=self.bucket, Key=key)
+                evicted += 1
+        return evicted
+
+def create_job_store(backend=JOB_STORE_BACKEND):
+    """Create the job store configured by JOB_STORE_BACKEND (sqlite, s3 or memory)"""
+    if backend == "sqlite":
+        return SQLiteJobStore()
+    if backend == "s3":
+        return S3JobStore()
+    if backend == "memory":
+        return MemoryJobStore()
+    raise ValueError(f"Unknown JOB_STORE_BACKEND: {backend}")
+
+# Process-wide job store
+job_store = create_job_store()
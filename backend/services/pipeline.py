@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+def run_stages(stages, max_workers=4, on_start=None, on_end=None):
+    """
+    Run a dependency graph of stages on a bounded thread pool.
+
+    stages is a list of (name, deps, fn) tuples. Each fn is called with the
+    results of its deps as positional arguments, and a stage starts as soon as
+    all of its deps have finished. on_start(name) / on_end(name, result) are
+    called from the worker thread around each stage. Returns a dict of
+    name -> result. The first stage error stops new stages from starting and
+    is re-raised once the running stages have finished.
+    """
+    names = [name for name, _, _ in stages]
+    for name, deps, _ in stages:
+        for dep in deps:
+            if dep not in names:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+
+    results = {}
+    pending = list(stages)
+    running = {}
+    error = None
+
+    def run(name, fn, args):
+        if on_start:
+            on_start(name)
+        result = fn(*args)
+        if on_end:
+            on_end(name, result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if error is None:
+                for stage in list(pending):
+                    name, deps, fn = stage
+                    if all(dep in results for dep in deps):
+                        pending.remove(stage)
+                        args = [results[dep] for dep in deps]
+                        running[executor.submit(run, name, fn, args)] = name
+            if not running:
+                if pending and error is None:
+                    raise ValueError(f"Stages have circular dependencies: {[s[0] for s in pending]}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+
+    if error is not None:
+        raise error
+    return results
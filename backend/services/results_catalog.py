@@ -0,0 +1,203 @@
+import json
+import time
+import bisect
+import hashlib
+import threading
+from datetime import datetime
+from config import S3_BUCKET, RESULTS_CATALOG_PREFIX, RESULTS_CATALOG_SYNC_SECONDS, RESULTS_CATALOG_REBUILD_SECONDS
+from utils.aws_clients import get_s3_client
+from utils.s3_utils import list_output_objects
+
+# In-process aggregate of every input's outputs under results/:
+# entries[s3_key][output_name] = {"last_modified": datetime, "size": int}
+_catalog = {
+    "entries": {},
+    "keys": [],
+    "manifest_etags": {},
+    "loaded": False,
+    "synced_at": 0.0,
+    "rebuilt_at": 0.0
+}
+_lock = threading.RLock()
+# Held while the catalog is first loaded, so concurrent first callers share one listing
+_load_lock = threading.Lock()
+# Serialises listing + manifest writes per input (striped, so the set stays bounded)
+_manifest_locks = [threading.Lock() for _ in range(64)]
+
+def _manifest_key(s3_key):
+    return f"{RESULTS_CATALOG_PREFIX.rstrip('/')}/{hashlib.sha256(s3_key.encode('utf-8')).hexdigest()}.json"
+
+def _set_entry(s3_key, outputs):
+    """Replace one input's outputs in the in-process catalog (caller holds _lock)"""
+    if s3_key not in _catalog["entries"]:
+        bisect.insort(_catalog["keys"], s3_key)
+    _catalog["entries"][s3_key] = outputs
+
+def _remove_entry(s3_key):
+    """Drop one input from the in-process catalog (caller holds _lock)"""
+    if _catalog["entries"].pop(s3_key, None) is not None:
+        del _catalog["keys"][bisect.bisect_left(_catalog["keys"], s3_key)]
+
+def _list_manifests(paginator):
+    """ETags of every manifest under the catalog prefix: {manifest_key: etag}"""
+    manifest_etags = {}
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=RESULTS_CATALOG_PREFIX):
+        for obj in page.get("Contents", []):
+            manifest_etags[obj["Key"]] = obj["ETag"]
+    return manifest_etags
+
+def rebuild_catalog():
+    """
+    Rebuild the catalog from a full, paginated listing of results/. The
+    listing runs without _lock, so lookups keep being served from the current
+    catalog until the new one is swapped in.
+    """
+    entries = {}
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix="results/"):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith("/"):
+                continue
+            # The output name is the last path segment; the input key may contain slashes
+            input_s3_key, _, output_name = key[len("results/"):].rpartition("/")
+            if not input_s3_key:
+                continue
+            entries.setdefault(input_s3_key, {})[output_name] = {
+                "last_modified": obj.get("LastModified"),
+                "size": obj.get("Size")
+            }
+    # The listing above already reflects every manifest written so far; one written
+    # after it has a newer ETag than listed here, so the next sync merges it back in
+    manifest_etags = _list_manifests(paginator)
+    with _lock:
+        _catalog["entries"] = entries
+        _catalog["keys"] = sorted(entries)
+        _catalog["manifest_etags"] = manifest_etags
+        _catalog["loaded"] = True
+        _catalog["synced_at"] = _catalog["rebuilt_at"] = time.monotonic()
+    print(f"[results_catalog] Rebuilt catalog with {len(entries)} inputs")
+
+def _sync_manifests():
+    """
+    Merge manifests written by other workers since the last sync, and drop
+    inputs whose manifest was deleted (one listing of the catalog prefix)
+    """
+    s3 = get_s3_client()
+    with _lock:
+        known = dict(_catalog["manifest_etags"])
+    # Only manifests known before the listing can be missing from it
+    listed = _list_manifests(s3.get_paginator('list_objects_v2'))
+    changed = [(key, etag) for key, etag in listed.items() if known.get(key) != etag]
+    removed = set(known) - set(listed)
+    for manifest_key, etag in changed:
+        try:
+            response = s3.get_object(Bucket=S3_BUCKET, Key=manifest_key)
+            manifest = json.loads(response['Body'].read().decode('utf-8'))
+        except Exception as e:
+            print(f"[results_catalog] Error reading manifest {manifest_key}: {e}")
+            continue
+        outputs = {
+            name: {"last_modified": datetime.fromisoformat(info["last_modified"]), "size": info["size"]}
+            for name, info in manifest["outputs"].items()
+        }
+        with _lock:
+            _set_entry(manifest["s3_key"], outputs)
+            _catalog["manifest_etags"][manifest_key] = etag
+    if removed:
+        with _lock:
+            for s3_key in [key for key in _catalog["entries"] if _manifest_key(key) in removed]:
+                _remove_entry(s3_key)
+            for manifest_key in removed:
+                _catalog["manifest_etags"].pop(manifest_key, None)
+        print(f"[results_catalog] Dropped {len(removed)} inputs whose manifests were deleted")
+
+def _ensure_fresh():
+    """Load the catalog on first use, then periodically merge other workers' updates and rebuild it"""
+    with _lock:
+        loaded = _catalog["loaded"]
+        now = time.monotonic()
+        rebuild = loaded and now - _catalog["rebuilt_at"] >= RESULTS_CATALOG_REBUILD_SECONDS
+        sync = loaded and now - _catalog["synced_at"] >= RESULTS_CATALOG_SYNC_SECONDS
+        if rebuild or sync:
+            # Only one caller refreshes; the others keep serving the current catalog
+            _catalog["synced_at"] = now
+            if rebuild:
+                _catalog["rebuilt_at"] = now
+    if not loaded:
+        with _load_lock:
+            with _lock:
+                loaded = _catalog["loaded"]
+            if not loaded:
+                rebuild_catalog()
+        return
+    try:
+        if rebuild:
+            rebuild_catalog()
+        elif sync:
+            _sync_manifests()
+    except Exception as e:
+        print(f"[results_catalog] Error refreshing the catalog: {e}")
+
+def record_outputs(s3_key):
+    """
+    Record the outputs under results/<s3_key>/ after some of them were
+    written. Their LastModified and size come from one listing of that
+    prefix, so the catalog carries S3's own timestamps. Updates the
+    in-process catalog and the input's manifest.
+    """
+    _ensure_fresh()
+    manifest_key = _manifest_key(s3_key)
+    with _manifest_locks[hash(s3_key) % len(_manifest_locks)]:
+        outputs = {
+            name: {"last_modified": obj["LastModified"], "size": obj["Size"]}
+            for name, obj in list_output_objects(s3_key).items()
+        }
+        with _lock:
+            _set_entry(s3_key, outputs)
+        manifest = {
+            "s3_key": s3_key,
+            "outputs": {
+                name: {"last_modified": info["last_modified"].isoformat(), "size": info["size"]}
+                for name, info in outputs.items()
+            }
+        }
+        response = get_s3_client().put_object(
+            Bucket=S3_BUCKET,
+            Key=manifest_key,
+            Body=json.dumps(manifest),
+            ContentType='application/json'
+        )
+    with _lock:
+        _catalog["manifest_etags"][manifest_key] = response.get("ETag")
+
+def get_outputs(s3_key):
+    """Outputs recorded for an input: {output_name: {"last_modified", "size"}} (empty if none)"""
+    _ensure_fresh()
+    with _lock:
+        return dict(_catalog["entries"].get(s3_key, {}))
+
+def list_results(cursor=None, limit=None):
+    """
+    Page through inputs that have results, ordered by key. Returns
+    ([(s3_key, outputs)], next_cursor); next_cursor is None on the last page.
+    """
+    _ensure_fresh()
+    with _lock:
+        keys = _catalog["keys"]
+        start = bisect.bisect_right(keys, cursor) if cursor else 0
+        end = len(keys) if limit is None else min(len(keys), start + limit)
+        page = [(key, dict(_catalog["entries"][key])) for key in keys[start:end]]
+        next_cursor = keys[end - 1] if end < len(keys) and end > start else None
+    return page, next_cursor
+
+def summarize_outputs(outputs):
+    """Timestamp summary of an input's outputs (last_modified, files_count, latest_file)"""
+    summary = {"last_modified": None, "files_count": 0, "latest_file": None}
+    for output_name, info in outputs.items():
+        if info.get("last_modified"):
+            if summary["last_modified"] is None or info["last_modified"] > summary["last_modified"]:
+                summary["last_modified"] = info["last_modified"]
+                summary["latest_file"] = output_name
+            summary["files_count"] += 1
+    return summary
@@ -0,0 +1,163 @@
+import io
+import re
+import zlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import RETRIEVAL_CHUNK_CHARS, RETRIEVAL_CHUNK_OVERLAP, RETRIEVAL_TOP_K, RETRIEVAL_EMBEDDING_MODEL
+from utils.aws_clients import get_s3_client
+
+# Hashed bag-of-words fallback embedding size
+HASH_EMBEDDING_DIM = 2048
+INDEX_OUTPUT_NAME = "retrieval_index.npz"
+
+_model = None
+_model_lock = threading.Lock()
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+INDEX_MEMO_MAX_ENTRIES = 32
+
+def chunk_text(text, chunk_chars=RETRIEVAL_CHUNK_CHARS, overlap=RETRIEVAL_CHUNK_OVERLAP):
+    """Split text into overlapping chunks, preferring paragraph and line boundaries"""
+    text = (text or "").strip()
+    if not text:
+        return []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            # Break on the last paragraph, line or word boundary in the second half of the window
+            for separator in ('\n\n', '\n', ' '):
+                boundary = text.rfind(separator, start + chunk_chars // 2, end)
+                if boundary != -1:
+                    end = boundary
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+def _get_model():
+    """Load the optional local embedding model (None when not configured or not installed)"""
+    global _model
+    if not RETRIEVAL_EMBEDDING_MODEL:
+        return None
+    with _model_lock:
+        if _model is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(RETRIEVAL_EMBEDDING_MODEL)
+            except ImportError:
+                print("[retrieval] sentence-transformers not installed, using hashed embeddings")
+                _model = False
+    return _model or None
+
+def embedding_model_name():
+    """Name of the embedder in use (stored with each index so mismatched indexes get rebuilt)"""
+    return RETRIEVAL_EMBEDDING_MODEL if _get_model() else f"hash-{HASH_EMBEDDING_DIM}"
+
+def _hash_embed(texts):
+    """Hashed unigram+bigram embedding with sublinear term frequency"""
+    vectors = np.zeros((len(texts), HASH_EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = re.findall(r"[a-z0-9]+", text.lower())
+        terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for term in terms:
+            vectors[row, zlib.crc32(term.encode('utf-8')) % HASH_EMBEDDING_DIM] += 1.0
+    np.log1p(vectors, out=vectors)
+    return vectors
+
+def embed(texts):
+    """Embed texts into L2-normalised vectors"""
+    model = _get_model()
+    if model:
+        vectors = np.asarray(model.encode(texts), dtype=np.float32)
+    else:
+        vectors = _hash_embed(texts)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def build_index(text, source_etag=None):
+    """Chunk and embed a document's text"""
+    chunks = chunk_text(text)
+    embeddings = embed(chunks) if chunks else np.zeros((0, 1), dtype=np.float32)
+    return {
+        "chunks": chunks,
+        "embeddings": embeddings,
+        "model": embedding_model_name(),
+        "source_etag": source_etag or ""
+    }
+
+def search(index, query, top_k=RETRIEVAL_TOP_K):
+    """Return the top_k chunks by cosine similarity to the query, in document order"""
+    if not index["chunks"]:
+        return []
+    scores = index["embeddings"] @ embed([query])[0]
+    top = np.argsort(-scores)[:top_k]
+    return [index["chunks"][i] for i in sorted(top)]
+
+def serialize_index(index):
+    """Serialise an index to .npz bytes"""
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        chunks=np.array(index["chunks"], dtype=str),
+        embeddings=index["embeddings"],
+        model=np.array(index["model"]),
+        source_etag=np.array(index["source_etag"])
+    )
+    return buffer.getvalue()
+
+def deserialize_index(data):
+    """Load an index from .npz bytes"""
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        return {
+            "chunks": [str(chunk) for chunk in npz["chunks"]],
+            "embeddings": npz["embeddings"],
+            "model": str(npz["model"]),
+            "source_etag": str(npz["source_etag"])
+        }
+
+def remember_index(s3_key, index):
+    """Keep an index in the in-process memo"""
+    with _indexes_lock:
+        _indexes[s3_key] = index
+        _indexes.move_to_end(s3_key)
+        while len(_indexes) > INDEX_MEMO_MAX_ENTRIES:
+            _indexes.popitem(last=False)
+
+def _load_stored_index(bucket, s3_key):
+    try:
+        response = get_s3_client().get_object(Bucket=bucket, Key=f"results/{s3_key}/{INDEX_OUTPUT_NAME}")
+        return deserialize_index(response['Body'].read())
+    except Exception:
+        return None
+
+def get_index(bucket, s3_key, source_etag, load_text):
+    """
+    Get the retrieval index for a source document version: in-process memo,
+    then results/<key>/retrieval_index.npz, then built from load_text().
+    """
+    def usable(index):
+        return (
+            index is not None
+            and index["model"] == embedding_model_name()
+            and (not source_etag or index["source_etag"] == source_etag)
+        )
+
+    with _indexes_lock:
+        index = _indexes.get(s3_key)
+    if usable(index):
+        return index
+
+    index = _load_stored_index(bucket, s3_key)
+    if not usable(index):
+        print(f"[retrieval] Building index for {s3_key}")
+        index = build_index(load_text(), source_etag)
+    remember_index(s3_key, index)
+    return index
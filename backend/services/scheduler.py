@@ -0,0 +1,128 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from config import SCHEDULER_WORKERS
+
+# Lower values run first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+class JobScheduler:
+    """
+    Bounded worker pool with a priority queue. Within a priority level jobs are
+    dispatched round-robin across users, so one user's batch cannot starve others.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.workers = workers
+        # priority -> OrderedDict(user -> deque of (job_id, fn, args))
+        self._queues = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = set()
+        self._accepting = True
+
+    def submit(self, job_id, fn, args=(), priority=PRIORITY_INTERACTIVE, user=None):
+        """Queue a job; fn(*args) runs on a worker thread"""
+        with self._cond:
+            if not self._accepting:
+                raise RuntimeError("Scheduler is shutting down")
+            self._ensure_workers()
+            users = self._queues.setdefault(priority, OrderedDict())
+            users.setdefault(user, deque()).append((job_id, fn, args))
+            self._cond.notify()
+
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _next_job(self):
+        """Pop the next job: lowest priority first, then round-robin across users"""
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if not users:
+                continue
+            user, jobs = next(iter(users.items()))
+            job = jobs.popleft()
+            # Move the user to the back of the rotation (or drop them if done)
+            del users[user]
+            if jobs:
+                users[user] = jobs
+            return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if not self._accepting:
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+                job_id, fn, args = job
+                self._running.add(job_id)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[scheduler] Job {job_id} raised: {e}")
+            finally:
+                with self._cond:
+                    self._running.discard(job_id)
+                    self._cond.notify_all()
+
+    def queue_position(self, job_id):
+        """1-based position of a queued job in dispatch order (None if not queued)"""
+        with self._cond:
+            position = 0
+            for priority in sorted(self._queues):
+                # Replay the round-robin rotation across this level's users
+                lanes = [list(jobs) for jobs in self._queues[priority].values()]
+                depth = 0
+                while any(depth < len(lane) for lane in lanes):
+                    for lane in lanes:
+                        if depth < len(lane):
+                            position += 1
+                            if lane[depth][0] == job_id:
+                                return position
+                    depth += 1
+        return None
+
+    def job_ids(self):
+        """IDs of the jobs this scheduler holds (queued or running)"""
+        with self._cond:
+            queued = [job[0] for users in self._queues.values() for jobs in users.values() for job in jobs]
+            return queued + list(self._running)
+
+    def stats(self):
+        """Queue depth and running count"""
+        with self._cond:
+            queued = sum(len(jobs) for users in self._queues.values() for jobs in users.values())
+            return {"queued": queued, "running": len(self._running), "workers": self.workers}
+
+    def shutdown(self, timeout=30, on_abandoned=None):
+        """
+        Stop accepting jobs, let running jobs finish (up to timeout seconds) and
+        hand any jobs that never started to on_abandoned(job_id).
+        """
+        with self._cond:
+            self._accepting = False
+            abandoned = [job[0] for users in self._queues.values() for jobs in users.values() for job in jobs]
+            self._queues.clear()
+            self._cond.notify_all()
+            deadline = time.monotonic() + timeout
+            while self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"[scheduler] Shutdown timed out with {len(self._running)} jobs still running")
+                    break
+                self._cond.wait(remaining)
+        if on_abandoned:
+            for job_id in abandoned:
+                on_abandoned(job_id)
+        return abandoned
+
+# Process-wide scheduler
+scheduler = JobScheduler()
@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+from config import S3_BUCKET
+from utils.aws_clients import get_s3_client
+from utils.text_extraction import extract_text_from_s3_object
+
+# Small in-process memo of extracted text, keyed by (bucket, key, source ETag)
+MEMO_MAX_ENTRIES = 64
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+def get_source_etag(bucket, s3_key):
+    """Get the ETag of a source document (None if it can't be read)"""
+    try:
+        return get_s3_client().head_object(Bucket=bucket, Key=s3_key).get("ETag")
+    except Exception as e:
+        print(f"[text_store] Error reading ETag for {s3_key}: {e}")
+        return None
+
+def _memo_get(memo_key):
+    with _memo_lock:
+        text = _memo.get(memo_key)
+        if text is not None:
+            _memo.move_to_end(memo_key)
+        return text
+
+def remember_extracted_text(bucket, s3_key, etag, text):
+    """Record extracted text for a source version in the in-process memo"""
+    if not etag or not text:
+        return
+    with _memo_lock:
+        _memo[(bucket, s3_key, etag)] = text
+        _memo.move_to_end((bucket, s3_key, etag))
+        while len(_memo) > MEMO_MAX_ENTRIES:
+            _memo.popitem(last=False)
+
+def _load_result_text(bucket, s3_key, etag):
+    """Read results/<key>/extracted_text.txt if it was produced from this source version"""
+    s3 = get_s3_client()
+    try:
+        response = s3.get_object(Bucket=bucket, Key=f"results/{s3_key}/extracted_text.txt")
+    except Exception:
+        return None
+    source_etag = response.get("Metadata", {}).get("source-etag")
+    if source_etag is not None:
+        if etag and source_etag != etag:
+            return None
+    elif etag:
+        # Older results have no source-etag metadata: trust them if they are newer than the source
+        try:
+            source_modified = s3.head_object(Bucket=bucket, Key=s3_key)["LastModified"]
+        except Exception:
+            return None
+        if response["LastModified"] < source_modified:
+            return None
+    return response['Body'].read().decode('utf-8')
+
+def get_extracted_text(bucket, s3_key, etag=None):
+    """
+    Get the extracted text of a source document, cheapest layer first:
+    the in-process memo, the stored results object, and only then a fresh
+    extraction (OCR).
+    """
+    etag = etag or get_source_etag(bucket, s3_key)
+
+    text = _memo_get((bucket, s3_key, etag))
+    if text is not None:
+        return text
+
+    text = _load_result_text(bucket, s3_key, etag)
+    if text is None:
+        print(f"[text_store] No stored text for {s3_key}, extracting")
+        text = extract_text_from_s3_object(bucket, s3_key)
+
+    remember_extracted_text(bucket, s3_key, etag, text)
+    return text
+
+def get_summary(job):
+    """Summary of a processed job, read from its results object (None if there is none yet)"""
+    # Jobs recorded before stage outputs moved out of the job record carry the text inline
+    if job.get("summary"):
+        return job["summary"]
+    if not job.get("summary_s3_key"):
+        return None
+    try:
+        response = get_s3_client().get_object(Bucket=S3_BUCKET, Key=job["summary_s3_key"])
+    except Exception as e:
+        print(f"[text_store] Error reading summary {job['summary_s3_key']}: {e}")
+        return None
+    return response['Body'].read().decode('utf-8')
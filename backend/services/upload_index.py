@@ -0,0 +1,27 @@
+import json
+from datetime import datetime
+from config import S3_BUCKET
+from utils.aws_clients import get_s3_client
+
+# Content hash -> source S3 key of the first upload with that content
+UPLOAD_INDEX_PREFIX = "cache/uploads/"
+
+def _index_key(content_sha256):
+    return f"{UPLOAD_INDEX_PREFIX}{content_sha256}.json"
+
+def find_upload(content_sha256):
+    """S3 key of an earlier upload with the same SHA-256 (None if unknown)"""
+    try:
+        response = get_s3_client().get_object(Bucket=S3_BUCKET, Key=_index_key(content_sha256))
+        return json.loads(response['Body'].read().decode('utf-8'))["s3_key"]
+    except Exception:
+        return None
+
+def remember_upload(content_sha256, s3_key):
+    """Record the S3 key that holds content with this SHA-256"""
+    get_s3_client().put_object(
+        Bucket=S3_BUCKET,
+        Key=_index_key(content_sha256),
+        Body=json.dumps({"s3_key": s3_key, "uploaded_at": datetime.now().isoformat()}),
+        ContentType='application/json'
+    )
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+from multipart.multipart import MultipartParser, parse_options_header
+from fastapi.concurrency import run_in_threadpool
+from config import UPLOAD_MAX_BYTES, UPLOAD_PART_SIZE, UPLOAD_MAX_INFLIGHT_PARTS, UPLOAD_ALLOWED_MIME_TYPES
+from utils.aws_clients import get_s3_client
+from utils.text_extraction import sniff_mime_type
+
+# Bytes needed to sniff the MIME type of an upload
+SNIFF_BYTES = 8
+
+class UploadRejected(Exception):
+    """Raised when an upload is refused; carries the HTTP status to answer with"""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+class StreamingUpload:
+    """
+    Stream the "file" part of a multipart/form-data request into S3 without
+    spooling it to disk. Parts go out as an S3 multipart upload once the file
+    exceeds one part (smaller files are sent with a single put_object), with
+    at most UPLOAD_MAX_INFLIGHT_PARTS parts in memory at a time. The content
+    hash is computed on the way through and the object only becomes visible
+    on commit(), so the caller can still abort() after reading the whole body.
+    """
+
+    def __init__(self, bucket, make_key):
+        self.bucket = bucket
+        self.make_key = make_key
+        self.s3_key = None
+        self.filename = None
+        self.mime_type = None
+        self.size = 0
+        self.fields = {}
+        self.content_sha256 = None
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self._pending = []
+        self._error = None
+
+    async def receive(self, request):
+        """Read the request body, uploading full parts as they fill"""
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadRejected(400, "Expected a multipart/form-data upload")
+        declared_length = int(request.headers.get("content-length") or 0)
+        if declared_length > UPLOAD_MAX_BYTES + 64 * 1024:
+            raise UploadRejected(413, f"File exceeds the {UPLOAD_MAX_BYTES} byte upload limit")
+
+        part = {"headers": {}, "header_field": b"", "name": None, "is_file": False, "value": b""}
+
+        def on_part_begin():
+            part.update(headers={}, header_field=b"", name=None, is_file=False, value=b"")
+
+        def on_header_field(data, start, end):
+            part["header_field"] += data[start:end]
+
+        def on_header_value(data, start, end):
+            name = part["header_field"].lower()
+            part["headers"][name] = part["headers"].get(name, b"") + data[start:end]
+
+        def on_header_end():
+            part["header_field"] = b""
+
+        def on_headers_finished():
+            _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+            part["name"] = options.get(b"name", b"").decode("utf-8")
+            if b"filename" in options and part["name"] == "file":
+                part["is_file"] = True
+                self.filename = options[b"filename"].decode("utf-8")
+                self.s3_key = self.make_key(self.filename)
+
+        def on_part_data(data, start, end):
+            if self._error:
+                return
+            if part["is_file"]:
+                self._write(data[start:end])
+            else:
+                part["value"] += data[start:end]
+
+        def on_part_end():
+            if not part["is_file"] and part["name"]:
+                self.fields[part["name"]] = part["value"].decode("utf-8")
+
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": on_part_begin,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished
+        })
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if self._error:
+                    raise self._error
+                if len(self._buffer) >= UPLOAD_PART_SIZE:
+                    await self._flush_part()
+            parser.finalize()
+            if self.filename is None:
+                raise UploadRejected(400, "No file part in the upload")
+            if self.mime_type is None:
+                self._check_mime_type()
+            self.content_sha256 = self._hash.hexdigest()
+            if self._pending:
+                await asyncio.gather(*self._pending)
+        except BaseException:
+            await self.abort()
+            raise
+
+    def _write(self, data):
+        """Hash and buffer file bytes, enforcing the size limit and MIME type as early as possible"""
+        self.size += len(data)
+        if self.size > UPLOAD_MAX_BYTES:
+            self._error = UploadRejected(413, f"File exceeds the {UPLOAD_MAX_BYTES} byte upload limit")
+            return
+        self._hash.update(data)
+        self._buffer += data
+        if self.mime_type is None and len(self._buffer) >= SNIFF_BYTES:
+            try:
+                self._check_mime_type()
+            except UploadRejected as e:
+                self._error = e
+
+    def _check_mime_type(self):
+        self.mime_type = sniff_mime_type(bytes(self._buffer[:SNIFF_BYTES]), self.filename or "")
+        if self.mime_type not in UPLOAD_ALLOWED_MIME_TYPES:
+            raise UploadRejected(415, f"Unsupported file type {self.mime_type}")
+
+    async def _flush_part(self):
+        """Send the buffered bytes as the next multipart part"""
+        s3 = get_s3_client()
+        if self._upload_id is None:
+            response = await run_in_threadpool(
+                s3.create_multipart_upload, Bucket=self.bucket, Key=self.s3_key, ContentType=self.mime_type
+            )
+            self._upload_id = response["UploadId"]
+        # Bound memory: wait for the oldest part before buffering another
+        if len(self._pending) >= UPLOAD_MAX_INFLIGHT_PARTS:
+            await self._pending.pop(0)
+        part_number = len(self._parts) + 1
+        body = bytes(self._buffer)
+        self._buffer.clear()
+        self._parts.append({"PartNumber": part_number})
+
+        async def upload_part():
+            response = await run_in_threadpool(
+                s3.upload_part, Bucket=self.bucket, Key=self.s3_key, UploadId=self._upload_id,
+                PartNumber=part_number, Body=body
+            )
+            self._parts[part_number - 1]["ETag"] = response["ETag"]
+
+        self._pending.append(asyncio.ensure_future(upload_part()))
+
+    async def commit(self):
+        """Make the uploaded object visible in S3"""
+        s3 = get_s3_client()
+        if self._upload_id is None:
+            await run_in_threadpool(
+                s3.put_object, Bucket=self.bucket, Key=self.s3_key, Body=bytes(self._buffer), ContentType=self.mime_type,
+                Metadata=self._metadata()
+            )
+        else:
+            if self._buffer:
+                await self._flush_part()
+            await asyncio.gather(*self._pending)
+            await run_in_threadpool(
+                s3.complete_multipart_upload, Bucket=self.bucket, Key=self.s3_key, UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts}
+            )
+            # The hash is only known once the last part is in, so set it with an in-place copy
+            await run_in_threadpool(
+                s3.copy_object, Bucket=self.bucket, Key=self.s3_key, CopySource={"Bucket": self.bucket, "Key": self.s3_key},
+                MetadataDirective="REPLACE", ContentType=self.mime_type, Metadata=self._metadata()
+            )
+        self._buffer.clear()
+
+    def _metadata(self):
+        """Metadata stored on the uploaded object: its content hash"""
+        return {"content-sha256": self.content_sha256}
+
+    async def abort(self):
+        """Discard the upload (nothing is left behind in S3)"""
+        self._buffer.clear()
+        for task in self._pending:
+            task.cancel()
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        self._pending = []
+        if self._upload_id is not None:
+            upload_id, self._upload_id = self._upload_id, None
+            try:
+                await run_in_threadpool(
+                    get_s3_client().abort_multipart_upload, Bucket=self.bucket, Key=self.s3_key, UploadId=upload_id
+                )
+            except Exception as e:
+                print(f"[StreamingUpload] Error aborting multipart upload for {self.s3_key}: {e}")
@@ -0,0 +1,107 @@
+import json
+import time
+import threading
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+from config import S3_BUCKET, USERS_CACHE_TTL, USERS_CACHE_MAX_STALE
+from utils.aws_clients import get_s3_client
+
+USERS_KEY = 'auth/allowed_users.json'
+
+# Shared in-process cache of auth/allowed_users.json. Each API worker process
+# keeps its own copy and revalidates it (conditional GET on the ETag) once it is
+# USERS_CACHE_TTL seconds old, so changes made by another process (the admin
+# scripts, other workers) take effect there within USERS_CACHE_TTL seconds.
+# Transient S3 errors keep the last good copy for up to USERS_CACHE_MAX_STALE
+# seconds; a missing, forbidden or unreadable file empties the cache.
+_cache = {
+    "users": [],
+    "index": {},
+    "etag": None,
+    "fetched_at": None
+}
+_lock = threading.Lock()
+
+# S3 error codes worth riding out with the last good copy
+TRANSIENT_ERROR_CODES = ("Throttling", "ThrottlingException", "SlowDown", "RequestTimeout", "ServiceUnavailable", "InternalError")
+
+def _build_index(users):
+    """Build an ads_id -> user index from the users list"""
+    return {user.get('ads_id'): user for user in users if user.get('ads_id') is not None}
+
+def _refresh():
+    """Fetch the users file from S3, revalidating with the cached ETag when possible"""
+    params = {"Bucket": S3_BUCKET, "Key": USERS_KEY}
+    if _cache["etag"]:
+        params["IfNoneMatch"] = _cache["etag"]
+    try:
+        response = get_s3_client().get_object(**params)
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if code in ("304", "NotModified"):
+            # Unchanged since the last fetch, keep the cached copy
+            _cache["fetched_at"] = time.monotonic()
+            return
+        raise
+    users_data = json.loads(response['Body'].read().decode('utf-8'))
+    users = users_data.get('users', [])
+    _cache["users"] = users
+    _cache["index"] = _build_index(users)
+    _cache["etag"] = response.get("ETag")
+    _cache["fetched_at"] = time.monotonic()
+
+def _is_transient(error):
+    """Throttling, 5xx and network errors are transient; anything else (NoSuchKey, AccessDenied, bad JSON) is not"""
+    if isinstance(error, (ConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return code in TRANSIENT_ERROR_CODES or status >= 500
+    return False
+
+def _ensure_fresh(force=False):
+    """Refresh the cache if the TTL has expired (or unconditionally when forced)"""
+    with _lock:
+        fetched_at = _cache["fetched_at"]
+        if not force and fetched_at is not None and time.monotonic() - fetched_at < USERS_CACHE_TTL:
+            return
+        try:
+            _refresh()
+        except Exception as e:
+            print(f"Error fetching allowed users: {e}")
+            if _is_transient(e) and fetched_at is not None and time.monotonic() - fetched_at < USERS_CACHE_MAX_STALE:
+                # Keep serving the last good copy for a bounded time; retry on the next call
+                return
+            # Missing, forbidden or unreadable file (or a stale copy too old to trust): deny everyone
+            _cache["users"] = []
+            _cache["index"] = {}
+            _cache["etag"] = None
+
+def get_allowed_users(fresh=False):
+    """Get the list of allowed users (cached). Pass fresh=True before read-modify-write."""
+    _ensure_fresh(force=fresh)
+    return list(_cache["users"])
+
+def get_user(ads_id):
+    """Look up a single allowed user by ADS ID (cached)"""
+    _ensure_fresh()
+    return _cache["index"].get(ads_id)
+
+def invalidate_users_cache():
+    """
+    Expire this process's cached users file so its next lookup revalidates
+    against S3. Other processes are not notified; they revalidate on their TTL.
+    """
+    with _lock:
+        _cache["fetched_at"] = None
+
+def save_allowed_users(users_list):
+    """Write the allowed users file to S3 and invalidate this process's cache"""
+    users_data = {"users": users_list}
+    get_s3_client().put_object(
+        Bucket=S3_BUCKET,
+        Key=USERS_KEY,
+        Body=json.dumps(users_data, indent=2),
+        ContentType='application/json'
+    )
+    invalidate_users_cache()
@@ -0,0 +1,82 @@
+import os
+import sys
+import asyncio
+
+# Test settings must be in place before any backend module reads config
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ["AWS_S3_BUCKET"] = "test-bucket"
+os.environ["JOB_STORE_BACKEND"] = "memory"
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from moto import mock_aws
+
+# Modules create their shared clients at import time, so S3 is mocked for the whole session
+_aws = mock_aws()
+_aws.start()
+
+@pytest.fixture
+def s3_bucket():
+    """Empty test bucket; returns (client, bucket name)"""
+    from utils.aws_clients import get_s3_client
+    client = get_s3_client()
+    bucket = os.environ["AWS_S3_BUCKET"]
+    client.create_bucket(Bucket=bucket)
+    yield client, bucket
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket):
+        for obj in page.get("Contents", []):
+            client.delete_object(Bucket=bucket, Key=obj["Key"])
+    client.delete_bucket(Bucket=bucket)
+
+@pytest.fixture
+def s3_calls(s3_bucket):
+    """List that records the operation name of every call made through the shared S3 client"""
+    client, _ = s3_bucket
+    calls = []
+    def record(model, **kwargs):
+        calls.append(model.name)
+    client.meta.events.register("before-call.s3", record)
+    yield calls
+    client.meta.events.unregister("before-call.s3", record)
+
+class FakeRequest:
+    """Minimal stand-in for a Starlette request (downloads only read headers)"""
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+def read_body(response):
+    """Collect a StreamingResponse body"""
+    async def collect():
+        return b"".join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(collect())
+
+def make_pdf(pages):
+    """
+    Minimal PDF with one page per entry: a string becomes a page with that
+    text in its text layer, None a page without one (like a scan).
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET" if text else ""
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return out
@@ -0,0 +1,45 @@
+import pytest
+from utils.bpmn_compiler import validate_template, compile_bpmn_template, TemplateError
+from utils.bpmn_validator import repair_bpmn
+
+def flow_names(model):
+    return [(source["name"], target["name"]) for source, target, _, _ in model["flows"]]
+
+def test_steps_chain_in_list_order():
+    model = validate_template({"tasks": ["Receive", "Review"], "end_event": "Done"})
+    assert flow_names(model) == [("Start", "Receive"), ("Receive", "Review"), ("Review", "Done")]
+
+def test_end_step_in_body_has_no_implicit_outgoing_flow():
+    template = {
+        "tasks": [
+            {"id": "Task_1", "name": "Check", "type": "exclusive", "next": [{"to": "Task_2", "label": "Yes"}, {"to": "Rejected", "label": "No"}]},
+            {"id": "Rejected", "name": "Rejected", "type": "end"},
+            {"id": "Task_2", "name": "Approve"}
+        ],
+        "end_event": "Approved"
+    }
+    model = validate_template(template)
+    assert ("Rejected", "Approve") not in flow_names(model)
+    assert not any(source["kind"] == "endEvent" for source, _, _, _ in model["flows"])
+    xml, _, problems = repair_bpmn(compile_bpmn_template(template))
+    assert [issue["code"] for issue in problems] == []
+
+def test_compiled_xml_needs_no_repairs():
+    template = {
+        "start_event": "Application received",
+        "tasks": [
+            {"id": "Task_1", "name": "Receive Application", "actor": "Support"},
+            {"id": "Gateway_1", "type": "exclusive", "name": "Complete?",
+             "next": [{"to": "Task_3", "condition": "${complete}", "label": "Yes"}, {"to": "Task_2", "label": "No"}]},
+            {"id": "Task_2", "name": "Request Documents", "actor": "Support", "next": "Task_1"},
+            {"id": "Task_3", "name": "Compliance Review", "actor": "Compliance", "type": "user"}
+        ],
+        "end_event": "Accepted"
+    }
+    xml, fixes, problems = repair_bpmn(compile_bpmn_template(template))
+    assert fixes == []
+    assert problems == []
+
+def test_unknown_step_reference_is_rejected():
+    with pytest.raises(TemplateError):
+        validate_template({"tasks": [{"name": "A", "next": "Nope"}]})
@@ -0,0 +1,63 @@
+import os
+import pytest
+from lxml import etree
+from utils.bpmn_validator import repair_bpmn, BPMN_NS, BPMNDI_NS
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "bpmn")
+
+def load(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+def codes(issues):
+    return [(issue["code"], issue["element"]) for issue in issues]
+
+# Fixture -> (expected fixes, expected problems left for the refiner)
+CORPUS = {
+    "valid.bpmn": ([], []),
+    "missing_ids.bpmn": (
+        [("missing_id", "sequenceFlow_1"), ("flow_references", "Start_1"), ("flow_references", "Task_1"), ("missing_di", None)],
+        []
+    ),
+    "dangling_flows.bpmn": ([("dangling_flow", "Flow_3"), ("flow_references", "Task_1")], []),
+    "missing_di.bpmn": ([("missing_di", None)], []),
+    "broken_namespaces.bpmn": ([("undeclared_namespace", None)] * 3, []),
+    "casing_and_conditions.bpmn": (
+        [("undeclared_namespace", None), ("element_casing", "Task_1"), ("condition_expression", "Flow_2")],
+        []
+    ),
+    "end_event_outgoing.bpmn": ([], [("end_event_outgoing", "Flow_3")])
+}
+
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_repair_corpus(name):
+    expected_fixes, expected_problems = CORPUS[name]
+    xml, fixes, problems = repair_bpmn(load(name))
+    assert codes(fixes) == expected_fixes
+    assert codes(problems) == expected_problems
+    # Repairs are complete: a second pass finds nothing more to fix
+    _, second_fixes, _ = repair_bpmn(xml)
+    assert second_fixes == []
+
+def test_valid_input_is_returned_unchanged():
+    source = load("valid.bpmn")
+    assert repair_bpmn(source)[0] is source
+
+def test_missing_di_is_laid_out():
+    xml, _, _ = repair_bpmn(load("missing_di.bpmn"))
+    root = etree.fromstring(xml.encode("utf-8"))
+    shapes = {shape.get("bpmnElement") for shape in root.iter(f"{{{BPMNDI_NS}}}BPMNShape")}
+    edges = {edge.get("bpmnElement") for edge in root.iter(f"{{{BPMNDI_NS}}}BPMNEdge")}
+    assert shapes == {"Start_1", "Task_1", "End_1"}
+    assert edges == {"Flow_1", "Flow_2"}
+
+def test_dangling_flow_references_are_removed():
+    xml, _, _ = repair_bpmn(load("dangling_flows.bpmn"))
+    root = etree.fromstring(xml.encode("utf-8"))
+    task = root.find(f".//{{{BPMN_NS}}}task")
+    assert [child.text for child in task.findall(f"{{{BPMN_NS}}}outgoing")] == ["Flow_2"]
+
+def test_unparseable_input_is_a_problem():
+    xml, fixes, problems = repair_bpmn("not xml at all")
+    assert xml == "not xml at all"
+    assert codes(problems) == [("malformed_xml", None)]
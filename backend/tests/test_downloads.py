@@ -0,0 +1,58 @@
+from datetime import datetime
+from conftest import FakeRequest, read_body
+from services import downloads
+from services.downloads import postprocess_bpmn, served_key, invalidate_served, stream_s3_object, serve_download
+
+RESULTS_KEY = "results/uploads/sop.pdf/final_bpmn_xml.bpmn"
+
+def bpmn(label):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL">'
+        f'<bpmn:process id="{label}"/></bpmn:definitions>'
+    )
+
+def put_run(client, bucket, label):
+    """Write a results/ output and its served artifact, as a completed run does"""
+    client.put_object(Bucket=bucket, Key=RESULTS_KEY, Body=bpmn(label).encode())
+    client.put_object(Bucket=bucket, Key=served_key(RESULTS_KEY), Body=postprocess_bpmn(bpmn(label), datetime(2024, 1, 1)))
+
+def test_streams_served_artifact(s3_bucket):
+    client, bucket = s3_bucket
+    put_run(client, bucket, "first")
+    body = read_body(stream_s3_object(FakeRequest(), bucket, RESULTS_KEY, "out.bpmn", watermark_bpmn=True))
+    assert b'id="first"' in body
+    assert b"BPMN Generated by" in body
+
+def test_rewritten_checkpoint_is_not_shadowed_by_old_served_artifact(s3_bucket):
+    client, bucket = s3_bucket
+    put_run(client, bucket, "first")
+    # A reprocess rewrites the stage checkpoint; save_outputs has not run yet
+    invalidate_served(bucket, RESULTS_KEY)
+    client.put_object(Bucket=bucket, Key=RESULTS_KEY, Body=bpmn("second").encode())
+    body = read_body(stream_s3_object(FakeRequest(), bucket, RESULTS_KEY, "out.bpmn", watermark_bpmn=True))
+    assert b'id="second"' in body
+    assert b"BPMN Generated by" in body
+
+def test_invalidation_drops_cached_presigned_url(s3_bucket):
+    client, bucket = s3_bucket
+    put_run(client, bucket, "first")
+    presigned = serve_download(FakeRequest(), bucket, RESULTS_KEY, "out.bpmn", watermark_bpmn=True, mode="presigned")
+    assert served_key(RESULTS_KEY) in presigned["url"]
+    invalidate_served(bucket, RESULTS_KEY)
+    assert not any(key[1] == served_key(RESULTS_KEY) for key in downloads._presigned_urls)
+    # Without a served artifact the download is streamed through the transform
+    response = serve_download(FakeRequest(), bucket, RESULTS_KEY, "out.bpmn", watermark_bpmn=True, mode="presigned")
+    assert not isinstance(response, dict)
+
+def test_other_workers_stop_reusing_presigned_urls_after_the_cache_window(s3_bucket):
+    client, bucket = s3_bucket
+    put_run(client, bucket, "first")
+    serve_download(FakeRequest(), bucket, RESULTS_KEY, "out.bpmn", watermark_bpmn=True, mode="presigned")
+    # Another worker reprocesses: the served copy disappears without this worker's cache being told
+    client.delete_object(Bucket=bucket, Key=served_key(RESULTS_KEY))
+    cache_key = (bucket, served_key(RESULTS_KEY), "out.bpmn")
+    url, created_at = downloads._presigned_urls[cache_key]
+    downloads._presigned_urls[cache_key] = (url, created_at - downloads.PRESIGNED_URL_CACHE_SECONDS)
+    response = serve_download(FakeRequest(), bucket, RESULTS_KEY, "out.bpmn", watermark_bpmn=True, mode="presigned")
+    assert not isinstance(response, dict)
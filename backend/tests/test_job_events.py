@@ -0,0 +1,51 @@
+import asyncio
+from services import job_events
+from services.job_events import publish, iter_job_events, job_status_event
+
+JOB_ID = "job-1"
+
+def collect(load_job, after_snapshot=(), recheck=5):
+    """Run iter_job_events to the end, publishing after_snapshot once the snapshot is out"""
+    async def run():
+        messages = []
+        async for message in iter_job_events(JOB_ID, load_job, recheck=recheck):
+            if message is None:
+                continue
+            messages.append(message)
+            if len(messages) == 1:
+                for event, data in after_snapshot:
+                    publish(JOB_ID, event, data)
+        return messages
+    return asyncio.run(asyncio.wait_for(run(), timeout=10))
+
+def test_events_published_before_the_snapshot_are_not_repeated():
+    job = {"status": "processing", "version": 2, "stages": {"extract": {"finished_at": 1}}}
+
+    def load_job():
+        # Writes landing between subscribe() and the snapshot read
+        publish(JOB_ID, "status", {"status": "processing", "version": 1})
+        publish(JOB_ID, "stage", {"stage": "extract", "state": "finished", "version": 2})
+        return job
+
+    messages = collect(load_job, after_snapshot=[
+        ("token", {"stage": "summary", "delta": "Hi"}),
+        ("status", {"status": "completed", "version": 3}),
+    ])
+    assert [(m["event"], m["data"].get("version")) for m in messages] == [
+        ("status", 2), ("token", None), ("status", 3)
+    ]
+    assert messages[0]["data"]["stages"] == job["stages"]
+
+def test_slow_subscriber_is_resynced_from_the_job(monkeypatch):
+    monkeypatch.setattr(job_events, "SUBSCRIBER_QUEUE_MAX", 3)
+    jobs = [{"status": "processing", "version": 1}, {"status": "completed", "version": 9}]
+
+    def load_job():
+        return jobs.pop(0)
+
+    # Five tokens overflow the queue; the subscriber re-reads the job and sees it completed
+    tokens = [("token", {"stage": "summary", "delta": str(n)}) for n in range(5)]
+    messages = collect(load_job, after_snapshot=tokens)
+    assert messages[-1]["event"] == "status"
+    assert messages[-1]["data"] == job_status_event({"status": "completed", "version": 9})
+    assert not jobs
@@ -0,0 +1,37 @@
+import time
+from services import file_processor
+from services.job_store import MemoryJobStore
+from config import JOB_STALE_SECONDS
+
+def use_store(monkeypatch):
+    store = MemoryJobStore()
+    monkeypatch.setattr(file_processor, "job_store", store)
+    return store
+
+def test_orphaned_job_is_failed_instead_of_reused(monkeypatch, s3_bucket):
+    store = use_store(monkeypatch)
+    store.put("dead", {"status": "processing", "s3_key": "uploads/a.pdf", "heartbeat_at": time.time() - JOB_STALE_SECONDS - 1})
+    assert file_processor.find_reusable_job("uploads/a.pdf") is None
+    job = store.get("dead")
+    assert job["status"] == "failed"
+    assert "reprocess" in job["error"]
+
+def test_live_job_is_reused(monkeypatch, s3_bucket):
+    store = use_store(monkeypatch)
+    store.put("live", {"status": "queued", "s3_key": "uploads/a.pdf", "heartbeat_at": time.time()})
+    assert file_processor.find_reusable_job("uploads/a.pdf") == "live"
+    assert store.get("live")["status"] == "queued"
+
+def test_status_reports_orphaned_job_as_failed(monkeypatch):
+    store = use_store(monkeypatch)
+    store.put("dead", {"status": "queued", "s3_key": "uploads/a.pdf", "heartbeat_at": 0})
+    assert file_processor.get_job_status("dead")["status"] == "failed"
+
+def test_heartbeat_does_not_bump_version(monkeypatch):
+    store = use_store(monkeypatch)
+    store.put("live", {"status": "processing", "s3_key": "uploads/a.pdf", "heartbeat_at": 0})
+    version = store.get("live")["version"]
+    store.heartbeat("live")
+    job = store.get("live")
+    assert job["version"] == version
+    assert time.time() - job["heartbeat_at"] < 5
@@ -0,0 +1,124 @@
+from types import SimpleNamespace
+import openai
+import pytest
+from utils import llm_utils
+from utils.llm_utils import TokenBucket, AdaptiveConcurrencyLimiter, LLMDeadlineExceeded, complete_chat
+
+class FakeClock:
+    """Stands in for the time module: sleep() advances monotonic() instantly"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def status_error(cls, status_code, headers=None):
+    response = SimpleNamespace(status_code=status_code, headers=headers or {}, request=None)
+    return cls(f"HTTP {status_code}", response=response, body=None)
+
+class FakeCompletions:
+    """Chat completions stand-in: raises the queued errors in order, then answers"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def create(self, model, messages, timeout, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_utils, "time", clock)
+    return clock
+
+@pytest.fixture
+def gateway(monkeypatch, clock):
+    """Fresh buckets, limiter and metrics; returns a function installing a fake completions client"""
+    monkeypatch.setattr(llm_utils, "_request_bucket", TokenBucket(600))
+    monkeypatch.setattr(llm_utils, "_token_bucket", TokenBucket(100000))
+    monkeypatch.setattr(llm_utils, "_limiter", AdaptiveConcurrencyLimiter(8))
+    monkeypatch.setattr(llm_utils, "_metrics", dict.fromkeys(llm_utils._metrics, 0))
+    def install(*errors):
+        completions = FakeCompletions(*errors)
+        monkeypatch.setattr(llm_utils.openai, "chat", SimpleNamespace(completions=completions))
+        return completions
+    return install
+
+def test_429_is_retried_and_halves_concurrency(gateway):
+    completions = gateway(status_error(openai.RateLimitError, 429), status_error(openai.RateLimitError, 429))
+    assert complete_chat(MESSAGES) == "ok"
+    assert completions.calls == 3
+    metrics = llm_utils.get_llm_metrics()
+    assert (metrics["throttled"], metrics["retries"], metrics["successes"]) == (2, 2, 1)
+    # Halved twice (8 -> 2), then one success adds 1/limit
+    assert metrics["concurrency_limit"] == 2.5
+
+def test_retry_after_is_honoured(gateway, clock):
+    gateway(status_error(openai.RateLimitError, 429, {"retry-after": "7"}))
+    assert complete_chat(MESSAGES) == "ok"
+    assert 7 <= clock.sleeps[-1] <= 8
+
+def test_5xx_is_retried_without_backing_off_concurrency(gateway):
+    completions = gateway(status_error(openai.InternalServerError, 500), status_error(openai.InternalServerError, 503))
+    assert complete_chat(MESSAGES) == "ok"
+    assert completions.calls == 3
+    assert llm_utils.get_llm_metrics()["throttled"] == 0
+    assert llm_utils._limiter.limit == 8
+
+def test_client_errors_are_not_retried(gateway):
+    completions = gateway(status_error(openai.BadRequestError, 400))
+    with pytest.raises(openai.BadRequestError):
+        complete_chat(MESSAGES)
+    assert completions.calls == 1
+    assert llm_utils.get_llm_metrics()["failures"] == 1
+
+def test_retries_stop_at_the_limit(gateway, monkeypatch):
+    monkeypatch.setattr(llm_utils, "LLM_MAX_RETRIES", 2)
+    completions = gateway(*[status_error(openai.InternalServerError, 500)] * 5)
+    with pytest.raises(openai.InternalServerError):
+        complete_chat(MESSAGES)
+    assert completions.calls == 3
+
+def test_token_bucket_waits_for_refill(clock):
+    bucket = TokenBucket(60)  # one token per second
+    assert bucket.acquire(60, deadline=clock.now + 100) == 0
+    assert bucket.acquire(3, deadline=clock.now + 100) == pytest.approx(3.0)
+    assert sum(clock.sleeps) == pytest.approx(3.0)
+
+def test_token_bucket_caps_requests_at_capacity(clock):
+    bucket = TokenBucket(60)
+    # A prompt larger than a minute's budget waits for a full bucket rather than forever
+    assert bucket.acquire(500, deadline=clock.now + 100) == 0
+
+def test_token_bucket_respects_the_deadline(clock):
+    bucket = TokenBucket(60)
+    bucket.acquire(60, deadline=clock.now + 100)
+    with pytest.raises(LLMDeadlineExceeded):
+        bucket.acquire(10, deadline=clock.now + 5)
+
+def test_concurrency_limit_halves_on_throttling_and_recovers():
+    limiter = AdaptiveConcurrencyLimiter(8)
+    for expected in (4, 2, 1, 1):
+        limiter.acquire(deadline=float("inf"))
+        limiter.release(throttled=True)
+        assert limiter.limit == expected
+    successes = 0
+    while limiter.limit < 8:
+        limiter.acquire(deadline=float("inf"))
+        limiter.release()
+        successes += 1
+    # Additive increase: roughly one step per limit's worth of successes, capped at max_limit
+    assert limiter.limit == 8
+    assert 25 <= successes <= 40
@@ -0,0 +1,92 @@
+import json
+import time
+import threading
+import pytest
+from services import results_catalog
+from services.results_catalog import record_outputs, get_outputs, list_results, _manifest_key
+
+INPUT_KEY = "uploads/sop.pdf"
+
+@pytest.fixture(autouse=True)
+def empty_catalog(monkeypatch):
+    monkeypatch.setattr(results_catalog, "_catalog", {
+        "entries": {}, "keys": [], "manifest_etags": {}, "loaded": False, "synced_at": 0.0, "rebuilt_at": 0.0
+    })
+
+def test_outputs_carry_s3_last_modified(s3_bucket):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/summary.txt", Body=b"summary")
+    record_outputs(INPUT_KEY)
+    head = client.head_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/summary.txt")
+    assert get_outputs(INPUT_KEY) == {"summary.txt": {"last_modified": head["LastModified"], "size": 7}}
+    manifest = json.loads(client.get_object(Bucket=bucket, Key=_manifest_key(INPUT_KEY))["Body"].read())
+    assert manifest["outputs"]["summary.txt"] == {"last_modified": head["LastModified"].isoformat(), "size": 7}
+
+def test_each_checkpoint_is_added_as_it_is_recorded(s3_bucket):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/extracted_text.txt", Body=b"text")
+    record_outputs(INPUT_KEY)
+    client.put_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/bpmn_template.json", Body=b"{}")
+    record_outputs(INPUT_KEY)
+    assert set(get_outputs(INPUT_KEY)) == {"extracted_text.txt", "bpmn_template.json"}
+
+def test_manifests_are_merged_by_other_workers(s3_bucket, monkeypatch):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/summary.txt", Body=b"summary")
+    record_outputs(INPUT_KEY)
+    expected = get_outputs(INPUT_KEY)
+    # Another worker starts from an empty catalog and only syncs manifests
+    monkeypatch.setattr(results_catalog, "RESULTS_CATALOG_SYNC_SECONDS", 0)
+    monkeypatch.setattr(results_catalog, "_catalog", {
+        "entries": {}, "keys": [], "manifest_etags": {}, "loaded": True, "synced_at": 0.0,
+        "rebuilt_at": time.monotonic()
+    })
+    assert get_outputs(INPUT_KEY) == expected
+
+def test_deleted_manifests_are_dropped_on_sync(s3_bucket, monkeypatch):
+    client, bucket = s3_bucket
+    for key in (INPUT_KEY, "uploads/other.pdf"):
+        client.put_object(Bucket=bucket, Key=f"results/{key}/summary.txt", Body=b"summary")
+        record_outputs(key)
+    # Another worker (or an operator) removes the input's results and manifest
+    client.delete_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/summary.txt")
+    client.delete_object(Bucket=bucket, Key=_manifest_key(INPUT_KEY))
+    monkeypatch.setattr(results_catalog, "RESULTS_CATALOG_SYNC_SECONDS", 0)
+    assert get_outputs(INPUT_KEY) == {}
+    assert [key for key, _ in list_results()[0]] == ["uploads/other.pdf"]
+
+def test_periodic_rebuild_drops_deleted_outputs(s3_bucket, monkeypatch):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/summary.txt", Body=b"summary")
+    get_outputs(INPUT_KEY)
+    assert set(get_outputs(INPUT_KEY)) == {"summary.txt"}
+    client.delete_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/summary.txt")
+    monkeypatch.setattr(results_catalog, "RESULTS_CATALOG_REBUILD_SECONDS", 0)
+    assert get_outputs(INPUT_KEY) == {}
+
+def test_lookups_are_served_while_the_catalog_is_rebuilt(s3_bucket, monkeypatch):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/summary.txt", Body=b"summary")
+    record_outputs(INPUT_KEY)
+    listing_started, release_listing = threading.Event(), threading.Event()
+    def block_rebuild_listing(**kwargs):
+        if threading.current_thread().name == "rebuild":
+            listing_started.set()
+            release_listing.wait(timeout=10)
+    client.meta.events.register("before-call.s3.ListObjectsV2", block_rebuild_listing)
+    # The next lookup is due for a periodic rebuild; the ones after it are not
+    monkeypatch.setattr(results_catalog, "RESULTS_CATALOG_REBUILD_SECONDS", 1)
+    results_catalog._catalog["rebuilt_at"] = time.monotonic() - 1
+    rebuild = threading.Thread(target=get_outputs, args=(INPUT_KEY,), name="rebuild")
+    try:
+        rebuild.start()
+        assert listing_started.wait(timeout=5)
+        served = []
+        lookup = threading.Thread(target=lambda: served.append(get_outputs(INPUT_KEY)))
+        lookup.start()
+        lookup.join(timeout=2)
+        assert served and set(served[0]) == {"summary.txt"}
+    finally:
+        release_listing.set()
+        rebuild.join(timeout=10)
+        client.meta.events.unregister("before-call.s3.ListObjectsV2", block_rebuild_listing)
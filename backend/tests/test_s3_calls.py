@@ -0,0 +1,34 @@
+import pytest
+import main
+from services import file_processor, results_catalog
+from services.file_processor import RESULT_OUTPUTS
+from services.job_store import MemoryJobStore
+
+INPUT_KEY = "uploads/sop.pdf"
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(file_processor, "job_store", MemoryJobStore())
+    monkeypatch.setitem(results_catalog._catalog, "loaded", False)
+
+def put_results(client, bucket):
+    for _, output_name in RESULT_OUTPUTS:
+        client.put_object(Bucket=bucket, Key=f"results/{INPUT_KEY}/{output_name}", Body=b"x")
+    client.put_object(Bucket=bucket, Key=INPUT_KEY, Body=b"%PDF-1.4")
+
+def test_process_existing_checks_results_with_one_listing(s3_bucket, s3_calls):
+    put_results(*s3_bucket)
+    s3_calls.clear()
+    response = main.process_existing(s3_key=INPUT_KEY, current_user="alice")
+    assert response["reused"] is True
+    assert s3_calls == ["ListObjectsV2"]
+
+def test_file_timestamps_only_heads_the_input(s3_bucket, s3_calls):
+    put_results(*s3_bucket)
+    # First use loads the catalog (results/ and catalog/ listings)
+    main.get_file_timestamps(INPUT_KEY)
+    s3_calls.clear()
+    response = main.get_file_timestamps(INPUT_KEY)
+    assert response["files_count"] == len(RESULT_OUTPUTS)
+    assert set(response["output_timestamps"]) == {output_name for _, output_name in RESULT_OUTPUTS}
+    assert s3_calls == ["HeadObject"]
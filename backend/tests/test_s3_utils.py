@@ -0,0 +1,21 @@
+import importlib
+import config
+from utils import s3_utils
+
+def test_internal_prefixes_follow_config(monkeypatch):
+    monkeypatch.setattr(config, "RESULTS_CATALOG_PREFIX", "meta/catalog")
+    monkeypatch.setattr(config, "JOB_STORE_S3_PREFIX", "meta/jobs/")
+    try:
+        reloaded = importlib.reload(s3_utils)
+        assert reloaded.is_internal_key("meta/catalog/abc.json")
+        assert reloaded.is_internal_key("meta/jobs/job1.json")
+        assert not reloaded.is_internal_key("catalog/report.pdf")
+        assert reloaded.is_internal_key("results/uploads/a.pdf/summary.txt")
+    finally:
+        monkeypatch.undo()
+        importlib.reload(s3_utils)
+
+def test_default_prefixes():
+    assert s3_utils.is_internal_key("jobs/job1.json")
+    assert s3_utils.is_internal_key("catalog/abc.json")
+    assert not s3_utils.is_internal_key("uploads/sop.pdf")
@@ -0,0 +1,49 @@
+import asyncio
+from conftest import make_pdf
+from utils import text_extraction
+
+LONG_TEXT = "This page has a text layer long enough to be read locally"
+
+def run(coro):
+    return asyncio.run(coro)
+
+def fake_textract(monkeypatch, text="OCR TEXT"):
+    """Replace whole-document Textract extraction; returns the list of keys it was called with"""
+    calls = []
+    async def extract(bucket, key, client=None):
+        calls.append(key)
+        return text
+    monkeypatch.setattr(text_extraction, "extract_text_from_s3_async", extract)
+    return calls
+
+def test_text_pdf_is_read_locally(monkeypatch, s3_bucket):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key="uploads/text.pdf", Body=make_pdf([LONG_TEXT, LONG_TEXT + " again"]))
+    calls = fake_textract(monkeypatch)
+    text = run(text_extraction.extract_text_from_s3_object_async(bucket, "uploads/text.pdf"))
+    assert text == f"{LONG_TEXT}\n{LONG_TEXT} again"
+    assert calls == []
+
+def test_damaged_pdf_falls_back_to_textract(monkeypatch, s3_bucket):
+    client, bucket = s3_bucket
+    # Valid header, but no /Root object
+    client.put_object(Bucket=bucket, Key="uploads/broken.pdf", Body=b"%PDF-1.4\n1 0 obj\n<< >>\nendobj\n%%EOF\n")
+    calls = fake_textract(monkeypatch)
+    text = run(text_extraction.extract_text_from_s3_object_async(bucket, "uploads/broken.pdf"))
+    assert text == "OCR TEXT"
+    assert calls == ["uploads/broken.pdf"]
+
+def test_images_are_sniffed_without_downloading(monkeypatch, s3_bucket):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key="uploads/scan.png", Body=b"\x89PNG\r\n\x1a\n" + b"\0" * 1024)
+    calls = fake_textract(monkeypatch)
+    def no_spool(bucket, key):
+        raise AssertionError("non-PDF documents must not be spooled")
+    monkeypatch.setattr(text_extraction, "_spool_s3_object", no_spool)
+    assert run(text_extraction.extract_text_from_s3_object_async(bucket, "uploads/scan.png")) == "OCR TEXT"
+    assert calls == ["uploads/scan.png"]
+
+def test_read_head_of_empty_object(s3_bucket):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key="uploads/empty.pdf", Body=b"")
+    assert text_extraction._read_s3_head(bucket, "uploads/empty.pdf") == b""
@@ -0,0 +1,46 @@
+import pytest
+from collections import OrderedDict
+from services import text_store
+from services.text_store import get_extracted_text, get_source_etag, remember_extracted_text
+
+SOURCE_KEY = "uploads/sop.pdf"
+
+@pytest.fixture(autouse=True)
+def empty_memo(monkeypatch):
+    monkeypatch.setattr(text_store, "_memo", OrderedDict())
+    def no_extraction(bucket, key):
+        raise AssertionError("text should not be extracted again")
+    monkeypatch.setattr(text_store, "extract_text_from_s3_object", no_extraction)
+
+def put_source(client, bucket):
+    client.put_object(Bucket=bucket, Key=SOURCE_KEY, Body=b"%PDF-1.4")
+    return get_source_etag(bucket, SOURCE_KEY)
+
+def test_memo_is_served_without_reading_results(s3_bucket, s3_calls):
+    client, bucket = s3_bucket
+    etag = put_source(client, bucket)
+    remember_extracted_text(bucket, SOURCE_KEY, etag, "memo text")
+    s3_calls.clear()
+    assert get_extracted_text(bucket, SOURCE_KEY, etag) == "memo text"
+    assert s3_calls == []
+
+def test_results_object_of_the_same_source_version_is_reused(s3_bucket):
+    client, bucket = s3_bucket
+    etag = put_source(client, bucket)
+    client.put_object(
+        Bucket=bucket, Key=f"results/{SOURCE_KEY}/extracted_text.txt", Body=b"stored text",
+        Metadata={"source-etag": etag}
+    )
+    assert get_extracted_text(bucket, SOURCE_KEY) == "stored text"
+    # Remembered for the next chat turn
+    assert text_store._memo_get((bucket, SOURCE_KEY, etag)) == "stored text"
+
+def test_results_of_another_source_version_are_extracted_again(s3_bucket, monkeypatch):
+    client, bucket = s3_bucket
+    put_source(client, bucket)
+    client.put_object(
+        Bucket=bucket, Key=f"results/{SOURCE_KEY}/extracted_text.txt", Body=b"old text",
+        Metadata={"source-etag": '"older"'}
+    )
+    monkeypatch.setattr(text_store, "extract_text_from_s3_object", lambda bucket, key: "fresh text")
+    assert get_extracted_text(bucket, SOURCE_KEY) == "fresh text"
@@ -0,0 +1,159 @@
+import json
+import time
+import asyncio
+import threading
+import pytest
+from botocore.exceptions import ClientError
+from conftest import make_pdf
+from utils import text_extraction
+from utils.aws_clients import get_client
+
+LONG_TEXT = "This page has a text layer long enough to be read locally"
+
+class FakeTextract:
+    """
+    Textract stand-in: each job "runs" for one poll, then returns its LINE
+    blocks page_size at a time with NextToken pagination. Pages are given per
+    document key (a dict or a function of the key); throttle makes the first
+    n calls fail.
+    """
+
+    def __init__(self, pages_by_key, page_size=2, throttle=0):
+        self.pages_for = pages_by_key if callable(pages_by_key) else pages_by_key.__getitem__
+        self.page_size = page_size
+        self.throttle = throttle
+        self.jobs = {}
+        self.calls = []
+
+    def _maybe_throttle(self, operation):
+        self.calls.append(operation)
+        if self.throttle:
+            self.throttle -= 1
+            raise ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, operation)
+
+    def start_document_text_detection(self, DocumentLocation, **kwargs):
+        self._maybe_throttle("StartDocumentTextDetection")
+        key = DocumentLocation["S3Object"]["Name"]
+        job_id = f"job-{len(self.jobs) + 1}"
+        blocks = [
+            {"BlockType": "LINE", "Page": page, "Text": line}
+            for page, lines in enumerate(self.pages_for(key), start=1)
+            for line in lines
+        ]
+        self.jobs[job_id] = {"key": key, "blocks": blocks, "polls": 0}
+        return {"JobId": job_id}
+
+    def get_document_text_detection(self, JobId, MaxResults, NextToken=None):
+        self._maybe_throttle("GetDocumentTextDetection")
+        job = self.jobs[JobId]
+        job["polls"] += 1
+        if job["polls"] == 1:
+            return {"JobStatus": "IN_PROGRESS"}
+        start = int(NextToken or 0)
+        result = {"JobStatus": "SUCCEEDED", "Blocks": job["blocks"][start:start + self.page_size]}
+        if start + self.page_size < len(job["blocks"]):
+            result["NextToken"] = str(start + self.page_size)
+        return result
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(text_extraction, "TEXTRACT_POLL_INITIAL", 0)
+    monkeypatch.setattr(text_extraction, "TEXTRACT_RETRY_BASE", 0)
+
+def use_fake(monkeypatch, fake):
+    monkeypatch.setattr(text_extraction, "get_textract_client", lambda: fake)
+    return fake
+
+def test_pages_are_joined_in_order_across_result_pages(monkeypatch):
+    # Page 2 straddles two NextToken result pages
+    fake = use_fake(monkeypatch, FakeTextract({"doc.png": [["a1", "a2", "a3"], ["b1", "b2", "b3"], ["c1"]]}, page_size=2))
+    text = asyncio.run(text_extraction.extract_text_from_s3_async("bucket", "doc.png"))
+    assert text == "a1\na2\na3\nb1\nb2\nb3\nc1"
+    assert fake.calls.count("StartDocumentTextDetection") == 1
+
+def test_iter_text_pages_yields_each_page_once(monkeypatch):
+    fake = FakeTextract({"doc.png": [["a1"], ["b1", "b2"], ["c1", "c2", "c3"]]}, page_size=1)
+    async def collect():
+        job_id = await text_extraction.start_text_detection("bucket", "doc.png", fake)
+        result = await text_extraction.wait_for_text_detection(job_id, fake)
+        return [page async for page in text_extraction.iter_text_pages(job_id, fake, first_result=result)]
+    assert asyncio.run(collect()) == [(1, ["a1"]), (2, ["b1", "b2"]), (3, ["c1", "c2", "c3"])]
+
+def test_throttled_calls_are_retried(monkeypatch):
+    fake = use_fake(monkeypatch, FakeTextract({"doc.png": [["hello"]]}, throttle=3))
+    assert asyncio.run(text_extraction.extract_text_from_s3_async("bucket", "doc.png")) == "hello"
+    assert fake.calls[:4] == ["StartDocumentTextDetection"] * 4
+
+def test_throttling_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(text_extraction, "TEXTRACT_MAX_RETRIES", 2)
+    fake = use_fake(monkeypatch, FakeTextract({"doc.png": [["hello"]]}, throttle=10))
+    with pytest.raises(ClientError):
+        asyncio.run(text_extraction.extract_text_from_s3_async("bucket", "doc.png"))
+    assert len(fake.calls) == 3
+
+def test_scanned_pages_are_batched_into_one_job(monkeypatch, s3_bucket):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key="uploads/mixed.pdf", Body=make_pdf([LONG_TEXT, None, LONG_TEXT + " 3", None]))
+    # Staged documents hold the scanned pages only (original pages 2 and 4)
+    fake = use_fake(monkeypatch, FakeTextract(lambda key: [["scan of page 2"], ["scan of page 4"]]))
+    text = asyncio.run(text_extraction.extract_text_from_s3_object_async(bucket, "uploads/mixed.pdf"))
+    assert text.split("\n") == [LONG_TEXT, "scan of page 2", LONG_TEXT + " 3", "scan of page 4"]
+    assert fake.calls.count("StartDocumentTextDetection") == 1
+    staged_key = fake.jobs["job-1"]["key"]
+    assert staged_key.startswith(text_extraction.OCR_STAGING_PREFIX)
+    # The staged copy is removed once Textract is done with it
+    assert "Contents" not in client.list_objects_v2(Bucket=bucket, Prefix=text_extraction.OCR_STAGING_PREFIX)
+
+def test_fully_scanned_pdf_is_sent_as_is(monkeypatch, s3_bucket):
+    client, bucket = s3_bucket
+    client.put_object(Bucket=bucket, Key="uploads/scan.pdf", Body=make_pdf([None, None]))
+    fake = use_fake(monkeypatch, FakeTextract({"uploads/scan.pdf": [["one"], ["two"]]}))
+    assert asyncio.run(text_extraction.extract_text_from_s3_object_async(bucket, "uploads/scan.pdf")) == "one\ntwo"
+    assert fake.jobs["job-1"]["key"] == "uploads/scan.pdf"
+
+def wait_for_waiters(count):
+    deadline = time.monotonic() + 5
+    while len(text_extraction._waiters) < count:
+        assert time.monotonic() < deadline, "waiter did not register"
+        time.sleep(0.01)
+
+def test_notifications_are_routed_to_concurrent_waiters(monkeypatch):
+    sqs = get_client("sqs")
+    queue_url = sqs.create_queue(QueueName="textract-completions")["QueueUrl"]
+    monkeypatch.setattr(text_extraction, "TEXTRACT_SNS_TOPIC_ARN", "arn:aws:sns:us-east-1:123456789012:textract")
+    monkeypatch.setattr(text_extraction, "TEXTRACT_SNS_ROLE_ARN", "arn:aws:iam::123456789012:role/textract")
+    monkeypatch.setattr(text_extraction, "TEXTRACT_SQS_QUEUE_URL", queue_url)
+    # Long enough that only the notification can finish the waits within the test
+    monkeypatch.setattr(text_extraction, "TEXTRACT_NOTIFICATION_CHECK", 60)
+    receives = []
+    def record(**kwargs):
+        receives.append(1)
+    sqs.meta.events.register("before-call.sqs.ReceiveMessage", record)
+    fake = FakeTextract({"a.png": [["a"]], "b.png": [["b"]]})
+    results = {}
+    def extract(key):
+        results[key] = asyncio.run(text_extraction.extract_text_from_s3_async("bucket", key, fake))
+    threads = []
+    for key in ("a.png", "b.png"):
+        threads.append(threading.Thread(target=extract, args=(key,)))
+        threads[-1].start()
+        wait_for_waiters(len(threads))
+
+    def notify(job_id):
+        message = json.dumps({"JobId": job_id, "Status": "SUCCEEDED"})
+        sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps({"Message": message}))
+    notify("job-of-another-process")
+    notify("job-2")
+    notify("job-1")
+    for thread in threads:
+        thread.join(timeout=15)
+    sqs.meta.events.unregister("before-call.sqs.ReceiveMessage", record)
+
+    assert results == {"a.png": "a", "b.png": "b"}
+    # Long polls block instead of spinning on the foreign message
+    assert len(receives) <= 4
+    # Only the two claimed messages are deleted; the foreign one is left for its waiter
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"]
+    )["Attributes"]
+    assert int(attributes["ApproximateNumberOfMessages"]) + int(attributes["ApproximateNumberOfMessagesNotVisible"]) == 1
@@ -0,0 +1,54 @@
+import asyncio
+import hashlib
+from services import uploads
+from services.uploads import StreamingUpload
+
+BOUNDARY = "test-boundary"
+
+class StreamingRequest:
+    """Request stand-in that streams a multipart/form-data body in small chunks"""
+    def __init__(self, body, chunk_size=64 * 1024):
+        self.headers = {
+            "content-type": f"multipart/form-data; boundary={BOUNDARY}",
+            "content-length": str(len(body)),
+        }
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start:start + self.chunk_size]
+
+def form_body(filename, content):
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+def upload(bucket, content):
+    incoming = StreamingUpload(bucket, lambda filename: f"uploads/{filename}")
+    async def run():
+        await incoming.receive(StreamingRequest(form_body("sop.pdf", content)))
+        await incoming.commit()
+    asyncio.run(run())
+    return incoming
+
+def test_small_upload_stores_the_content_hash(s3_bucket):
+    client, bucket = s3_bucket
+    content = b"%PDF-1.4 small document"
+    incoming = upload(bucket, content)
+    head = client.head_object(Bucket=bucket, Key=incoming.s3_key)
+    assert head["Metadata"]["content-sha256"] == hashlib.sha256(content).hexdigest()
+    assert head["ContentType"] == "application/pdf"
+
+def test_multipart_upload_stores_the_content_hash(monkeypatch, s3_bucket, s3_calls):
+    client, bucket = s3_bucket
+    monkeypatch.setattr(uploads, "UPLOAD_PART_SIZE", 5 * 1024 * 1024)
+    content = b"%PDF-1.4 " + b"x" * (5 * 1024 * 1024 + 100)
+    incoming = upload(bucket, content)
+    assert "CompleteMultipartUpload" in s3_calls
+    head = client.head_object(Bucket=bucket, Key=incoming.s3_key)
+    assert head["Metadata"]["content-sha256"] == hashlib.sha256(content).hexdigest()
+    assert head["ContentType"] == "application/pdf"
+    assert client.get_object(Bucket=bucket, Key=incoming.s3_key)["Body"].read() == content
@@ -0,0 +1,77 @@
+import json
+import pytest
+from botocore.exceptions import ClientError
+from services import user_directory
+from services.user_directory import USERS_KEY, get_user, get_allowed_users, save_allowed_users
+
+def write_users(client, bucket, users):
+    """Write the users file directly, as another process would"""
+    client.put_object(Bucket=bucket, Key=USERS_KEY, Body=json.dumps({"users": users}))
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(user_directory, "_cache", {"users": [], "index": {}, "etag": None, "fetched_at": None})
+
+def test_lookups_within_ttl_are_served_from_memory(s3_bucket, s3_calls):
+    write_users(*s3_bucket, [{"ads_id": "alice", "role": "admin"}])
+    s3_calls.clear()
+    for _ in range(5):
+        assert get_user("alice")["role"] == "admin"
+    assert s3_calls == ["GetObject"]
+
+def test_unchanged_file_is_revalidated_with_its_etag(monkeypatch, s3_bucket, s3_calls):
+    write_users(*s3_bucket, [{"ads_id": "alice", "role": "admin"}])
+    get_user("alice")
+    monkeypatch.setattr(user_directory, "USERS_CACHE_TTL", 0)
+    s3_calls.clear()
+    assert get_user("alice")["role"] == "admin"
+    assert s3_calls == ["GetObject"]
+    assert user_directory._cache["etag"] is not None
+
+def test_changes_from_another_process_apply_after_the_ttl(monkeypatch, s3_bucket):
+    client, bucket = s3_bucket
+    write_users(client, bucket, [{"ads_id": "alice", "role": "admin"}, {"ads_id": "bob", "role": "user"}])
+    assert get_user("bob")["role"] == "user"
+    # e.g. update_user_role.py / remove_user.py run elsewhere
+    write_users(client, bucket, [{"ads_id": "alice", "role": "user"}])
+    assert get_user("bob") is not None
+    monkeypatch.setattr(user_directory, "USERS_CACHE_TTL", 0)
+    assert get_user("bob") is None
+    assert get_user("alice")["role"] == "user"
+
+def test_save_invalidates_this_process(s3_bucket):
+    write_users(*s3_bucket, [{"ads_id": "alice", "role": "user"}])
+    users = get_allowed_users(fresh=True)
+    users.append({"ads_id": "carol", "role": "user"})
+    save_allowed_users(users)
+    assert get_user("carol") == {"ads_id": "carol", "role": "user"}
+
+def test_deleted_users_file_revokes_access_after_the_ttl(monkeypatch, s3_bucket):
+    client, bucket = s3_bucket
+    write_users(client, bucket, [{"ads_id": "alice", "role": "admin"}])
+    assert get_user("alice")["role"] == "admin"
+    client.delete_object(Bucket=bucket, Key=USERS_KEY)
+    monkeypatch.setattr(user_directory, "USERS_CACHE_TTL", 0)
+    assert get_user("alice") is None
+    assert get_allowed_users() == []
+
+def test_unreadable_users_file_revokes_access(monkeypatch, s3_bucket):
+    client, bucket = s3_bucket
+    write_users(client, bucket, [{"ads_id": "alice", "role": "admin"}])
+    get_user("alice")
+    client.put_object(Bucket=bucket, Key=USERS_KEY, Body=b"{not json")
+    monkeypatch.setattr(user_directory, "USERS_CACHE_TTL", 0)
+    assert get_user("alice") is None
+
+class ThrottledS3:
+    def get_object(self, **kwargs):
+        raise ClientError({"Error": {"Code": "SlowDown"}, "ResponseMetadata": {"HTTPStatusCode": 503}}, "GetObject")
+
+def test_last_good_copy_is_kept_for_transient_errors_up_to_max_stale(monkeypatch, s3_bucket):
+    write_users(*s3_bucket, [{"ads_id": "alice", "role": "admin"}])
+    get_user("alice")
+    monkeypatch.setattr(user_directory, "USERS_CACHE_TTL", 0)
+    monkeypatch.setattr(user_directory, "get_s3_client", ThrottledS3)
+    assert get_user("alice")["role"] == "admin"
+    monkeypatch.setattr(user_directory, "USERS_CACHE_MAX_STALE", 0)
+    assert get_user("alice") is None
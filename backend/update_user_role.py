@@ -5,14 +5,15 @@ Usage: python update_user_role.py <ads_id> <new_role>
 """
 
 import json
-import boto3
 import sys
-from config import S3_BUCKET
+from config import S3_BUCKET, USERS_CACHE_TTL
+from utils.aws_clients import get_s3_client
+from services.user_directory import save_allowed_users
 
 def update_user_role(ads_id: str, new_role: str):
     """Update a user's role in the S3 auth file"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         
         # Get existing users
         try:
@@ -37,14 +38,10 @@ def update_user_role(ads_id: str, new_role: str):
             return False
         
         # Upload updated file to S3
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key='auth/allowed_users.json',
-            Body=json.dumps(users_data, indent=2),
-            ContentType='application/json'
-        )
+        save_allowed_users(users_data["users"])
         
         print(f"Successfully updated user role in S3")
+        print(f"Running API workers pick up the change within {USERS_CACHE_TTL} seconds")
         return True
         
     except Exception as e:
@@ -54,7 +51,7 @@ def update_user_role(ads_id: str, new_role: str):
 def list_users():
     """List all users in the S3 auth file"""
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
         response = s3_client.get_object(Bucket=S3_BUCKET, Key='auth/allowed_users.json')
         users_data = json.loads(response['Body'].read().decode('utf-8'))
         
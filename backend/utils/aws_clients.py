@@ -0,0 +1,50 @@
+import threading
+import boto3
+from botocore.config import Config
+from config import (
+    AWS_DEFAULT_REGION, AWS_S3_ENDPOINT_URL, AWS_MAX_POOL_CONNECTIONS, AWS_MAX_ATTEMPTS,
+    AWS_CONNECT_TIMEOUT, AWS_READ_TIMEOUT,
+)
+
+# Shared connection-pool / retry settings for every AWS client in the process
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    connect_timeout=AWS_CONNECT_TIMEOUT,
+    read_timeout=AWS_READ_TIMEOUT,
+    retries={"max_attempts": AWS_MAX_ATTEMPTS, "mode": "adaptive"}
+)
+
+_clients = {}
+_lock = threading.Lock()
+_session = None
+
+def _get_session():
+    """Get the process-wide boto3 session (credentials are resolved once)"""
+    global _session
+    if _session is None:
+        _session = boto3.session.Session(region_name=AWS_DEFAULT_REGION)
+    return _session
+
+def get_client(service_name, endpoint_url=None):
+    """Get a shared, thread-safe boto3 client for the given service"""
+    key = (service_name, endpoint_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _get_session().client(service_name, endpoint_url=endpoint_url, config=CLIENT_CONFIG)
+            _clients[key] = client
+    return client
+
+def get_s3_client():
+    """Get the shared S3 client"""
+    # Optional endpoint override, e.g. a local MinIO/moto server in development
+    return get_client('s3', endpoint_url=AWS_S3_ENDPOINT_URL)
+
+def get_textract_client():
+    """Get the shared Textract client"""
+    return get_client('textract')
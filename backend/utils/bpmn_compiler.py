@@ -0,0 +1,295 @@
+import re
+import json
+from lxml import etree
+from utils.bpmn_validator import BPMN_NS, XSI_NS
+from utils.bpmn_layout import layout_definitions
+
+# Template "type" values (lower-cased, without separators) -> BPMN element
+NODE_TYPES = {
+    "task": "task", "user": "userTask", "usertask": "userTask", "human": "userTask",
+    "service": "serviceTask", "servicetask": "serviceTask", "system": "serviceTask", "automated": "serviceTask",
+    "manual": "manualTask", "manualtask": "manualTask", "script": "scriptTask", "scripttask": "scriptTask",
+    "businessrule": "businessRuleTask", "businessruletask": "businessRuleTask", "rule": "businessRuleTask",
+    "send": "sendTask", "sendtask": "sendTask", "receive": "receiveTask", "receivetask": "receiveTask",
+    "subprocess": "callActivity", "callactivity": "callActivity",
+    "exclusive": "exclusiveGateway", "exclusivegateway": "exclusiveGateway", "xor": "exclusiveGateway",
+    "decision": "exclusiveGateway", "gateway": "exclusiveGateway",
+    "parallel": "parallelGateway", "parallelgateway": "parallelGateway", "and": "parallelGateway",
+    "inclusive": "inclusiveGateway", "inclusivegateway": "inclusiveGateway", "or": "inclusiveGateway",
+    "eventbased": "eventBasedGateway", "eventbasedgateway": "eventBasedGateway",
+    "timer": "intermediateCatchEvent", "wait": "intermediateCatchEvent", "delay": "intermediateCatchEvent",
+    "message": "intermediateCatchEvent", "intermediateevent": "intermediateCatchEvent",
+    "end": "endEvent", "endevent": "endEvent"
+}
+EVENT_DEFINITIONS = {"timer": "timerEventDefinition", "wait": "timerEventDefinition", "delay": "timerEventDefinition", "message": "messageEventDefinition"}
+# Keys the template may use for a node's successors, a flow's ends and a flow's label
+NEXT_KEYS = ("next", "outgoing", "branches", "paths")
+SOURCE_KEYS = ("from", "source", "sourceRef")
+TARGET_KEYS = ("to", "target", "targetRef", "next")
+LABEL_KEYS = ("label", "name", "outcome", "when")
+
+class TemplateError(ValueError):
+    """Raised when a BPMN template does not match the schema the compiler understands"""
+
+def _q(name):
+    return f"{{{BPMN_NS}}}{name}"
+
+def _first(mapping, keys):
+    for key in keys:
+        if mapping.get(key) not in (None, ""):
+            return mapping[key]
+    return None
+
+def _text(value, what):
+    if isinstance(value, dict):
+        value = _first(value, ("name", "label", "id"))
+    if not isinstance(value, (str, int, float)) or not str(value).strip():
+        raise TemplateError(f"{what} must be a non-empty string")
+    return str(value).strip()
+
+class _Ids:
+    """Valid, unique XML ids derived from the template's own ids where possible"""
+
+    def __init__(self):
+        self.used = set()
+
+    def make(self, wanted, fallback):
+        base = re.sub(r"[^\w.-]", "_", str(wanted or "").strip())
+        if base and not re.match(r"[A-Za-z_]", base):
+            base = f"{fallback}_{base}"
+        # Generated ids are numbered from 1 (Flow_1, Flow_2, ...)
+        candidate, n = (base, 2) if base else (f"{fallback}_1", 2)
+        while candidate in self.used:
+            candidate, n = f"{base or fallback}_{n}", n + 1
+        self.used.add(candidate)
+        return candidate
+
+def validate_template(template):
+    """
+    Check and normalize a BPMN template (the JSON the template agents produce).
+    Returns a dict of nodes, flows, lanes, data objects and annotations for
+    compile_bpmn_template; raises TemplateError when the template cannot be compiled.
+    """
+    if isinstance(template, str):
+        try:
+            template = json.loads(template)
+        except ValueError as e:
+            raise TemplateError(f"Template is not valid JSON: {e}")
+    if not isinstance(template, dict):
+        raise TemplateError("Template must be a JSON object")
+    items = template.get("tasks")
+    if not isinstance(items, list) or not items:
+        raise TemplateError("Template needs a non-empty 'tasks' list")
+
+    ids = _Ids()
+    nodes, by_ref = [], {}
+
+    def add_node(kind, name, wanted_id, fallback, actor=None, source=None):
+        node = {"id": ids.make(wanted_id, fallback), "kind": kind, "name": name, "actor": actor, "source": source or {}}
+        nodes.append(node)
+        for ref in (wanted_id, name):
+            if ref is not None:
+                by_ref.setdefault(str(ref).strip().lower(), node)
+        by_ref.setdefault(node["id"].lower(), node)
+        return node
+
+    start_value = template.get("start_event") or "Start"
+    start = add_node(
+        "startEvent", _text(start_value, "start_event"),
+        start_value.get("id") if isinstance(start_value, dict) else None, "StartEvent",
+        source=start_value if isinstance(start_value, dict) else None
+    )
+    body = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"name": item}
+        if not isinstance(item, dict):
+            raise TemplateError(f"tasks[{index}] must be an object or a string")
+        type_name = re.sub(r"[\s_-]", "", str(item.get("type") or "task")).lower()
+        kind = NODE_TYPES.get(type_name)
+        if kind is None:
+            kind = "exclusiveGateway" if "gateway" in type_name else "task"
+        name = _text(_first(item, ("name", "label", "description", "id")), f"tasks[{index}].name")
+        actor = _first(item, ("actor", "role", "lane", "swimlane", "owner"))
+        body.append(add_node(kind, name, item.get("id"), "Gateway" if kind.endswith("Gateway") else "Task", actor, item))
+        body[-1]["event_definition"] = EVENT_DEFINITIONS.get(type_name)
+    end_values = template.get("end_events") or template.get("end_event") or "End"
+    ends = [
+        add_node("endEvent", _text(value, "end_event"), value.get("id") if isinstance(value, dict) else None, "EndEvent",
+                 source=value if isinstance(value, dict) else None)
+        for value in (end_values if isinstance(end_values, list) else [end_values])
+    ]
+
+    def resolve(ref, what):
+        key = _text(ref, what).lower()
+        if key in ("end", "end_event") and key not in by_ref:
+            return ends[0]
+        if key not in by_ref:
+            raise TemplateError(f"{what} refers to unknown step '{_text(ref, what)}'")
+        return by_ref[key]
+
+    def targets(value, what):
+        """(target node, label, condition) for each successor, in any of the accepted shapes"""
+        if value is None:
+            return []
+        if isinstance(value, dict) and not _first(value, TARGET_KEYS + ("id",)):
+            # {"Yes": "Task_3", "No": "Task_2"}
+            return [(resolve(target, what), label, None) for label, target in value.items()]
+        result = []
+        for entry in value if isinstance(value, list) else [value]:
+            if isinstance(entry, dict):
+                target = _first(entry, TARGET_KEYS + ("id",))
+                label = _first(entry, LABEL_KEYS) if _first(entry, TARGET_KEYS) else None
+                result.append((resolve(target, what), label, entry.get("condition")))
+            else:
+                result.append((resolve(entry, what), None, None))
+        return result
+
+    flows = []
+    explicit = set()
+    for node in [start] + body + ends:
+        for key in NEXT_KEYS:
+            for target, label, condition in targets(node["source"].get(key), f"{node['name']}.{key}"):
+                flows.append((node, target, label, condition))
+                explicit.add(node["id"])
+    for index, entry in enumerate(template.get("sequence_flows") or template.get("flows") or []):
+        if not isinstance(entry, dict):
+            raise TemplateError(f"sequence_flows[{index}] must be an object")
+        source = resolve(_first(entry, SOURCE_KEYS), f"sequence_flows[{index}].from")
+        target = resolve(_first(entry, TARGET_KEYS), f"sequence_flows[{index}].to")
+        flows.append((source, target, _first(entry, LABEL_KEYS), entry.get("condition")))
+        explicit.add(source["id"])
+    # Steps without explicit successors continue with the next step in list order
+    # (an end step in the body ends its path, and nothing flows back into a start event)
+    sequence = [start] + body + [ends[0]]
+    for node, following in zip(sequence, sequence[1:]):
+        if node["id"] not in explicit and node["kind"] != "endEvent" and following["kind"] != "startEvent":
+            flows.append((node, following, None, None))
+
+    swimlanes = [_text(lane, "swimlanes entry") for lane in template.get("swimlanes") or []]
+    for node in body:
+        if node["actor"] is not None:
+            node["actor"] = _text(node["actor"], f"{node['name']}.actor")
+            if node["actor"] not in swimlanes:
+                swimlanes.append(node["actor"])
+
+    data_objects = []
+    for index, value in enumerate(template.get("data_objects") or []):
+        name = _text(value, f"data_objects[{index}]")
+        users = value.get("used_by", value.get("tasks", [])) if isinstance(value, dict) else []
+        data_objects.append({
+            "id": ids.make(value.get("id") if isinstance(value, dict) else None, "DataObject"),
+            "name": name,
+            "inputs": [resolve(ref, f"data_objects[{index}].used_by") for ref in (users if isinstance(users, list) else [users])]
+        })
+    by_data = {entry["name"].lower(): entry for entry in data_objects}
+    by_data.update({entry["id"].lower(): entry for entry in data_objects})
+    for node in body:
+        for key, direction in (("inputs", "in"), ("outputs", "out")):
+            refs = node["source"].get(key) or []
+            for ref in refs if isinstance(refs, list) else [refs]:
+                name = _text(ref, f"{node['name']}.{key}")
+                if name.lower() not in by_data:
+                    data_objects.append({"id": ids.make(None, "DataObject"), "name": name, "inputs": []})
+                    by_data[name.lower()] = data_objects[-1]
+                entry = by_data[name.lower()]
+                entry.setdefault("outputs", [])
+                (entry["inputs"] if direction == "in" else entry["outputs"]).append(node)
+
+    annotations = []
+    for index, value in enumerate(template.get("annotations") or template.get("notes") or []):
+        target = _first(value, ("task", "target", "step")) if isinstance(value, dict) else None
+        annotations.append({
+            "text": _text(_first(value, ("text", "note", "annotation")) if isinstance(value, dict) else value, f"annotations[{index}]"),
+            "target": resolve(target, f"annotations[{index}].task") if target is not None else None
+        })
+    for node in body:
+        note = _first(node["source"], ("annotation", "note", "notes"))
+        if isinstance(note, str) and note.strip():
+            annotations.append({"text": note.strip(), "target": node})
+
+    return {
+        "name": _text(_first(template, ("process_name", "name", "title")) or "Process", "process_name"),
+        "nodes": nodes,
+        "flows": flows,
+        "swimlanes": swimlanes,
+        "data_objects": data_objects,
+        "annotations": annotations,
+        "ids": ids
+    }
+
+def compile_bpmn_template(template):
+    """
+    Compile a BPMN template (JSON string or dict) straight to BPMN 2.0 XML with
+    a computed diagram layout: one participant whose lanes are the swimlanes,
+    the tasks, gateways and events, sequence flows with their conditions, data
+    objects and annotations. Raises TemplateError for templates it cannot compile.
+    """
+    model = validate_template(template)
+    ids = model["ids"]
+    root = etree.Element(_q("definitions"), nsmap={"bpmn": BPMN_NS, "xsi": XSI_NS})
+    root.set("id", ids.make(None, "Definitions"))
+    root.set("targetNamespace", "http://bpmn.io/schema/bpmn")
+    process_id = ids.make(None, "Process")
+    collaboration = etree.SubElement(root, _q("collaboration"), id=ids.make(None, "Collaboration"))
+    etree.SubElement(collaboration, _q("participant"), id=ids.make(None, "Participant"), name=model["name"], processRef=process_id)
+    process = etree.SubElement(root, _q("process"), id=process_id, isExecutable="false")
+
+    nodes = model["nodes"]
+    if model["swimlanes"]:
+        lane_set = etree.SubElement(process, _q("laneSet"), id=ids.make(None, "LaneSet"))
+        lanes = {name: etree.SubElement(lane_set, _q("lane"), id=ids.make(None, "Lane"), name=name) for name in model["swimlanes"]}
+        # Events sit in the lane of the step they connect to
+        for node in nodes:
+            if node["actor"] is None:
+                neighbours = [b for a, b, _, _ in model["flows"] if a is node] + [a for a, b, _, _ in model["flows"] if b is node]
+                node["actor"] = next((n["actor"] for n in neighbours if n["actor"]), model["swimlanes"][0])
+            etree.SubElement(lanes[node["actor"]], _q("flowNodeRef")).text = node["id"]
+
+    flow_ids = [ids.make(None, "Flow") for _ in model["flows"]]
+    elements = {}
+    for node in nodes:
+        element = etree.SubElement(process, _q(node["kind"]), id=node["id"], name=node["name"])
+        documentation = _first(node["source"], ("description", "documentation"))
+        if isinstance(documentation, str) and documentation.strip() and documentation.strip() != node["name"]:
+            etree.SubElement(element, _q("documentation")).text = documentation.strip()
+        for flow_id, (source, target, _, _) in zip(flow_ids, model["flows"]):
+            if target is node:
+                etree.SubElement(element, _q("incoming")).text = flow_id
+        for flow_id, (source, target, _, _) in zip(flow_ids, model["flows"]):
+            if source is node:
+                etree.SubElement(element, _q("outgoing")).text = flow_id
+        if node.get("event_definition"):
+            etree.SubElement(element, _q(node["event_definition"]), id=ids.make(None, "EventDefinition"))
+        elements[node["id"]] = element
+    for flow_id, (source, target, label, condition) in zip(flow_ids, model["flows"]):
+        flow = etree.SubElement(process, _q("sequenceFlow"), id=flow_id, sourceRef=source["id"], targetRef=target["id"])
+        if label:
+            flow.set("name", str(label))
+        if condition:
+            expression = etree.SubElement(flow, _q("conditionExpression"))
+            expression.set(f"{{{XSI_NS}}}type", "tFormalExpression")
+            expression.text = str(condition)
+
+    for entry in model["data_objects"]:
+        data_object_id = ids.make(None, "DataObject")
+        etree.SubElement(process, _q("dataObject"), id=data_object_id)
+        etree.SubElement(process, _q("dataObjectReference"), id=entry["id"], name=entry["name"], dataObjectRef=data_object_id)
+        for node in entry["inputs"]:
+            association = etree.SubElement(elements[node["id"]], _q("dataInputAssociation"), id=ids.make(None, "DataInputAssociation"))
+            etree.SubElement(association, _q("sourceRef")).text = entry["id"]
+        for node in entry.get("outputs", []):
+            association = etree.SubElement(elements[node["id"]], _q("dataOutputAssociation"), id=ids.make(None, "DataOutputAssociation"))
+            etree.SubElement(association, _q("targetRef")).text = entry["id"]
+    for entry in model["annotations"]:
+        annotation = etree.SubElement(process, _q("textAnnotation"), id=ids.make(None, "TextAnnotation"))
+        etree.SubElement(annotation, _q("text")).text = entry["text"]
+        if entry["target"] is not None:
+            etree.SubElement(
+                process, _q("association"), id=ids.make(None, "Association"),
+                sourceRef=entry["target"]["id"], targetRef=annotation.get("id")
+            )
+
+    layout_definitions(root)
+    etree.indent(root, space="  ")
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + etree.tostring(root, encoding="unicode")
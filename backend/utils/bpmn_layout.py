@@ -0,0 +1,421 @@
+from lxml import etree
+from utils.bpmn_validator import BPMN_NS, BPMNDI_NS, DC_NS, DI_NS, FLOW_NODE_TAGS
+
+# Layered (Sugiyama-style) layout: flows run left to right, lanes are horizontal bands
+LAYER_GAP = 60
+ROW_HEIGHT = 120
+PADDING = 40
+LANE_HEADER = 30
+ARTIFACT_GAP = 40
+ORDERING_SWEEPS = 4
+SUBPROCESS_TAGS = {"subProcess", "transaction", "adHocSubProcess"}
+ARTIFACT_TAGS = {"textAnnotation", "dataObjectReference", "dataStoreReference"}
+DI_NSMAP = {"bpmndi": BPMNDI_NS, "dc": DC_NS, "di": DI_NS}
+
+def _q(name, ns=BPMN_NS):
+    return f"{{{ns}}}{name}"
+
+def _local(element):
+    return etree.QName(element).localname if element is not None and isinstance(element.tag, str) else None
+
+def _size(tag):
+    if tag.endswith("Event"):
+        return 36, 36
+    if tag.endswith("Gateway"):
+        return 50, 50
+    if tag == "textAnnotation":
+        return 100, 30
+    if tag in ("dataObjectReference", "dataStoreReference"):
+        return 36, 50
+    return 100, 80
+
+def _lanes(process):
+    """Leaf lanes of a process in document order: [(lane_id, {node_id})]"""
+    lanes = []
+    def walk(lane_set):
+        for lane in lane_set.findall(_q("lane")):
+            children = lane.findall(_q("childLaneSet"))
+            if children:
+                for child in children:
+                    walk(child)
+            else:
+                lanes.append((lane.get("id"), {(ref.text or "").strip() for ref in lane.findall(_q("flowNodeRef"))}))
+    for lane_set in process.findall(_q("laneSet")):
+        walk(lane_set)
+    return lanes
+
+def _order_dfs(nodes, successors, starts):
+    """Depth-first visiting order (starts first) and the edges that close a cycle"""
+    order, back_edges = [], set()
+    state = {}
+    for root in starts + [node for node in nodes if node not in starts]:
+        if root in state:
+            continue
+        state[root] = 1
+        stack = [(root, iter(successors.get(root, ())))]
+        order.append(root)
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if state.get(child) == 1:
+                    back_edges.add((node, child))
+                elif child not in state:
+                    state[child] = 1
+                    order.append(child)
+                    stack.append((child, iter(successors.get(child, ()))))
+                    break
+            else:
+                state[node] = 2
+                stack.pop()
+    return order, back_edges
+
+def _layout_container(container, lanes):
+    """
+    Lay out the flow nodes directly inside a process or subprocess. Returns
+    (shapes, edges, width, height, lane_bands) with coordinates relative to the
+    container's top-left corner; shapes are {id: (x, y, w, h)}, edges {id: [(x, y)]}.
+    """
+    children = [child for child in container if isinstance(child.tag, str) and child.get("id")]
+    nodes = {child.get("id"): child for child in children if _local(child) in FLOW_NODE_TAGS}
+    flows = [
+        child for child in children
+        if _local(child) == "sequenceFlow" and child.get("sourceRef") in nodes and child.get("targetRef") in nodes
+    ]
+    # Boundary events are drawn on their host, so they rank with it
+    hosts = {
+        node_id: node.get("attachedToRef") for node_id, node in nodes.items()
+        if _local(node) == "boundaryEvent" and node.get("attachedToRef") in nodes
+    }
+    owner = lambda node_id: hosts.get(node_id, node_id)
+    ranked = [node_id for node_id in nodes if node_id not in hosts]
+    successors = {}
+    for flow in flows:
+        source, target = owner(flow.get("sourceRef")), owner(flow.get("targetRef"))
+        if source != target and target not in successors.setdefault(source, []):
+            successors[source].append(target)
+
+    # 1. Break cycles by reversing the edges that close them
+    starts = [node_id for node_id in ranked if _local(nodes[node_id]) == "startEvent"]
+    order, back_edges = _order_dfs(ranked, successors, starts)
+    dag = {node_id: [] for node_id in ranked}
+    for source, targets in successors.items():
+        for target in targets:
+            a, b = (target, source) if (source, target) in back_edges else (source, target)
+            if b not in dag[a]:
+                dag[a].append(b)
+
+    # 2. Longest-path layering
+    indegree = {node_id: 0 for node_id in ranked}
+    for targets in dag.values():
+        for target in targets:
+            indegree[target] += 1
+    rank = {node_id: 0 for node_id in ranked}
+    queue = [node_id for node_id in order if indegree[node_id] == 0]
+    while queue:
+        node_id = queue.pop()
+        for target in dag[node_id]:
+            rank[target] = max(rank[target], rank[node_id] + 1)
+            indegree[target] -= 1
+            if indegree[target] == 0:
+                queue.append(target)
+
+    lane_of = {}
+    for index, (_, refs) in enumerate(lanes):
+        for node_id in refs:
+            lane_of.setdefault(node_id, index)
+    for node_id in ranked:
+        lane_of.setdefault(node_id, len(lanes) if lanes else 0)
+
+    # 3. Long edges get a dummy node in every layer they cross
+    preds, succs = {node_id: [] for node_id in ranked}, {node_id: [] for node_id in ranked}
+    dummies = {}
+    for source in ranked:
+        for target in dag[source]:
+            chain = [source]
+            for layer in range(rank[source] + 1, rank[target]):
+                dummy = ("dummy", source, target, layer)
+                rank[dummy], lane_of[dummy] = layer, lane_of[source]
+                preds[dummy], succs[dummy] = [], []
+                chain.append(dummy)
+            chain.append(target)
+            for a, b in zip(chain, chain[1:]):
+                succs[a].append(b)
+                preds[b].append(a)
+            dummies[(source, target)] = chain[1:-1]
+    layers = [[] for _ in range(max(rank.values(), default=-1) + 1)]
+    for node_id in order + [node for node in rank if isinstance(node, tuple)]:
+        layers[rank[node_id]].append(node_id)
+
+    # 4. Barycenter ordering, grouped by lane
+    position = {node_id: index for layer in layers for index, node_id in enumerate(layer)}
+    def sweep(layer_indexes, neighbours):
+        for index in layer_indexes:
+            layer = layers[index]
+            def key(node_id):
+                adjacent = neighbours[node_id]
+                bary = sum(position[n] for n in adjacent) / len(adjacent) if adjacent else position[node_id]
+                return lane_of[node_id], bary
+            layer.sort(key=key)
+            for i, node_id in enumerate(layer):
+                position[node_id] = i
+    for _ in range(ORDERING_SWEEPS):
+        sweep(range(len(layers) - 1, -1, -1), succs)
+        sweep(range(len(layers)), preds)
+
+    # 5. Rows: follow the predecessors' row where possible so chains stay straight
+    row = {}
+    lane_rows = {}
+    for layer in layers:
+        last = {}
+        for node_id in layer:
+            lane = lane_of[node_id]
+            same_lane = [row[p] for p in preds[node_id] if p in row and lane_of[p] == lane]
+            preferred = round(sum(same_lane) / len(same_lane)) if same_lane else 0
+            row[node_id] = max(preferred, last.get(lane, -1) + 1)
+            last[lane] = row[node_id]
+            lane_rows[lane] = max(lane_rows.get(lane, 0), row[node_id] + 1)
+    band_count = len(lanes) + (1 if any(lane_of[n] == len(lanes) for n in ranked) else 0) if lanes else 1
+    lane_top, top = [], 0
+    for lane in range(band_count):
+        lane_top.append(top)
+        top += max(lane_rows.get(lane, 0), 1) * ROW_HEIGHT
+    height = top
+
+    column_left, left = [], 0
+    column_width = []
+    for layer in layers:
+        width = max([_size(_local(nodes[n]))[0] for n in layer if n in nodes] or [36])
+        column_left.append(left)
+        column_width.append(width)
+        left += width + LAYER_GAP
+    width = max(left - LAYER_GAP, 0)
+
+    centers, shapes = {}, {}
+    for node_id in rank:
+        cx = column_left[rank[node_id]] + column_width[rank[node_id]] / 2
+        cy = lane_top[lane_of[node_id]] + row[node_id] * ROW_HEIGHT + ROW_HEIGHT / 2
+        centers[node_id] = (cx, cy)
+        if node_id in nodes:
+            w, h = _size(_local(nodes[node_id]))
+            shapes[node_id] = (cx - w / 2, cy - h / 2, w, h)
+    attached = {}
+    for node_id, host in hosts.items():
+        attached.setdefault(host, []).append(node_id)
+    for host, events in attached.items():
+        hx, hy, hw, hh = shapes[host]
+        for i, node_id in enumerate(events):
+            shapes[node_id] = (hx + hw * (i + 1) / (len(events) + 1) - 18, hy + hh - 18, 36, 36)
+
+    # 6. Orthogonal edge routes through the dummy nodes
+    edges = {}
+    for flow in flows:
+        source_id, target_id = flow.get("sourceRef"), flow.get("targetRef")
+        sx, sy, sw, sh = shapes[source_id]
+        tx, ty, tw, th = shapes[target_id]
+        source, target = owner(source_id), owner(target_id)
+        if source == target or (source, target) in back_edges:
+            # Loops go back underneath both shapes
+            below = max(sy + sh, ty + th) + ROW_HEIGHT / 4
+            edges[flow.get("id")] = [
+                (sx + sw / 2, sy + sh), (sx + sw / 2, below), (tx + tw / 2, below), (tx + tw / 2, ty + th)
+            ]
+            continue
+        # Points carry their column so bends can sit in the gap before it
+        if source_id in hosts:
+            points = [(sx + sw / 2, sy + sh, None), (sx + sw / 2, sy + sh + 20, None)]
+        else:
+            points = [(sx + sw, sy + sh / 2, None)]
+        points += [centers[d] + (rank[d],) for d in dummies.get((source, target), [])]
+        points.append((tx, ty + th / 2, rank[target]))
+        route = [points[0][:2]]
+        for (x1, y1, _), (x2, y2, column) in zip(points, points[1:]):
+            if y1 != y2 and x1 != x2:
+                bend = column_left[column] - LAYER_GAP / 2 if column is not None else (x1 + x2) / 2
+                route += [(bend, y1), (bend, y2)]
+            route.append((x2, y2))
+        edges[flow.get("id")] = route
+
+    # Lane bands span the full width
+    lane_bands = [(lane_id, lane_top[i], max(lane_rows.get(i, 0), 1) * ROW_HEIGHT) for i, (lane_id, _) in enumerate(lanes)]
+    return shapes, edges, width, height, lane_bands
+
+def _connect(a, b):
+    """Straight connection between the facing sides of two shapes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    acx, acy, bcx, bcy = ax + aw / 2, ay + ah / 2, bx + bw / 2, by + bh / 2
+    if abs(bcy - acy) > abs(bcx - acx):
+        return [(acx, ay + ah if bcy > acy else ay), (bcx, by if bcy > acy else by + bh)]
+    return [(ax + aw if bcx > acx else ax, acy), (bx if bcx > acx else bx + bw, bcy)]
+
+def _add_artifacts(container, shapes, edges, left, top):
+    """Place text annotations and data objects in a row under the flow, and connect their associations"""
+    x = left
+    for child in container:
+        if _local(child) in ARTIFACT_TAGS and child.get("id"):
+            w, h = _size(_local(child))
+            shapes[child.get("id")] = (x, top + ARTIFACT_GAP, w, h)
+            x += w + ARTIFACT_GAP
+    for element in container.iter(_q("association"), _q("dataInputAssociation"), _q("dataOutputAssociation")):
+        if not element.get("id"):
+            continue
+        if _local(element) == "association":
+            source, target = element.get("sourceRef"), element.get("targetRef")
+        elif _local(element) == "dataInputAssociation":
+            source, target = (element.findtext(_q("sourceRef")) or "").strip(), element.getparent().get("id")
+        else:
+            source, target = element.getparent().get("id"), (element.findtext(_q("targetRef")) or "").strip()
+        if source in shapes and target in shapes:
+            edges[element.get("id")] = _connect(shapes[source], shapes[target])
+
+def _offset(shapes, edges, dx, dy):
+    return (
+        {key: (x + dx, y + dy, w, h) for key, (x, y, w, h) in shapes.items()},
+        {key: [(x + dx, y + dy) for x, y in points] for key, points in edges.items()}
+    )
+
+def _layout_process(process, left, top):
+    """Absolute layout of a process: (shapes, edges, width, height, lane_bands)"""
+    shapes, edges, width, height, lane_bands = _layout_container(process, _lanes(process))
+    shapes, edges = _offset(shapes, edges, left, top)
+    lane_bands = [(lane_id, band_top + top, band_height) for lane_id, band_top, band_height in lane_bands]
+    artifacts_before = len(shapes)
+    _add_artifacts(process, shapes, edges, left, top + height)
+    if len(shapes) > artifacts_before:
+        height += ARTIFACT_GAP + max(h for x, y, w, h in list(shapes.values())[artifacts_before:])
+    return shapes, edges, width, height, lane_bands
+
+def _plane(root, element_id):
+    diagram = etree.SubElement(root, _q("BPMNDiagram", BPMNDI_NS), nsmap=DI_NSMAP)
+    diagram.set("id", f"BPMNDiagram_{element_id}")
+    plane = etree.SubElement(diagram, _q("BPMNPlane", BPMNDI_NS))
+    plane.set("id", f"BPMNPlane_{element_id}")
+    plane.set("bpmnElement", element_id)
+    return plane
+
+def _number(value):
+    return str(int(round(value)))
+
+def _write(plane, shapes, edges, elements, horizontal=()):
+    for element_id, (x, y, w, h) in shapes.items():
+        shape = etree.SubElement(plane, _q("BPMNShape", BPMNDI_NS))
+        shape.set("id", f"{element_id}_di")
+        shape.set("bpmnElement", element_id)
+        if element_id in horizontal:
+            shape.set("isHorizontal", "true")
+        if _local(elements.get(element_id)) in SUBPROCESS_TAGS:
+            shape.set("isExpanded", "false")
+        elif _local(elements.get(element_id)) == "exclusiveGateway":
+            shape.set("isMarkerVisible", "true")
+        bounds = etree.SubElement(shape, _q("Bounds", DC_NS))
+        for name, value in (("x", x), ("y", y), ("width", w), ("height", h)):
+            bounds.set(name, _number(value))
+    for element_id, points in edges.items():
+        edge = etree.SubElement(plane, _q("BPMNEdge", BPMNDI_NS))
+        edge.set("id", f"{element_id}_di")
+        edge.set("bpmnElement", element_id)
+        for x, y in points:
+            waypoint = etree.SubElement(edge, _q("waypoint", DI_NS))
+            waypoint.set("x", _number(x))
+            waypoint.set("y", _number(y))
+
+def layout_definitions(root):
+    """
+    Replace the diagram interchange (bpmndi) section of a parsed
+    <bpmn:definitions> with a layout computed from the process model. Each
+    participant becomes a pool with its lanes as bands; subprocesses are drawn
+    collapsed and get their own diagram.
+    """
+    for diagram in root.findall(_q("BPMNDiagram", BPMNDI_NS)):
+        root.remove(diagram)
+    elements = {element.get("id"): element for element in root.iter() if isinstance(element.tag, str) and element.get("id")}
+    processes = root.findall(_q("process"))
+    collaboration = root.find(_q("collaboration"))
+    if collaboration is None and not processes:
+        return root
+
+    if collaboration is not None:
+        plane = _plane(root, collaboration.get("id"))
+        shapes, edges, pools = {}, {}, []
+        top = PADDING
+        laid_out = set()
+        for participant in collaboration.findall(_q("participant")):
+            process = elements.get(participant.get("processRef"))
+            if process is None or _local(process) != "process" or process.get("id") in laid_out:
+                # Black-box pool, widened to match the others below
+                shapes[participant.get("id")] = (PADDING, top, 0, 60)
+                pools.append(participant.get("id"))
+                top += 60 + PADDING
+                continue
+            laid_out.add(process.get("id"))
+            lanes = _lanes(process)
+            content_left = PADDING + LANE_HEADER + (LANE_HEADER if lanes else 0) + PADDING
+            process_shapes, process_edges, width, height, lane_bands = _layout_process(process, content_left, top + PADDING / 2)
+            pool_width = content_left - PADDING + width + PADDING
+            pool_height = max(height + PADDING, ROW_HEIGHT)
+            shapes[participant.get("id")] = (PADDING, top, pool_width, pool_height)
+            pools.append(participant.get("id"))
+            # Lanes fill the pool from top to bottom
+            if lane_bands:
+                lane_id, band_top, band_height = lane_bands[0]
+                lane_bands[0] = (lane_id, top, band_height + band_top - top)
+                lane_id, band_top, _ = lane_bands[-1]
+                lane_bands[-1] = (lane_id, band_top, top + pool_height - band_top)
+            for lane_id, band_top, band_height in lane_bands:
+                shapes[lane_id] = (PADDING + LANE_HEADER, band_top, pool_width - LANE_HEADER, band_height)
+                pools.append(lane_id)
+            shapes.update(process_shapes)
+            edges.update(process_edges)
+            top += pool_height + PADDING
+        pool_width = max([shapes[pool][2] for pool in pools] + [600])
+        for pool in pools:
+            x, y, w, h = shapes[pool]
+            if w == 0:
+                shapes[pool] = (x, y, pool_width, h)
+        _add_artifacts(collaboration, shapes, edges, PADDING, top - PADDING)
+        for flow in collaboration.findall(_q("messageFlow")):
+            if flow.get("sourceRef") in shapes and flow.get("targetRef") in shapes:
+                edges[flow.get("id")] = _connect(shapes[flow.get("sourceRef")], shapes[flow.get("targetRef")])
+        _write(plane, shapes, edges, elements, horizontal=pools)
+        processes = [process for process in processes if process.get("id") not in laid_out]
+
+    for process in processes:
+        plane = _plane(root, process.get("id"))
+        lanes = _lanes(process)
+        shapes, edges, width, _, lane_bands = _layout_process(process, PADDING + (LANE_HEADER + PADDING if lanes else 0), PADDING)
+        for lane_id, band_top, band_height in lane_bands:
+            shapes[lane_id] = (PADDING, band_top, LANE_HEADER + PADDING + width + PADDING, band_height)
+        _write(plane, shapes, edges, elements, horizontal=[lane_id for lane_id, _, _ in lane_bands])
+
+    # Collapsed subprocesses are drilled into on their own plane
+    for subprocess in [element for element in elements.values() if _local(element) in SUBPROCESS_TAGS]:
+        shapes, edges, _, _, _ = _layout_container(subprocess, [])
+        shapes, edges = _offset(shapes, edges, PADDING, PADDING)
+        _add_artifacts(subprocess, shapes, edges, PADDING, PADDING + max([y + h for x, y, w, h in shapes.values()] or [0]))
+        _write(_plane(root, subprocess.get("id")), shapes, edges, elements)
+    return root
+
+def layout_bpmn(bpmn_xml):
+    """Return the BPMN XML with a freshly computed diagram layout (unchanged if it cannot be parsed)"""
+    try:
+        root = etree.fromstring(bpmn_xml.strip().encode("utf-8"), etree.XMLParser(resolve_entities=False, no_network=True))
+    except (etree.XMLSyntaxError, AttributeError) as e:
+        print(f"[layout_bpmn] Skipping layout, XML could not be parsed: {e}")
+        return bpmn_xml
+    if etree.QName(root).namespace != BPMN_NS or _local(root) != "definitions":
+        return bpmn_xml
+    layout_definitions(root)
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + etree.tostring(root, encoding="unicode")
+
+def strip_diagram(bpmn_xml):
+    """Return the BPMN XML without its bpmndi section, e.g. before sending it to the LLM"""
+    try:
+        root = etree.fromstring(bpmn_xml.strip().encode("utf-8"), etree.XMLParser(resolve_entities=False, no_network=True))
+    except (etree.XMLSyntaxError, AttributeError):
+        return bpmn_xml
+    diagrams = root.findall(_q("BPMNDiagram", BPMNDI_NS))
+    if not diagrams:
+        return bpmn_xml
+    for diagram in diagrams:
+        root.remove(diagram)
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + etree.tostring(root, encoding="unicode")
@@ -0,0 +1,321 @@
+import re
+from lxml import etree
+
+# BPMN 2.0 namespaces
+BPMN_NS = "http://www.omg.org/spec/BPMN/20100524/MODEL"
+BPMNDI_NS = "http://www.omg.org/spec/BPMN/20100524/DI"
+DC_NS = "http://www.omg.org/spec/DD/20100524/DC"
+DI_NS = "http://www.omg.org/spec/DD/20100524/DI"
+XSI_NS = "http://www.w3.org/2001/XMLSchema-instance"
+NAMESPACES = {"bpmn": BPMN_NS, "bpmndi": BPMNDI_NS, "dc": DC_NS, "di": DI_NS, "xsi": XSI_NS}
+
+FLOW_NODE_TAGS = {
+    "startEvent", "endEvent", "intermediateCatchEvent", "intermediateThrowEvent", "boundaryEvent",
+    "task", "userTask", "serviceTask", "scriptTask", "manualTask", "businessRuleTask", "sendTask",
+    "receiveTask", "callActivity", "subProcess", "transaction", "adHocSubProcess",
+    "exclusiveGateway", "parallelGateway", "inclusiveGateway", "eventBasedGateway", "complexGateway"
+}
+# Canonical spelling of element names, used to fix casing mistakes like <bpmn:ConditionExpression>
+KNOWN_TAGS = {
+    BPMN_NS: FLOW_NODE_TAGS | {
+        "definitions", "process", "collaboration", "participant", "messageFlow", "sequenceFlow",
+        "conditionExpression", "incoming", "outgoing", "laneSet", "lane", "flowNodeRef", "documentation",
+        "extensionElements", "dataObject", "dataObjectReference", "dataStoreReference", "textAnnotation",
+        "text", "association", "message", "messageEventDefinition", "timerEventDefinition",
+        "errorEventDefinition", "signalEventDefinition", "terminateEventDefinition",
+        "conditionalEventDefinition", "dataInputAssociation", "dataOutputAssociation", "sourceRef", "targetRef"
+    },
+    BPMNDI_NS: {"BPMNDiagram", "BPMNPlane", "BPMNShape", "BPMNEdge", "BPMNLabel"},
+    DC_NS: {"Bounds"},
+    DI_NS: {"waypoint"}
+}
+_CANONICAL_TAGS = {
+    ns: {name.lower(): name for name in names} for ns, names in KNOWN_TAGS.items()
+}
+# Children that precede incoming/outgoing in a flow node (BPMN 2.0 schema order)
+_LEADING_CHILDREN = {"documentation", "extensionElements"}
+
+def _q(name, ns=BPMN_NS):
+    return f"{{{ns}}}{name}"
+
+def _local(element):
+    return etree.QName(element).localname if isinstance(element.tag, str) else None
+
+def _remove(element):
+    """Remove an element, keeping the surrounding indentation intact"""
+    parent, previous = element.getparent(), element.getprevious()
+    if previous is not None:
+        previous.tail = element.tail
+    else:
+        parent.text = element.tail
+    parent.remove(element)
+
+def _issue(code, message, element_id=None):
+    return {"code": code, "element": element_id, "message": message}
+
+def format_issues(issues):
+    """One line per issue, for logs and prompts"""
+    return "\n".join(
+        f"- [{issue['code']}] {issue['message']}" + (f" (id: {issue['element']})" if issue["element"] else "")
+        for issue in issues
+    )
+
+def _declare_missing_namespaces(text, fixes):
+    """Add xmlns declarations for well-known BPMN prefixes that are used but never declared"""
+    match = re.search(r"<((?:\w+:)?definitions)\b[^>]*>", text)
+    if not match:
+        return text
+    declarations = []
+    for prefix, uri in NAMESPACES.items():
+        used = re.search(rf"[<\s/]{prefix}:\w", text)
+        # conditionExpression gets an xsi:type below, so make sure xsi is declared up front
+        if prefix == "xsi" and re.search(r"conditionexpression", text, re.IGNORECASE):
+            used = True
+        if f"xmlns:{prefix}=" not in text and used:
+            declarations.append(f' xmlns:{prefix}="{uri}"')
+            fixes.append(_issue("undeclared_namespace", f"Declared missing namespace prefix '{prefix}'"))
+    if not declarations:
+        return text
+    insert_at = match.start() + 1 + len(match.group(1))
+    return text[:insert_at] + "".join(declarations) + text[insert_at:]
+
+def _parse(text, fixes, problems):
+    """Parse strictly, falling back to lxml's recovering parser for malformed XML"""
+    data = text.encode("utf-8")
+    try:
+        return etree.fromstring(data, etree.XMLParser(resolve_entities=False, no_network=True))
+    except etree.XMLSyntaxError as e:
+        error = str(e)
+    root = etree.fromstring(data, etree.XMLParser(recover=True, resolve_entities=False, no_network=True))
+    if root is None or _local(root) != "definitions":
+        problems.append(_issue("malformed_xml", f"XML could not be parsed: {error}"))
+        return None
+    fixes.append(_issue("malformed_xml", f"Recovered from an XML syntax error: {error}"))
+    return root
+
+def _fix_casing(root, fixes):
+    for element in root.iter():
+        if not isinstance(element.tag, str):
+            continue
+        qname = etree.QName(element)
+        canonical = _CANONICAL_TAGS.get(qname.namespace, {}).get(qname.localname.lower())
+        if canonical and canonical != qname.localname:
+            element.tag = _q(canonical, qname.namespace)
+            fixes.append(_issue("element_casing", f"Renamed <{qname.localname}> to <{canonical}>", element.get("id")))
+
+def _fix_condition_expressions(root, fixes):
+    for expression in root.iter(_q("conditionExpression")):
+        if expression.get(_q("type", XSI_NS)) is None:
+            expression.set(_q("type", XSI_NS), "tFormalExpression")
+            fixes.append(_issue("condition_expression", "Added xsi:type to a conditionExpression", expression.getparent().get("id")))
+
+def _fix_missing_ids(root, fixes):
+    """Give processes, flow nodes and sequence flows without an id a generated one"""
+    used = {element.get("id") for element in root.iter() if isinstance(element.tag, str) and element.get("id")}
+    for element in root.iter():
+        if not isinstance(element.tag, str) or element.get("id") or etree.QName(element).namespace != BPMN_NS:
+            continue
+        name = _local(element)
+        if name not in FLOW_NODE_TAGS and name not in ("process", "sequenceFlow"):
+            continue
+        n = 1
+        while f"{name}_{n}" in used:
+            n += 1
+        element.set("id", f"{name}_{n}")
+        used.add(f"{name}_{n}")
+        fixes.append(_issue("missing_id", f"Added an id to a <{name}>", f"{name}_{n}"))
+
+def _fix_duplicate_ids(root, fixes, problems):
+    """Drop exact duplicates, renumber duplicate flows (their references are rebuilt) and report the rest"""
+    seen = {}
+    used = {element.get("id") for element in root.iter() if isinstance(element.tag, str) and element.get("id")}
+    for element in list(root.iter()):
+        if not isinstance(element.tag, str):
+            continue
+        element_id = element.get("id")
+        if not element_id:
+            continue
+        first = seen.get(element_id)
+        if first is None:
+            seen[element_id] = element
+            continue
+        if etree.tostring(first) == etree.tostring(element):
+            _remove(element)
+            fixes.append(_issue("duplicate_id", "Removed a duplicate element", element_id))
+            continue
+        n = 2
+        while f"{element_id}_{n}" in used:
+            n += 1
+        new_id = f"{element_id}_{n}"
+        used.add(new_id)
+        element.set("id", new_id)
+        if _local(element) == "sequenceFlow":
+            fixes.append(_issue("duplicate_id", f"Renamed a duplicate sequenceFlow to {new_id}", element_id))
+        else:
+            problems.append(_issue(
+                "duplicate_id",
+                f"Two different <{_local(element)}> elements shared this id; the second was renamed to {new_id} "
+                f"and references to it may point at the wrong element",
+                element_id
+            ))
+
+def _flow_nodes(root):
+    return {
+        element.get("id"): element for element in root.iter()
+        if isinstance(element.tag, str) and etree.QName(element).namespace == BPMN_NS
+        and _local(element) in FLOW_NODE_TAGS and element.get("id")
+    }
+
+def _remove_dangling(root, tag, targets, fixes, code):
+    """Remove connecting elements whose sourceRef or targetRef does not resolve"""
+    for element in list(root.iter(_q(tag))):
+        source, target = element.get("sourceRef"), element.get("targetRef")
+        if source not in targets or target not in targets:
+            _remove(element)
+            fixes.append(_issue(code, f"Removed {tag} with undefined sourceRef/targetRef ({source} -> {target})", element.get("id")))
+
+def _fix_node_references(nodes, flows, fixes):
+    """Rebuild incoming/outgoing of every flow node from the sequence flows that actually exist"""
+    expected = {node_id: ([], []) for node_id in nodes}
+    for flow in flows:
+        expected[flow.get("targetRef")][0].append(flow.get("id"))
+        expected[flow.get("sourceRef")][1].append(flow.get("id"))
+    for node_id, node in nodes.items():
+        incoming, outgoing = expected[node_id]
+        current_in = [child.text.strip() for child in node.findall(_q("incoming")) if child.text]
+        current_out = [child.text.strip() for child in node.findall(_q("outgoing")) if child.text]
+        if sorted(current_in) == sorted(incoming) and sorted(current_out) == sorted(outgoing):
+            continue
+        for child in node.findall(_q("incoming")) + node.findall(_q("outgoing")):
+            node.remove(child)
+        position = 0
+        for child in node:
+            if _local(child) not in _LEADING_CHILDREN:
+                break
+            position += 1
+        for tag, refs in (("incoming", incoming), ("outgoing", outgoing)):
+            for ref in refs:
+                child = etree.Element(_q(tag), nsmap=node.nsmap)
+                child.text = ref
+                child.tail = node.text
+                node.insert(position, child)
+                position += 1
+        fixes.append(_issue("flow_references", "Rebuilt incoming/outgoing from the sequence flows", node_id))
+
+def _fix_lanes(root, nodes, fixes):
+    for ref in list(root.iter(_q("flowNodeRef"))):
+        if (ref.text or "").strip() not in nodes:
+            _remove(ref)
+            fixes.append(_issue("lane_reference", f"Removed lane reference to undefined node {ref.text}"))
+
+def _fix_diagram(root, ids, fixes):
+    """Drop shapes and edges for undefined or already drawn elements; lay the diagram out again if anything is undrawn"""
+    drawn = set()
+    for tag in ("BPMNShape", "BPMNEdge"):
+        for element in list(root.iter(_q(tag, BPMNDI_NS))):
+            target = element.get("bpmnElement")
+            if target not in ids or (tag, target) in drawn:
+                _remove(element)
+                fixes.append(_issue("orphaned_di", f"Removed {tag} for undefined or already drawn element", target))
+            else:
+                drawn.add((tag, target))
+    planes = list(root.iter(_q("BPMNPlane", BPMNDI_NS)))
+    containers = root.findall(_q("collaboration")) or root.findall(_q("process"))
+    for plane in planes:
+        if plane.get("bpmnElement") not in ids and len(containers) == 1:
+            plane.set("bpmnElement", containers[0].get("id"))
+            fixes.append(_issue("orphaned_di", "Pointed the BPMNPlane at the diagram's root element", containers[0].get("id")))
+    undrawn = [node_id for node_id in _flow_nodes(root) if ("BPMNShape", node_id) not in drawn]
+    undrawn += [flow.get("id") for flow in root.iter(_q("sequenceFlow")) if ("BPMNEdge", flow.get("id")) not in drawn]
+    if not planes or undrawn:
+        # Imported here: the layout engine builds on this module's namespace constants
+        from utils.bpmn_layout import layout_definitions
+        layout_definitions(root)
+        fixes.append(_issue(
+            "missing_di",
+            "Generated the diagram layout" if not planes else f"Regenerated the diagram layout, {len(undrawn)} element(s) had no BPMNShape/BPMNEdge"
+        ))
+
+def _check_semantics(root, nodes, flows, problems):
+    """Problems that need judgement about the process itself, not just its structure"""
+    processes = root.findall(_q("process"))
+    if not processes:
+        problems.append(_issue("no_process", "The definitions contain no process"))
+        return
+    for process in processes:
+        process_nodes = [child for child in process if _local(child) in FLOW_NODE_TAGS]
+        if not process_nodes:
+            continue
+        if not any(_local(node) == "startEvent" for node in process_nodes):
+            problems.append(_issue("no_start_event", "Process has no start event", process.get("id")))
+        if not any(_local(node) == "endEvent" for node in process_nodes):
+            problems.append(_issue("no_end_event", "Process has no end event", process.get("id")))
+    successors = {}
+    for flow in flows:
+        successors.setdefault(flow.get("sourceRef"), []).append(flow.get("targetRef"))
+    # Boundary events start from their host; subprocess contents from their own start events
+    for node_id, node in nodes.items():
+        if _local(node) == "boundaryEvent" and node.get("attachedToRef") in nodes:
+            successors.setdefault(node.get("attachedToRef"), []).append(node_id)
+    reached = set()
+    pending = [node_id for node_id, node in nodes.items() if _local(node) == "startEvent"]
+    while pending:
+        node_id = pending.pop()
+        if node_id in reached:
+            continue
+        reached.add(node_id)
+        pending.extend(successors.get(node_id, []))
+        if _local(nodes[node_id]) in ("subProcess", "transaction", "adHocSubProcess"):
+            pending.extend(child.get("id") for child in nodes[node_id] if child.get("id") in nodes)
+    for flow in flows:
+        source = nodes.get(flow.get("sourceRef"))
+        if source is not None and _local(source) == "endEvent":
+            problems.append(_issue("end_event_outgoing", f"endEvent {flow.get('sourceRef')} has an outgoing sequence flow", flow.get("id")))
+    for node_id, node in nodes.items():
+        if node_id not in reached:
+            problems.append(_issue("unreachable_node", f"<{_local(node)}> cannot be reached from a start event", node_id))
+        elif _local(node) != "endEvent" and not any(flow.get("sourceRef") == node_id for flow in flows) \
+                and _local(node.getparent()) == "process":
+            problems.append(_issue("dead_end", f"<{_local(node)}> has no outgoing sequence flow", node_id))
+
+def repair_bpmn(bpmn_xml):
+    """
+    Validate BPMN 2.0 XML and repair its mechanical problems locally: undeclared
+    namespaces, element casing, conditionExpression types, missing and duplicate IDs, dangling
+    sourceRef/targetRef, incoming/outgoing lists, orphaned diagram elements and
+    missing diagram layout.
+    Returns (xml, fixes, problems); problems are the issues left for the LLM refiner.
+    The input is returned unchanged when there was nothing to fix.
+    """
+    fixes, problems = [], []
+    text = (bpmn_xml or "").strip().lstrip("\ufeff")
+    if not text:
+        return bpmn_xml, fixes, [_issue("empty", "No BPMN XML to refine")]
+    text = _declare_missing_namespaces(text, fixes)
+    root = _parse(text, fixes, problems)
+    if root is None:
+        return bpmn_xml, fixes, problems
+    if etree.QName(root).namespace != BPMN_NS or _local(root) != "definitions":
+        problems.append(_issue("not_bpmn", "Root element is not <bpmn:definitions>"))
+        return bpmn_xml, fixes, problems
+
+    _fix_casing(root, fixes)
+    _fix_condition_expressions(root, fixes)
+    _fix_missing_ids(root, fixes)
+    _fix_duplicate_ids(root, fixes, problems)
+    nodes = _flow_nodes(root)
+    _remove_dangling(root, "sequenceFlow", nodes, fixes, "dangling_flow")
+    ids = {element.get("id") for element in root.iter() if isinstance(element.tag, str) and element.get("id")}
+    _remove_dangling(root, "messageFlow", ids, fixes, "dangling_flow")
+    _remove_dangling(root, "association", ids, fixes, "dangling_association")
+    flows = list(root.iter(_q("sequenceFlow")))
+    _fix_node_references(nodes, flows, fixes)
+    _fix_lanes(root, nodes, fixes)
+    ids = {element.get("id") for element in root.iter() if isinstance(element.tag, str) and element.get("id")}
+    _fix_diagram(root, ids, fixes)
+    _check_semantics(root, nodes, flows, problems)
+
+    if not fixes:
+        return bpmn_xml, fixes, problems
+    xml = '<?xml version="1.0" encoding="UTF-8"?>\n' + etree.tostring(root, encoding="unicode")
+    return xml, fixes, problems
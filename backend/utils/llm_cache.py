@@ -0,0 +1,145 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from config import S3_BUCKET, LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES, LLM_CACHE_S3_PREFIX
+from utils.aws_clients import get_s3_client
+
+_stats = {"hits": 0, "disk_hits": 0, "s3_hits": 0, "misses": 0, "bypassed": 0, "writes": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+_write_lock = threading.Lock()
+_initialized = False
+
+def _count(*names, n=1):
+    with _stats_lock:
+        for name in names:
+            _stats[name] += n
+
+def make_cache_key(model, system_prompt, prompt, agent=None, prompt_version=None, response_format=None):
+    """Content-addressed cache key for one LLM call"""
+    parts = [model, system_prompt, prompt, agent, prompt_version]
+    # Only structured-output calls add the format, so existing keys stay valid
+    if response_format:
+        parts.append(response_format)
+    payload = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _connect():
+    """Open a connection to the on-disk cache, creating the schema on first use"""
+    global _initialized
+    conn = sqlite3.connect(LLM_CACHE_PATH, timeout=30)
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+        conn.commit()
+        _initialized = True
+    return conn
+
+def _disk_get(key):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+        return row[0]
+    finally:
+        conn.close()
+
+def _disk_put(key, response):
+    size = len(response.encode('utf-8'))
+    now = time.time()
+    with _write_lock:
+        conn = _connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            _evict(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+def _evict(conn):
+    """Drop least-recently-used entries until the cache fits in LLM_CACHE_MAX_BYTES"""
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+    if total <= LLM_CACHE_MAX_BYTES:
+        return
+    evicted = 0
+    for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC").fetchall():
+        if total <= LLM_CACHE_MAX_BYTES:
+            break
+        conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+        total -= size
+        evicted += 1
+    _count("evictions", n=evicted)
+
+def _s3_key(key):
+    return f"{LLM_CACHE_S3_PREFIX.rstrip('/')}/{key}.txt"
+
+def _s3_get(key):
+    if not (LLM_CACHE_S3_PREFIX and S3_BUCKET):
+        return None
+    try:
+        response = get_s3_client().get_object(Bucket=S3_BUCKET, Key=_s3_key(key))
+        return response['Body'].read().decode('utf-8')
+    except Exception:
+        return None
+
+def _s3_put(key, response):
+    if not (LLM_CACHE_S3_PREFIX and S3_BUCKET):
+        return
+    get_s3_client().put_object(Bucket=S3_BUCKET, Key=_s3_key(key), Body=response.encode('utf-8'), ContentType='text/plain')
+
+def cache_get(key):
+    """Look up a cached response (disk first, then the shared S3 tier)"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    try:
+        response = _disk_get(key)
+        if response is not None:
+            _count("hits", "disk_hits")
+            return response
+        response = _s3_get(key)
+        if response is not None:
+            _count("hits", "s3_hits")
+            # Promote to the local tier
+            _disk_put(key, response)
+            return response
+    except Exception as e:
+        print(f"[llm_cache] Error reading cache entry {key}: {e}")
+    _count("misses")
+    return None
+
+def cache_put(key, response):
+    """Store a response in every enabled cache tier"""
+    if not LLM_CACHE_ENABLED or response is None:
+        return
+    try:
+        _disk_put(key, response)
+        _s3_put(key, response)
+        _count("writes")
+    except Exception as e:
+        print(f"[llm_cache] Error writing cache entry {key}: {e}")
+
+def record_bypass():
+    """Count a call that skipped the cache lookup on purpose"""
+    _count("bypassed")
+
+def get_cache_stats():
+    """Get hit/miss counters for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    stats["enabled"] = LLM_CACHE_ENABLED
+    stats["s3_tier"] = bool(LLM_CACHE_S3_PREFIX)
+    return stats
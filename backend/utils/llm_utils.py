@@ -1,19 +1,373 @@
-import os
+import re
+import json
+import time
+import queue
+import random
+import threading
 import openai
+from config import (
+    OPENAI_API_KEY, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_RETRIES,
+    LLM_REQUEST_TIMEOUT, LLM_CALL_DEADLINE, LLM_JSON_REPAIR_ATTEMPTS,
+)
+from utils.llm_cache import make_cache_key, cache_get, cache_put, record_bypass
+from utils.resource_limits import RESOURCE_SLOTS
 
-# Configure OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-def call_llm(prompt):
-    """Call OpenAI LLM with the given prompt"""
-    response = openai.chat.completions.create(
-        model="gpt-4.1",
-        messages=[
-            {"role": "system", "content": "You are a BPMN process builder."},
-            {"role": "user", "content": prompt}
-        ]
+# Configure OpenAI (OPENAI_BASE_URL can point at a local fake server for testing)
+openai.api_key = OPENAI_API_KEY
+# Retries are handled by the gateway below
+openai.max_retries = 0
+
+LLM_MODEL = "gpt-4.1"
+SYSTEM_PROMPT = "You are a BPMN process builder."
+
+# LLM gateway backoff bounds (seconds)
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 30.0
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when an LLM call cannot complete before its deadline"""
+
+class LLMOutputError(Exception):
+    """Raised when a structured LLM response is still unusable after its repair attempts"""
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount, deadline):
+        """Block until amount tokens are available; returns the time spent waiting"""
+        amount = min(float(amount), self.capacity)
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return now - start
+                wait = (amount - self.tokens) / self.rate
+            if now + wait > deadline:
+                raise LLMDeadlineExceeded("Rate limit wait would exceed the call deadline")
+            time.sleep(min(wait, 1.0))
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit: grows by ~1 per limit's worth of successful calls,
+    halves on throttling, and never exceeds max_limit.
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = float(max_limit)
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, deadline):
+        start = time.monotonic()
+        with self.cond:
+            while self.in_flight >= max(1, int(self.limit)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LLMDeadlineExceeded("Timed out waiting for an LLM concurrency slot")
+                self.cond.wait(remaining)
+            self.in_flight += 1
+        return time.monotonic() - start
+
+    def release(self, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+_request_bucket = TokenBucket(LLM_REQUESTS_PER_MINUTE)
+_token_bucket = TokenBucket(LLM_TOKENS_PER_MINUTE)
+_limiter = AdaptiveConcurrencyLimiter(RESOURCE_SLOTS["llm"])
+_metrics = {
+    "requests": 0,
+    "successes": 0,
+    "failures": 0,
+    "throttled": 0,
+    "retries": 0,
+    "json_repairs": 0,
+    "queue_wait_seconds_total": 0.0,
+    "queue_wait_seconds_max": 0.0
+}
+_metrics_lock = threading.Lock()
+
+def _record(**increments):
+    with _metrics_lock:
+        for name, value in increments.items():
+            if name == "queue_wait_seconds_max":
+                _metrics[name] = max(_metrics[name], value)
+            else:
+                _metrics[name] += value
+
+def get_llm_metrics():
+    """Get LLM gateway counters for this worker"""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["concurrency_limit"] = round(_limiter.limit, 2)
+    metrics["in_flight"] = _limiter.in_flight
+    return metrics
+
+def estimate_tokens(text):
+    """Rough prompt token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+def _is_retryable(error):
+    """Return (retryable, throttled) for an OpenAI error"""
+    if isinstance(error, openai.RateLimitError):
+        return True, True
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+        return True, False
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500, error.status_code == 429
+    return False, False
+
+def _retry_delay(error, attempt):
+    """Full-jitter exponential backoff, honouring Retry-After when the server sends it"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after) + random.uniform(0, 1)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+def _create_completion(messages, timeout, on_delta=None, response_format=None):
+    """Run one completion request and return its text, streaming deltas to on_delta if given"""
+    options = {"response_format": response_format} if response_format else {}
+    if on_delta is None:
+        response = openai.chat.completions.create(model=LLM_MODEL, messages=messages, timeout=timeout, **options)
+        return response.choices[0].message.content
+    stream = openai.chat.completions.create(model=LLM_MODEL, messages=messages, timeout=timeout, stream=True, **options)
+    parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+    return "".join(parts)
+
+def complete_chat(messages, deadline=None, on_delta=None, response_format=None):
+    """
+    Send a chat completion through the shared gateway: request and token-rate
+    buckets, adaptive concurrency, per-attempt timeouts and jittered retries.
+    Returns the completion text. With on_delta, the completion is streamed and
+    on_delta(text) is called per chunk; a stream that fails after emitting
+    output is not retried (the caller would see duplicated text).
+    response_format is passed through (e.g. JSON_RESPONSE_FORMAT).
+    """
+    deadline = deadline or time.monotonic() + LLM_CALL_DEADLINE
+    estimated = sum(estimate_tokens(message["content"]) for message in messages)
+    attempt = 0
+    while True:
+        waited = _request_bucket.acquire(1, deadline)
+        waited += _token_bucket.acquire(estimated, deadline)
+        waited += _limiter.acquire(deadline)
+        _record(requests=1, queue_wait_seconds_total=waited, queue_wait_seconds_max=waited)
+        throttled = False
+        emitted = []
+        def track_delta(delta):
+            emitted.append(True)
+            on_delta(delta)
+        try:
+            timeout = min(LLM_REQUEST_TIMEOUT, max(1.0, deadline - time.monotonic()))
+            content = _create_completion(messages, timeout, track_delta if on_delta else None, response_format)
+            _record(successes=1)
+            return content
+        except Exception as e:
+            retryable, throttled = _is_retryable(e)
+            retryable = retryable and not emitted
+            if throttled:
+                _record(throttled=1)
+            delay = _retry_delay(e, attempt)
+            if not retryable or attempt >= LLM_MAX_RETRIES or time.monotonic() + delay > deadline:
+                _record(failures=1)
+                raise
+            print(f"[call_llm] Attempt {attempt + 1} failed ({e}); retrying in {delay:.1f}s")
+            _record(retries=1)
+        finally:
+            _limiter.release(throttled=throttled)
+        time.sleep(delay)
+        attempt += 1
+
+def call_llm(prompt, agent=None, prompt_version=None, bypass_cache=False, on_delta=None, response_format=None):
+    """
+    Call OpenAI LLM with the given prompt.
+    Responses are cached by content; bypass_cache=True forces a fresh
+    generation (which then replaces the cached entry). With on_delta the
+    completion is streamed (a cache hit is delivered as a single delta).
+    """
+    cache_key = make_cache_key(LLM_MODEL, SYSTEM_PROMPT, prompt, agent, prompt_version, response_format)
+    if bypass_cache:
+        record_bypass()
+    else:
+        cached = cache_get(cache_key)
+        if cached is not None:
+            if on_delta:
+                on_delta(cached)
+            return cached
+
+    content = complete_chat([
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ], on_delta=on_delta, response_format=response_format)
+    cache_put(cache_key, content)
+    return content
+
+class JSONStreamParser:
+    """
+    Incremental scanner for the first top-level JSON object in a stream of
+    text: nesting and string state are tracked as deltas arrive (jumping
+    between structural characters), so the end of the object is known the
+    moment it is emitted and the text is never rescanned.
+    """
+    _TOKENS = re.compile(r'[{}"\\]')
+
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.start = None
+        self.end = None
+
+    def feed(self, text):
+        base = self.length
+        self.parts.append(text)
+        self.length += len(text)
+        if self.end is not None:
+            return
+        skip = 1 if self.escape else 0
+        self.escape = False
+        for match in self._TOKENS.finditer(text, skip):
+            i = match.start()
+            if i < skip:
+                continue
+            char = match.group()
+            if self.in_string:
+                if char == '\\':
+                    # Skip the escaped character, which may arrive in the next delta
+                    skip = i + 2
+                    self.escape = skip > len(text)
+                elif char == '"':
+                    self.in_string = False
+            elif self.start is None:
+                if char == '{':
+                    self.start, self.depth = base + i, 1
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = base + i + 1
+                    return
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    def text(self):
+        return "".join(self.parts)
+
+    def value(self):
+        """The parsed object; raises ValueError if it is missing, unfinished or invalid"""
+        if self.start is None:
+            raise ValueError("Response contains no JSON object")
+        if self.end is None:
+            raise ValueError("Response ends before the JSON object is complete")
+        return json.loads(self.text()[self.start:self.end])
+
+def call_llm_json(prompt, agent=None, prompt_version=None, bypass_cache=False, on_delta=None, validate=None):
+    """
+    Call the LLM in JSON mode and return the parsed object. validate(value) may
+    raise ValueError to reject it; an unusable response gets up to
+    LLM_JSON_REPAIR_ATTEMPTS repair calls that show the model its output and
+    the error. A response that parses but still fails validation is returned
+    as is; LLMOutputError is raised when no JSON object could be obtained.
+    """
+    parser = JSONStreamParser()
+    def on_text(delta):
+        parser.feed(delta)
+        on_delta(delta)
+    content = call_llm(
+        prompt, agent=agent, prompt_version=prompt_version, bypass_cache=bypass_cache,
+        on_delta=on_text if on_delta else None, response_format=JSON_RESPONSE_FORMAT
     )
-    return response.choices[0].message.content
+    if not on_delta:
+        parser.feed(content)
+
+    value, error = None, None
+    for attempt in range(LLM_JSON_REPAIR_ATTEMPTS + 1):
+        try:
+            value = parser.value()
+            if not isinstance(value, dict):
+                raise ValueError("Response must be a JSON object")
+            if validate:
+                validate(value)
+            if attempt:
+                # Later calls with the same prompt get the repaired response from the cache
+                cache_put(make_cache_key(LLM_MODEL, SYSTEM_PROMPT, prompt, agent, prompt_version, JSON_RESPONSE_FORMAT), content)
+            return value
+        except ValueError as e:
+            error = e
+        if attempt == LLM_JSON_REPAIR_ATTEMPTS:
+            break
+        print(f"[call_llm_json] {agent or 'LLM'} response unusable ({error}); repair attempt {attempt + 1}")
+        _record(json_repairs=1)
+        content = complete_chat([
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": content},
+            {"role": "user", "content": f"That response could not be used: {error}. Return the complete corrected JSON object only."}
+        ], response_format=JSON_RESPONSE_FORMAT)
+        parser = JSONStreamParser()
+        parser.feed(content)
+
+    if isinstance(value, dict):
+        print(f"[call_llm_json] Using {agent or 'LLM'} response that still fails validation: {error}")
+        return value
+    raise LLMOutputError(f"{agent or 'LLM'} did not return a usable JSON object: {error}")
+
+def stream_llm(prompt, agent=None, prompt_version=None):
+    """Generator of text deltas for a prompt (the call runs on a background thread)"""
+    deltas = queue.Queue()
+    done = object()
+
+    def run():
+        try:
+            call_llm(prompt, agent=agent, prompt_version=prompt_version, on_delta=deltas.put)
+        except Exception as e:
+            deltas.put(e)
+        finally:
+            deltas.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        item = deltas.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
 
 def extract_xml_content(text):
     """
@@ -54,4 +408,27 @@ def extract_xml_content(text):
     if not xml_content.startswith('<?xml') and not xml_content.startswith('<bpmn:definitions'):
         return text  # Something went wrong, return original
     
-    return xml_content 
\ No newline at end of file
+    return xml_content
+
+def extract_json_content(text, required_key=None):
+    """
+    Extract the first JSON object from an LLM response, skipping explanatory
+    text and markdown fences. Returns the parsed dict, or None if there is none
+    (or none containing required_key).
+    """
+    if not text:
+        return None
+    # Prefer fenced ```json blocks, then any object in the text
+    candidates = [block for block in re.findall(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)] + [text]
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        start = candidate.find('{')
+        while start != -1:
+            try:
+                value, _ = decoder.raw_decode(candidate, start)
+            except ValueError:
+                value = None
+            if isinstance(value, dict) and (required_key is None or required_key in value):
+                return value
+            start = candidate.find('{', start + 1)
+    return None
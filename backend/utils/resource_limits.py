@@ -0,0 +1,22 @@
+import threading
+from contextlib import contextmanager
+from config import TEXTRACT_SLOTS, LLM_SLOTS
+
+# Process-wide concurrency limits per external resource (not per job)
+RESOURCE_SLOTS = {
+    "textract": TEXTRACT_SLOTS,
+    # Upper bound for the adaptive LLM concurrency limiter in utils/llm_utils.py
+    "llm": LLM_SLOTS
+}
+
+_semaphores = {name: threading.BoundedSemaphore(slots) for name, slots in RESOURCE_SLOTS.items()}
+
+@contextmanager
+def resource_slot(name):
+    """Hold one slot of a limited resource for the duration of the block"""
+    semaphore = _semaphores[name]
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
@@ -1,20 +1,34 @@
 import os
 import json
-import boto3
 from datetime import datetime
+from config import RESULTS_CATALOG_PREFIX, JOB_STORE_S3_PREFIX
+from utils.aws_clients import get_s3_client
 
-# Configure S3 client
-s3 = boto3.client('s3')
+# Shared S3 client
+s3 = get_s3_client()
 S3_BUCKET = os.getenv("AWS_S3_BUCKET")
 
-def upload_to_s3(file_path, bucket, key):
+# Bucket prefixes used by the backend itself rather than for input documents
+# (the catalog and job store prefixes are configurable)
+INTERNAL_PREFIXES = tuple(
+    prefix.rstrip('/') + '/'
+    for prefix in ("results/", "served/", "auth/", "cache/", RESULTS_CATALOG_PREFIX, JOB_STORE_S3_PREFIX)
+)
+
+def is_internal_key(key):
+    """Check if an S3 key belongs to the backend's own data rather than an input document"""
+    return key.startswith(INTERNAL_PREFIXES)
+
+def upload_to_s3(file_path, bucket, key, metadata=None):
     """Upload a file to S3"""
-    s3.upload_file(file_path, bucket, key)
+    extra_args = {"Metadata": metadata} if metadata else None
+    s3.upload_file(file_path, bucket, key, ExtraArgs=extra_args)
 
-def upload_output_to_s3(local_path, s3_input_key, output_name):
+def upload_output_to_s3(local_path, s3_input_key, output_name, metadata=None):
     """Upload output file to S3 with organized structure"""
     s3_key = f"results/{s3_input_key}/{output_name}"
-    s3.upload_file(local_path, S3_BUCKET, s3_key)
+    extra_args = {"Metadata": metadata} if metadata else None
+    s3.upload_file(local_path, S3_BUCKET, s3_key, ExtraArgs=extra_args)
     return s3_key
 
 def download_output_from_s3(s3_input_key, output_name, local_path):
@@ -39,55 +53,40 @@ def get_s3_file_metadata(s3_key):
         print(f"[get_s3_file_metadata] Error getting metadata for {s3_key}: {e}")
         return None
 
-def list_results_structure():
-    """List all results in S3 under results/ with timestamps"""
-    response = s3.list_objects_v2(Bucket=S3_BUCKET, Prefix="results/")
-    files = response.get("Contents", [])
-    structure = {}
-    timestamps = {}
-    
-    for obj in files:
-        key = obj["Key"]
-        if key.endswith("/"):
-            continue
-        parts = key.split("/", 2)
-        if len(parts) < 3:
-            continue
-        _, input_s3_key, output_name = parts
-        
-        # Store file list
-        if input_s3_key not in structure:
-            structure[input_s3_key] = []
-        structure[input_s3_key].append(output_name)
-        
-        # Store timestamp information
-        if input_s3_key not in timestamps:
-            timestamps[input_s3_key] = {
-                "last_modified": None,
-                "files_count": 0,
-                "latest_file": None
-            }
-        
-        # Update timestamp info
-        file_timestamp = obj.get("LastModified")
-        if file_timestamp:
-            if timestamps[input_s3_key]["last_modified"] is None or file_timestamp > timestamps[input_s3_key]["last_modified"]:
-                timestamps[input_s3_key]["last_modified"] = file_timestamp
-                timestamps[input_s3_key]["latest_file"] = output_name
-            timestamps[input_s3_key]["files_count"] += 1
-    
-    return structure, timestamps
+def list_input_files():
+    """List input documents (non-internal keys) with their timestamps, across all pages"""
+    files = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET):
+        for obj in page.get("Contents", []):
+            if is_internal_key(obj["Key"]) or obj["Key"].endswith("/"):
+                continue
+            files.append(obj)
+    return files
+
+def list_output_objects(s3_input_key):
+    """List the outputs under results/<key>/ as {output_name: listing entry} (usually one request)"""
+    prefix = f"results/{s3_input_key}/"
+    outputs = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            name = obj["Key"][len(prefix):]
+            # Skip outputs of inputs nested under this key
+            if name and "/" not in name:
+                outputs[name] = obj
+    return outputs
 
 def list_s3_files():
     """List all files in S3 bucket, excluding auth files"""
     try:
         if not S3_BUCKET:
             return {"error": "S3_BUCKET not configured"}
-        response = s3.list_objects_v2(Bucket=S3_BUCKET)
-        files = [obj["Key"] for obj in response.get("Contents", [])]
+        paginator = s3.get_paginator('list_objects_v2')
+        files = [obj["Key"] for page in paginator.paginate(Bucket=S3_BUCKET) for obj in page.get("Contents", [])]
         
-        # Filter out auth files
-        filtered_files = [file for file in files if not file.startswith("auth/")]
+        # Filter out auth files and other internal prefixes
+        filtered_files = [file for file in files if not is_internal_key(file) or file.startswith("results/")]
         
         return {"files": filtered_files}
     except Exception as e:
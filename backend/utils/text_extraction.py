@@ -1,43 +1,316 @@
-import os
+import json
 import time
-import boto3
+import uuid
+import random
+import asyncio
+import concurrent.futures
+import tempfile
+import threading
+from functools import partial
 import pdfplumber
+from botocore.exceptions import ClientError
+from PyPDF2 import PdfReader, PdfWriter
+from config import (
+    TEXTRACT_POLL_INITIAL, TEXTRACT_POLL_MAX, TEXTRACT_TIMEOUT, TEXTRACT_MAX_RETRIES, TEXTRACT_RETRY_BASE,
+    TEXTRACT_SNS_TOPIC_ARN, TEXTRACT_SNS_ROLE_ARN, TEXTRACT_SQS_QUEUE_URL, PDF_TEXT_MIN_CHARS,
+)
+from utils.aws_clients import get_client, get_s3_client, get_textract_client
+from utils.resource_limits import resource_slot
 
-# Configure AWS clients
-textract = boto3.client('textract', region_name=os.getenv('AWS_DEFAULT_REGION'))
+# Textract polling backs off geometrically from TEXTRACT_POLL_INITIAL up to TEXTRACT_POLL_MAX
+TEXTRACT_POLL_FACTOR = 1.5
+# Throttled Textract calls are retried with jittered exponential backoff
+TEXTRACT_THROTTLE_CODES = ("ThrottlingException", "ProvisionedThroughputExceededException", "LimitExceededException")
+# Scanned pages of mixed PDFs are uploaded here for Textract and deleted afterwards
+OCR_STAGING_PREFIX = "cache/ocr/"
+SPOOL_MAX_MEMORY = 16 * 1024 * 1024
+# With notifications enabled, a waiter still checks its job this often in case the
+# message went to another process; messages nobody here waits for are deleted after
+# this many receives (their jobs are picked up by that check instead)
+TEXTRACT_NOTIFICATION_CHECK = 30
+TEXTRACT_SQS_MAX_RECEIVES = 5
 
-def extract_text_from_s3(bucket, key):
-    """Extract text from image files using AWS Textract"""
-    # 1. Start the Textract job
-    response = textract.start_document_text_detection(
-        DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}}
-    )
-    job_id = response['JobId']
+# One process-wide consumer routes completion messages to waiters by JobId
+_waiters = {}
+_waiters_lock = threading.Lock()
+_consumer = None
+
+def _notifications_enabled():
+    return bool(TEXTRACT_SNS_TOPIC_ARN and TEXTRACT_SNS_ROLE_ARN and TEXTRACT_SQS_QUEUE_URL)
+
+async def _call(fn, **kwargs):
+    """Run a blocking boto3 call without blocking the event loop, retrying throttling errors"""
+    loop = asyncio.get_running_loop()
+    for attempt in range(TEXTRACT_MAX_RETRIES + 1):
+        try:
+            return await loop.run_in_executor(None, partial(fn, **kwargs))
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in TEXTRACT_THROTTLE_CODES or attempt == TEXTRACT_MAX_RETRIES:
+                raise
+            delay = TEXTRACT_RETRY_BASE * 2 ** attempt * random.uniform(0.5, 1)
+            print(f"[textract] {code} from {getattr(fn, '__name__', 'call')}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+async def start_text_detection(bucket, key, client=None):
+    """Start an async Textract text detection job and return its JobId"""
+    client = client or get_textract_client()
+    params = {"DocumentLocation": {'S3Object': {'Bucket': bucket, 'Name': key}}}
+    if _notifications_enabled():
+        params["NotificationChannel"] = {
+            "SNSTopicArn": TEXTRACT_SNS_TOPIC_ARN,
+            "RoleArn": TEXTRACT_SNS_ROLE_ARN
+        }
+    response = await _call(client.start_document_text_detection, **params)
+    return response['JobId']
+
+def _parse_notification(message):
+    """Textract payload of an SQS message (SNS wraps it in a "Message" field)"""
+    try:
+        body = json.loads(message["Body"])
+        return json.loads(body.get("Message", message["Body"]))
+    except (ValueError, TypeError, AttributeError):
+        return {}
+
+def _consume_notifications():
+    """Long-poll the SQS queue and resolve waiters until none are left"""
+    global _consumer
+    sqs = get_client('sqs')
+    while True:
+        with _waiters_lock:
+            if not _waiters:
+                _consumer = None
+                return
+        try:
+            response = sqs.receive_message(
+                QueueUrl=TEXTRACT_SQS_QUEUE_URL,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=20,
+                AttributeNames=["ApproximateReceiveCount"]
+            )
+            for message in response.get("Messages", []):
+                payload = _parse_notification(message)
+                with _waiters_lock:
+                    future = _waiters.pop(payload.get("JobId"), None)
+                receives = int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+                if future is None and receives < TEXTRACT_SQS_MAX_RECEIVES:
+                    # Another process may be waiting on it: leave it for the visibility timeout
+                    continue
+                sqs.delete_message(QueueUrl=TEXTRACT_SQS_QUEUE_URL, ReceiptHandle=message["ReceiptHandle"])
+                if future is not None and future.set_running_or_notify_cancel():
+                    future.set_result(payload.get("Status"))
+        except Exception as e:
+            print(f"[textract] Error receiving notifications: {e}")
+            time.sleep(TEXTRACT_POLL_MAX)
 
-    # 2. Poll for the job to complete
+async def _wait_for_notification(job_id, timeout):
+    """Wait up to timeout seconds for this job's completion message. Returns the status or None."""
+    global _consumer
+    future = concurrent.futures.Future()
+    with _waiters_lock:
+        _waiters[job_id] = future
+        if _consumer is None:
+            _consumer = threading.Thread(target=_consume_notifications, name="textract-notifications", daemon=True)
+            _consumer.start()
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        with _waiters_lock:
+            if _waiters.get(job_id) is future:
+                del _waiters[job_id]
+
+async def wait_for_text_detection(job_id, client=None, timeout=TEXTRACT_TIMEOUT):
+    """Wait for a Textract job to finish and return the first page of results"""
+    client = client or get_textract_client()
+    deadline = time.monotonic() + timeout
+
+    delay = TEXTRACT_POLL_INITIAL
+    while True:
+        result = await _call(client.get_document_text_detection, JobId=job_id, MaxResults=1000)
+        if result['JobStatus'] in ['SUCCEEDED', 'FAILED', 'PARTIAL_SUCCESS']:
+            return result
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Textract job {job_id} did not finish within {timeout}s")
+        if _notifications_enabled():
+            # Wake on the completion message, re-checking the job now and then regardless
+            await _wait_for_notification(job_id, min(TEXTRACT_NOTIFICATION_CHECK, deadline - time.monotonic()))
+            continue
+        await asyncio.sleep(delay)
+        delay = min(delay * TEXTRACT_POLL_FACTOR, TEXTRACT_POLL_MAX)
+
+async def iter_text_pages(job_id, client=None, first_result=None):
+    """
+    Async generator of (page_number, lines) for a finished Textract job.
+    Follows NextToken pagination and yields each page as soon as it is complete.
+    """
+    client = client or get_textract_client()
+    result = first_result
+    if result is None:
+        result = await _call(client.get_document_text_detection, JobId=job_id, MaxResults=1000)
+
+    page, lines = None, []
     while True:
-        result = textract.get_document_text_detection(JobId=job_id)
-        status = result['JobStatus']
-        if status in ['SUCCEEDED', 'FAILED']:
+        for block in result.get('Blocks', []):
+            if block['BlockType'] != 'LINE':
+                continue
+            block_page = block.get('Page', 1)
+            if page is not None and block_page != page and lines:
+                yield page, lines
+                lines = []
+            page = block_page
+            lines.append(block['Text'])
+        next_token = result.get('NextToken')
+        if not next_token:
             break
-        time.sleep(2)  # Wait before polling again
-
-    if status == 'SUCCEEDED':
-        # 3. Extract text from all pages
-        text = ""
-        next_token = None
-        while True:
-            if next_token:
-                result = textract.get_document_text_detection(JobId=job_id, NextToken=next_token)
-            for block in result['Blocks']:
-                if block['BlockType'] == 'LINE':
-                    text += block['Text'] + '\n'
-            next_token = result.get('NextToken')
-            if not next_token:
-                break
+        result = await _call(client.get_document_text_detection, JobId=job_id, MaxResults=1000, NextToken=next_token)
+
+    if lines:
+        yield page, lines
+
+async def extract_text_from_s3_async(bucket, key, client=None):
+    """Extract text from a document in S3 using AWS Textract (asyncio driver)"""
+    client = client or get_textract_client()
+    # Blocking acquire is fine here: each extraction runs its own event loop on a worker thread
+    with resource_slot("textract"):
+        job_id = await start_text_detection(bucket, key, client)
+        result = await wait_for_text_detection(job_id, client)
+
+        if result['JobStatus'] == 'FAILED':
+            return "Textract job failed"
+
+        page_texts = []
+        async for _, lines in iter_text_pages(job_id, client, first_result=result):
+            page_texts.append('\n'.join(lines))
+    text = '\n'.join(page_texts)
+    return text.strip() or "(No text found in document)"
+
+def extract_text_from_s3(bucket, key):
+    """Extract text from image files using AWS Textract"""
+    return asyncio.run(extract_text_from_s3_async(bucket, key))
+
+def sniff_mime_type(head, key=""):
+    """Guess a document's MIME type from its first bytes (falling back to the file extension)"""
+    if head.startswith(b'%PDF'):
+        return "application/pdf"
+    if head.startswith(b'\x89PNG'):
+        return "image/png"
+    if head.startswith(b'\xff\xd8\xff'):
+        return "image/jpeg"
+    if head.startswith(b'II*\x00') or head.startswith(b'MM\x00*'):
+        return "image/tiff"
+    if head.startswith(b'PK') and key.lower().endswith('.docx'):
+        return "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    return "application/octet-stream"
+
+def _read_s3_head(bucket, key, size=8):
+    """First bytes of an S3 object, fetched with a ranged GET"""
+    try:
+        response = get_s3_client().get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{size - 1}")
+    except ClientError as e:
+        # Empty objects have no satisfiable range
+        if e.response.get("Error", {}).get("Code") == "InvalidRange":
+            return b""
+        raise
+    return response['Body'].read()
+
+def _spool_s3_object(bucket, key):
+    """Stream an S3 object into a spooled temp file (memory first, disk for large files)"""
+    response = get_s3_client().get_object(Bucket=bucket, Key=key)
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    for chunk in response['Body'].iter_chunks(chunk_size=1024 * 1024):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+def _split_pdf_pages(fileobj):
+    """Read the text layer of each page. Returns (local page texts, 1-based scanned page numbers)."""
+    page_texts = {}
+    scanned_pages = []
+    with pdfplumber.open(fileobj) as pdf:
+        for number, page in enumerate(pdf.pages, start=1):
+            page_text = (page.extract_text() or "").strip()
+            if len(page_text) >= PDF_TEXT_MIN_CHARS:
+                page_texts[number] = page_text
+            else:
+                scanned_pages.append(number)
+    return page_texts, scanned_pages
+
+def _stage_pdf_pages(bucket, fileobj, page_numbers):
+    """Upload the given pages of a PDF as a smaller PDF under OCR_STAGING_PREFIX; returns its key"""
+    fileobj.seek(0)
+    reader = PdfReader(fileobj)
+    writer = PdfWriter()
+    for number in page_numbers:
+        writer.add_page(reader.pages[number - 1])
+    staged = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    writer.write(staged)
+    staged.seek(0)
+    ocr_key = f"{OCR_STAGING_PREFIX}{uuid.uuid4()}.pdf"
+    get_s3_client().upload_fileobj(staged, bucket, ocr_key)
+    return ocr_key
+
+async def _ocr_pdf_pages(bucket, key, fileobj, scanned_pages, total_pages):
+    """Run Textract on the given pages of a PDF and return {original page number: text}"""
+    # Every page needs OCR (or the pages cannot be split out): send the original object as-is
+    ocr_key, page_map = key, {n: n for n in scanned_pages}
+    if len(scanned_pages) < total_pages:
+        try:
+            ocr_key = _stage_pdf_pages(bucket, fileobj, scanned_pages)
+            page_map = {i: n for i, n in enumerate(scanned_pages, start=1)}
+        except Exception as e:
+            print(f"[extract_text] Could not stage the scanned pages of {key}, sending the whole document: {e}")
+
+    try:
+        client = get_textract_client()
+        with resource_slot("textract"):
+            job_id = await start_text_detection(bucket, ocr_key, client)
+            result = await wait_for_text_detection(job_id, client)
+            if result['JobStatus'] == 'FAILED':
+                print(f"[extract_text] Textract failed for scanned pages of {key}")
+                return {}
+            ocr_texts = {}
+            async for page, lines in iter_text_pages(job_id, client, first_result=result):
+                # Pages outside page_map already have a text layer
+                if page in page_map:
+                    ocr_texts[page_map[page]] = '\n'.join(lines)
+        return ocr_texts
+    finally:
+        if ocr_key != key:
+            get_s3_client().delete_object(Bucket=bucket, Key=ocr_key)
+
+async def extract_text_from_s3_object_async(bucket, key):
+    """
+    Extract text from an S3 document, routing each page to the cheapest extractor:
+    born-digital PDF pages are read locally with pdfplumber, and only scanned
+    pages and images go through Textract. Page order is preserved.
+    """
+    if sniff_mime_type(_read_s3_head(bucket, key), key) != "application/pdf":
+        # Images (and anything else Textract accepts) go straight to OCR without being downloaded
+        return await extract_text_from_s3_async(bucket, key)
+
+    spool = _spool_s3_object(bucket, key)
+    try:
+        try:
+            page_texts, scanned_pages = _split_pdf_pages(spool)
+        except Exception as e:
+            # Damaged PDFs (e.g. "No /Root object!") are often still readable by Textract
+            print(f"[extract_text] Could not parse {key} locally, sending the whole document to Textract: {e}")
+            return await extract_text_from_s3_async(bucket, key)
+        total_pages = len(page_texts) + len(scanned_pages)
+        print(f"[extract_text] {key}: {len(page_texts)} text pages, {len(scanned_pages)} scanned pages")
+        if scanned_pages:
+            page_texts.update(await _ocr_pdf_pages(bucket, key, spool, scanned_pages, total_pages))
+
+        text = '\n'.join(page_texts[number] for number in sorted(page_texts) if page_texts[number])
         return text.strip() or "(No text found in document)"
-    else:
-        return "Textract job failed"
+    finally:
+        spool.close()
+
+def extract_text_from_s3_object(bucket, key):
+    """Extract text from a document in S3 (pdfplumber for text pages, Textract for the rest)"""
+    return asyncio.run(extract_text_from_s3_object_async(bucket, key))
 
 def extract_text_from_pdf(file_path):
     """Extract text from PDF files using pdfplumber"""
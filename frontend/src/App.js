@@ -959,10 +959,10 @@ function App() {
     fetchReprocessableFiles();
   }, [authToken, refreshResults]);
 
-  // Poll for job outputs and update chat live
+  // Refresh job outputs whenever the job changes and update chat live
   useEffect(() => {
     if (!jobId) return;
-    let interval;
+    let cancelled = false;
     const fetchOutputs = async () => {
       try {
         const res = await fetch(`http://localhost:8000/job_outputs/${jobId}`, {
@@ -1018,8 +1018,9 @@ function App() {
       }
     };
     fetchOutputs();
-    interval = setInterval(fetchOutputs, 2000);
-    return () => clearInterval(interval);
+    watchJob(jobId, () => { if (!cancelled) fetchOutputs(); }, () => cancelled)
+      .catch((error) => console.error("Error watching job outputs:", error));
+    return () => { cancelled = true; };
     // eslint-disable-next-line
   }, [jobId, shownOutputs, chatHistory]);
 
@@ -1103,25 +1104,39 @@ function App() {
   //   setLoading(false);
   // };
 
-  const pollStatus = (jobId) => {
-    const interval = setInterval(async () => {
-      const res = await fetch(`http://localhost:8000/status/${jobId}`);
+  // Long-poll job status: each request returns as soon as the job changes (or after 30s)
+  const watchJob = async (jobId, onStatus, shouldStop = () => false) => {
+    let since = -1;
+    while (!shouldStop()) {
+      const res = await fetch(`http://localhost:8000/status/${jobId}?wait=30&since=${since}`, {
+        headers: getAuthHeaders()
+      });
+      if (!res.ok) throw new Error(`Status request failed: ${res.status}`);
       const data = await res.json();
-      console.log("Status response:", data); // Debug log
-      setStatus(data.status);
+      since = data.version;
+      onStatus(data);
+      if (data.status === "completed" || data.status === "failed") return data;
+    }
+  };
+
+  const pollStatus = async (jobId) => {
+    try {
+      const data = await watchJob(jobId, (update) => {
+        console.log("Status response:", update); // Debug log
+        setStatus(update.status);
+      });
+      setLoading(false);
       if (data.status === "completed") {
-        clearInterval(interval);
-        setLoading(false);
         // await fetchAndShowOutputs(jobId, true); // This line is removed
         setShowChat(true);
-      }
-      if (data.status === "failed") {
-        clearInterval(interval);
+      } else {
         setShowChat(false);
-        setLoading(false);
         setChatHistory([{ role: "system", content: "Processing failed. Please try another file." }]);
       }
-    }, 2000);
+    } catch (error) {
+      console.error("Error polling status:", error);
+      setLoading(false);
+    }
   };
 
   // Handle single file reprocessing
@@ -1192,31 +1207,21 @@ function App() {
     }
   };
 
-  // Poll for reprocessing status
-  const pollReprocessingStatus = (jobId, s3Key) => {
-    const interval = setInterval(async () => {
-      try {
-        const res = await fetch(`http://localhost:8000/status/${jobId}`, {
-          headers: getAuthHeaders()
-        });
-        const data = await res.json();
-        
-        if (data.status === "completed" || data.status === "failed") {
-          clearInterval(interval);
-          // Remove from reprocessing jobs
-          setReprocessingJobs(prev => {
-            const newJobs = { ...prev };
-            delete newJobs[s3Key];
-            return newJobs;
-          });
-          // Refresh results to show updated outputs
-          setRefreshResults(r => !r);
-        }
-      } catch (error) {
-        console.error("Error polling reprocessing status:", error);
-        clearInterval(interval);
-      }
-    }, 2000);
+  // Wait for a reprocessing job to finish (long-polls /status instead of polling every 2s)
+  const pollReprocessingStatus = async (jobId, s3Key) => {
+    try {
+      await watchJob(jobId, () => {});
+      // Remove from reprocessing jobs
+      setReprocessingJobs(prev => {
+        const newJobs = { ...prev };
+        delete newJobs[s3Key];
+        return newJobs;
+      });
+      // Refresh results to show updated outputs
+      setRefreshResults(r => !r);
+    } catch (error) {
+      console.error("Error polling reprocessing status:", error);
+    }
   };
 
   const handleSend = async () => {